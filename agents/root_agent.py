@@ -5,12 +5,14 @@ Simple AI Agent using Google ADK
 """
 
 import asyncio
-import json
+import functools
 import logging
 import os
 import random
+import threading
 import uuid
 import warnings
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
@@ -24,7 +26,9 @@ from google.adk.tools import agent_tool, google_search
 from google.adk.tools.mcp_tool.mcp_toolset import MCPToolset
 from google.genai import types
 
-from tools.user_memory_mcp_server import MemoryTag
+from tools.user_memory_mcp_server import MemoryTag, memory_shard_file
+from tools.user_schedule_mcp_server import ScheduleManager
+from tools.utils.change_feed import MemoryView
 from tools.utils.mcp_connect import MCPConnector
 
 load_dotenv()
@@ -44,11 +48,47 @@ USER_ID = "test_user"
 # メモリファイルパス
 USER_MEMORY_FILE = os.environ.get("USER_MEMORY_FILE", "memory/user_memory.json")
 
+# メモリの保存方式（MCPサーバーと同じ値にする）
+USER_MEMORY_STORAGE = os.environ.get("USER_MEMORY_STORAGE", "json")
+
 # スケジュールファイルパス
 USER_SCHEDULE_FILE = os.environ.get("USER_SCHEDULE_FILE", "memory/user_schedule.json")
 
+# スケジュールの保存方式（MCPサーバーと同じ値にする）
+USER_SCHEDULE_STORAGE = os.environ.get("USER_SCHEDULE_STORAGE", "json")
+
+# メモリに常駐させるメモリの写し（ユーザ）の最大数（MCPサーバーのシャードと同じ値を使う）
+USER_MEMORY_MAX_RESIDENT_SHARDS = int(os.environ.get("USER_MEMORY_MAX_RESIDENT_SHARDS", "64"))
+
+# ユーザごとのメモリの写し（モデルを呼ぶたびにメモリファイル全体を読み込まず、変更フィードで差分だけを取り込む）
+# 最も長く使われていないものから閉じて、常駐する数をUSER_MEMORY_MAX_RESIDENT_SHARDSまでにする
+memory_views: OrderedDict[Optional[str], MemoryView] = OrderedDict()
+memory_views_lock = threading.Lock()
+
+
+def get_memory_view(user_id: Optional[str] = None) -> MemoryView:
+  """ユーザのメモリの写しを取得（初めての場合は作成する）"""
+  with memory_views_lock:
+    view = memory_views.get(user_id)
+    if view is not None:
+      memory_views.move_to_end(user_id)
+      return view
+    view = memory_views[user_id] = MemoryView(memory_shard_file(USER_MEMORY_FILE, user_id), USER_MEMORY_STORAGE)
+    while len(memory_views) > USER_MEMORY_MAX_RESIDENT_SHARDS:
+      _, evicted = memory_views.popitem(last=False)
+      evicted.close()
+    return view
 
-def before_model_modifier(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+
+@functools.cache
+def get_schedule_reader() -> ScheduleManager:
+  """スケジュールの読み出しに使うマネージャー（書き込みはしない。他のプロセスが書き込んだ場合だけ読み込み直す）"""
+  return ScheduleManager(USER_SCHEDULE_FILE, USER_SCHEDULE_STORAGE)
+
+
+def before_model_modifier(
+  callback_context: CallbackContext, llm_request: LlmRequest, user_id: Optional[str] = None
+) -> Optional[LlmResponse]:
   """Inspects/modifies the LLM request or skips the call."""
   # これでシステムプロンプトを見ることができる
   # print(llm_request.config.system_instruction)
@@ -60,19 +100,15 @@ def before_model_modifier(callback_context: CallbackContext, llm_request: LlmReq
     new_instruction = f"{original_instruction}\n\n# 現在時刻\n{current_time}\n"
     llm_request.config.system_instruction = new_instruction
 
-    # スケジュールを読み出してプロンプトに追加する
-    with open(USER_SCHEDULE_FILE, "r", encoding="utf-8") as f:
-      schedules = json.load(f)
+    # スケジュールを読み出してプロンプトに追加する（保存方式によらずマネージャー経由で読む）
     now = datetime.now(timezone(timedelta(hours=9))).strftime("%Y%m%d")
-    schedules = [schedule for schedule in schedules.values() if schedule["deadline"][:8] >= now]
+    schedules = [schedule for schedule in get_schedule_reader().get_all_schedules() if schedule.deadline[:8] >= now]
     schedule_instruction = ""
     for schedule in schedules:
-      schedule_instruction += f"{schedule['deadline']}: {schedule['content']}\n"
-    
-    # 記憶を読み出してプロンプトに追加する
-    with open(USER_MEMORY_FILE, "r", encoding="utf-8") as f:
-      memories = json.load(f)
-    memories = [memory for memory in memories.values()]
+      schedule_instruction += f"{schedule.deadline}: {schedule.content}\n"
+
+    # 記憶を読み出してプロンプトに追加する（ユーザのメモリがまだない場合は空）
+    memories = [memory for memory in get_memory_view(user_id).entries().values()]
     # パーソナルな情報を抽出
     personal_information = [memory for memory in memories if MemoryTag.PERSONAL_INFORMATION.value in memory["tags"]]
     # AIへの指示を抽出
@@ -143,20 +179,12 @@ system_instruction = """
 # メモリ使用ガイドライン
 会話の連続性やコンテキスト保持を向上させるために、メモリツールを最大限に活用してください。
 
-## メモリのタグ一覧
-- **get_memory_tag_list**: メモリのタグ一覧を取得する。
-- メモリを保存したり、更新する際はまずタグ一覧を取得して適切なタグを指定すること。
-
-## メモリの優先度一覧
-- **get_memory_priority_list**: メモリの優先度一覧を取得する。
-- メモリを保存したり、更新する際はまず優先度一覧を取得して適切な優先度を指定すること。
+## メモリのタグと優先度
+- 選択できるタグと優先度はツールの引数の定義に書かれているので、一覧を取得するツールを呼ぶ必要はない。
 
 ## メモリを保存するためのツール
-- **add_memory**: 重要な会話のやり取り、重要な意思決定、ユーザーの好みなど今後の会話で覚えておく価値のあるコンテキストを保存する。
-- メモリを保存する際は、以下の手順で行うこと。
-  - get_memory_tag_listを使ってタグ一覧を取得し適切なタグを選択
-  - get_memory_priority_listを使って優先度一覧を取得し適切な優先度を選択
-  - add_memoryを使ってメモリを保存する
+- **add_memories**: 重要な会話のやり取り、重要な意思決定、ユーザーの好みなど今後の会話で覚えておく価値のあるコンテキストを保存する。
+- 保存したいことが複数ある場合も、add_memoriesを1回だけ呼んでまとめて保存すること（1件だけの場合はadd_memoryでもよい）。
 - ユーザはパーソナライズされたコミュニケーションを望んでいるので、積極的にこのツールを使うこと。
 - 具体的にはユーザの趣味、個人情報、性格、習慣、学習、目標、人間関係、趣向、あなたへの指示などです。
 - 一時的な情報よりも、長期的に意味のある情報に焦点を当てること。
@@ -167,16 +195,18 @@ system_instruction = """
 - ユーザはパーソナライズされたコミュニケーションを望んでいるので、積極的にこのツールを使うこと。
 
 ## メモリを更新するためのツール
-- **update_memory**: 過去のメモリに対して、新しい重要情報をと統合し、メモリの内容を再構築する。
-- このツールを使う場合、まずはsearch_memoriesを使って関連メモリのkeyを取得し、そのkeyを使ってupdate_memoryを呼び出すこと。
+- **update_memories**: 過去のメモリに対して、新しい重要情報をと統合し、メモリの内容を再構築する。
+- このツールを使う場合、まずはsearch_memories（複数の話題はsearch_memories_batch）を使って関連メモリのkeyを取得し、そのkeyを使ってupdate_memoriesを呼び出すこと。
+- 複数のメモリを更新する場合もupdate_memoriesを1回だけ呼んでまとめて更新すること。
 - 進行中のプロジェクトや関係に意味のある進展があったときに更新する
 - 関連情報を統合して、時間を通じて一貫したコンテキストを維持する
 
 ## メモリを削除するためのツール
-- **delete_memory**: 不要なメモリを削除する。
+- **delete_memories**: 不要なメモリを削除する。複数のメモリを削除する場合も1回の呼び出しでまとめて削除すること。
 - 背反する指示が含まれている場合、優先度が低いメモリを削除すること。
-- しばらく参照されていない情報がある場合、メモリを削除すること。
-- このツールを使う場合、まずはsearch_memoriesを使って関連メモリのkeyを取得し、そのkeyを使ってdelete_memoryを呼び出すこと。
+- しばらく参照されていない情報がある場合、メモリを削除すること。しばらく参照されていないメモリはget_all_memoriesをorder_by="least_useful"で呼ぶと先頭に並ぶ。
+- このツールを使う場合、まずはsearch_memoriesを使って関連メモリのkeyを取得し、そのkeyを使ってdelete_memoriesを呼び出すこと。
+- 同じ内容のメモリが言い回しを変えて複数保存されている場合は、**deduplicate_memories**をapply=Falseで呼んでまとめ方を確認し、問題なければapply=Trueで呼んでまとめること。
 
 これらのツールは、会話の連続性を構築し、よりパーソナライズされた支援を提供するために使用してください。
 エラー防止や意図推測のための仕組みではありません。
@@ -184,15 +214,11 @@ system_instruction = """
 # ユーザスケジュール管理ガイドライン
 ユーザのスケジュールを把握し、適切なリマインド、フォローアップを行うために、スケジュールツールを最大限に活用してください。
 
-## スケジュールの優先度一覧
-- **get_schedule_priority_list**: スケジュールの優先度一覧を取得する。
-- スケジュールを保存したり、更新する際はまず優先度一覧を取得して適切な優先度を指定すること。
+## スケジュールの優先度
+- 選択できる優先度はツールの引数の定義に書かれているので、一覧を取得するツールを呼ぶ必要はない。
 
 ## スケジュールを保存するためのツール
 - **add_schedule**: ユーザの将来的なスケジュールを保存する。
-- スケジュールを保存する際は、以下の手順で行うこと。
-  - get_schedule_priority_listを使って優先度一覧を取得し適切な優先度を選択
-  - add_scheduleを使ってスケジュールを保存する
 - ユーザがスケジュールを忘れないようにあなたが適切にスケジュールを管理すること。
 
 ## スケジュールを検索するためのツール
@@ -249,7 +275,7 @@ class SimpleAIAgent:
 
     try:
       # MCPツール(stdio)を取得
-      self.mcp_names, self.mcp_tools = self.mcp_connector.get_stdio_tools()
+      self.mcp_names, self.mcp_tools = self.mcp_connector.get_stdio_tools(self.user_id)
       self.mcp_tools.append(agent_tool.AgentTool(agent=search_agent))
 
       print("--------------------------------")
@@ -273,7 +299,7 @@ class SimpleAIAgent:
         instruction=system_instruction,
         model=MODEL_NAME,
         tools=self.mcp_tools,
-        before_model_callback=before_model_modifier,
+        before_model_callback=functools.partial(before_model_modifier, user_id=self.user_id),
       )
 
       # ランナーを作成
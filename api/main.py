@@ -5,7 +5,7 @@ Google ADK AIエージェントをHTTP APIとして公開するサーバー
 """
 
 import asyncio
-import json
+import functools
 import logging
 import os
 import sys
@@ -28,6 +28,9 @@ from pydantic import BaseModel, Field
 
 # パス設定後にインポート
 from agents.root_agent import SimpleAIAgent
+from tools.user_memory_mcp_server import memory_shard_file
+from tools.user_schedule_mcp_server import ScheduleManager
+from tools.utils.memory_stats import read_memory_stats
 
 load_dotenv()
 
@@ -43,9 +46,21 @@ DEFAULT_USER_ID = "default_user"
 # メモリファイルパス
 USER_MEMORY_FILE = os.environ.get("USER_MEMORY_FILE", "memory/user_memory.json")
 
+# メモリの保存方式（MCPサーバーと同じ値にする）
+USER_MEMORY_STORAGE = os.environ.get("USER_MEMORY_STORAGE", "json")
+
 # スケジュールファイルパス
 USER_SCHEDULE_FILE = os.environ.get("USER_SCHEDULE_FILE", "memory/user_schedule.json")
 
+# スケジュールの保存方式（MCPサーバーと同じ値にする）
+USER_SCHEDULE_STORAGE = os.environ.get("USER_SCHEDULE_STORAGE", "json")
+
+
+@functools.cache
+def get_schedule_reader() -> ScheduleManager:
+  """スケジュールの読み出しに使うマネージャー（書き込みはしない。他のプロセスが書き込んだ場合だけ読み込み直す）"""
+  return ScheduleManager(USER_SCHEDULE_FILE, USER_SCHEDULE_STORAGE)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -116,83 +131,22 @@ class ScheduleResponse(BaseModel):
   message: Optional[str] = Field(None, description="エラーメッセージ")
 
 
-def get_memory_stats_from_file() -> Optional[Dict[str, Any]]:
-  """メモリファイルから直接統計情報を取得"""
+def get_memory_stats_from_file(user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+  """ユーザのメモリファイルの統計情報を取得（MCPサーバーが変更のたびに保存している統計情報を使う）"""
   try:
     # メモリファイルのパスを構築
-    memory_file_path = os.path.join(project_root, USER_MEMORY_FILE)
+    memory_file_path = memory_shard_file(os.path.join(project_root, USER_MEMORY_FILE), user_id)
 
     logger.info(f"📊 メモリファイルから統計情報を取得中: {memory_file_path}")
 
-    # ファイルが存在するかチェック
-    if not os.path.exists(memory_file_path):
+    stats = read_memory_stats(memory_file_path, USER_MEMORY_STORAGE)
+    if stats is None:
       logger.warning(f"⚠️ メモリファイルが存在しません: {memory_file_path}")
       return None
 
-    # メモリファイルを読み込み
-    with open(memory_file_path, "r", encoding="utf-8") as f:
-      memories: Any = json.load(f)
-
-    # 統計情報を計算
-    total_memories = len(memories)
-
-    if total_memories == 0:
-      logger.info("📊 メモリファイルは空です")
-      return {
-        "total_memories": 0,
-        "key_range": {"earliest": None, "latest": None},
-        "tag_counts": {},
-        "most_used_tags": [],
-        "latest_memory_contents": [],
-      }
-
-    # タグの使用頻度をカウント
-    tag_counts: Dict[str, int] = {}
-    created_at_list: list[str] = []
-
-    for memory in memories.values():
-      # タグのカウント
-      tags = memory.get("tags", [])
-      if isinstance(tags, list):
-        for tag in tags:
-          if isinstance(tag, str):
-            tag_counts[tag] = tag_counts.get(tag, 0) + 1
-      created_at = memory.get("created_at", "")
-      if isinstance(created_at, str):
-        created_at_list.append(created_at)
-
-    if created_at_list:
-      created_at_list.sort()
-      key_range: Dict[str, Optional[str]] = {"earliest": created_at_list[0], "latest": created_at_list[-1]}
-    else:
-      key_range: Dict[str, Optional[str]] = {"earliest": None, "latest": None}
-
-    # 最も使用されているタグ（上位5位）
-    most_used_tags: list = sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-
-    # 最新のメモリ内容
-    latest_memory_contents: list[str] = []
-    for memory in memories.values():
-      latest_memory_contents.append(memory.get("content", ""))
-    latest_memory_contents = latest_memory_contents[:10]
-
-    stats = {
-      "total_memories": total_memories,
-      "key_range": key_range,
-      "tag_counts": tag_counts,
-      "most_used_tags": most_used_tags,
-      "latest_memory_contents": latest_memory_contents,
-    }
-
-    logger.info(f"✅ メモリファイルから統計情報を正常に取得しました: {total_memories}件")
+    logger.info(f"✅ メモリファイルから統計情報を正常に取得しました: {stats['total_memories']}件")
     return stats
 
-  except FileNotFoundError:
-    logger.error(f"❌ メモリファイルが見つかりません: {USER_MEMORY_FILE}")
-    return None
-  except json.JSONDecodeError as e:
-    logger.error(f"❌ メモリファイルのJSON形式が不正です: {e}")
-    return None
   except Exception as e:
     traceback.print_exc()
     logger.error(f"❌ メモリファイルの読み込み中にエラーが発生: {e}")
@@ -246,11 +200,11 @@ async def chat(request: ChatRequest):
 
 
 @app.get("/api/memory/stats", response_model=MemoryStatsResponse)
-async def get_memory_stats():
+async def get_memory_stats(user_id: str = DEFAULT_USER_ID):
   """メモリ統計エンドポイント"""
   try:
     # MCPサーバーからメモリ統計を取得
-    stats = get_memory_stats_from_file()
+    stats = get_memory_stats_from_file(user_id)
 
     if stats:
       # MCPサーバーから取得したデータを使用
@@ -271,6 +225,7 @@ async def get_memory_stats():
           "preference": 0,
           "instruction_for_ai": 0,
         },
+        "priority_counts": {},
         "most_used_tags": [],
         "latest_memory_contents": [],
       }
@@ -316,30 +271,22 @@ async def list_sessions():
 async def get_schedules():
   """スケジュール一覧エンドポイント"""
   try:
-    # USER_SCHEDULE_FILEから実際のデータを読み込み
-    try:
-      with open(USER_SCHEDULE_FILE, "r", encoding="utf-8") as f:
-        schedule_data = json.load(f)
-
-      schedules = []
-      for schedule_entry in schedule_data.values():
-        # YYYYMMDDHHMM形式からYYYY-MM-DD形式に変換
-        deadline_str = schedule_entry["deadline"]
-        formatted_deadline = f"{deadline_str[:4]}-{deadline_str[4:6]}-{deadline_str[6:8]}"
-
-        schedules.append(
-          Schedule(deadline=formatted_deadline, content=schedule_entry["content"], priority=schedule_entry["priority"])
-        )
-
-      logger.info(f"📅 スケジュールデータを読み込みました: {len(schedules)}件")
-      return ScheduleResponse(success=True, schedules=schedules, message=None)
-
-    except FileNotFoundError:
-      logger.warning("📅 スケジュールファイルが見つかりません。空のリストを返します")
-      return ScheduleResponse(success=True, schedules=[], message=None)
-    except json.JSONDecodeError:
-      logger.warning("📅 スケジュールファイルの形式が不正です。空のリストを返します")
-      return ScheduleResponse(success=True, schedules=[], message=None)
+    # 保存方式（USER_SCHEDULE_STORAGE）によらずマネージャー経由で読み込む
+    # （ファイルがない場合や形式が不正な場合は空になる）
+    schedule_entries = await asyncio.to_thread(get_schedule_reader().get_all_schedules)
+
+    schedules = []
+    for schedule_entry in schedule_entries:
+      # YYYYMMDDHHMM形式からYYYY-MM-DD形式に変換
+      deadline_str = schedule_entry.deadline
+      formatted_deadline = f"{deadline_str[:4]}-{deadline_str[4:6]}-{deadline_str[6:8]}"
+
+      schedules.append(
+        Schedule(deadline=formatted_deadline, content=schedule_entry.content, priority=schedule_entry.priority)
+      )
+
+    logger.info(f"📅 スケジュールデータを読み込みました: {len(schedules)}件")
+    return ScheduleResponse(success=True, schedules=schedules, message=None)
 
   except Exception as e:
     logger.error(f"❌ スケジュール取得中にエラーが発生: {e}")
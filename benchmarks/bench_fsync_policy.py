@@ -0,0 +1,87 @@
+"""
+fsyncの方針（always / group / none）ごとの書き込みスループットのベンチマーク
+
+保存方式ごとに、既存のメモリを1件ずつ更新し続けたときの1秒あたりの書き込み回数を比較する。
+スケジュールは追加し続けたときの回数を計測する。
+
+  PYTHONPATH=. uv run benchmarks/bench_fsync_policy.py
+"""
+
+import os
+import tempfile
+import time
+from pathlib import Path
+
+# ベンチマーク中にカレントディレクトリのメモリファイルを触らないようにする
+os.environ.setdefault("USER_MEMORY_FILE", os.path.join(tempfile.mkdtemp(), "user_memory.json"))
+os.environ.setdefault("USER_SCHEDULE_FILE", os.path.join(tempfile.mkdtemp(), "user_schedule.json"))
+
+from benchmarks.bench_memory_search import make_contents
+from tools.user_memory_mcp_server import MemoryManager
+from tools.user_schedule_mcp_server import ScheduleManager
+from tools.utils.durability import FSYNC_POLICIES, Durability
+from tools.utils.memory_storage import write_json_snapshot
+
+# 既存のメモリ・スケジュールの件数（json・binaryは書き込みごとに全体を書き直すため、件数が多いほど遅い）
+SIZE = 1_000
+WRITES = 200
+MEMORY_STORAGES = ["json", "journal", "binary", "sqlite"]
+SCHEDULE_STORAGES = ["json", "binary"]
+
+
+def write_memories(memory_file: Path) -> list[str]:
+  memories = {
+    key: {
+      "tags": ["hobby"],
+      "content": content,
+      "priority": "mid",
+      "created_at": "20250101000000",
+      "updated_at": "20250101000000",
+      "reference_count": 0,
+    }
+    for key, content in make_contents(SIZE).items()
+  }
+  write_json_snapshot(memory_file, memories, Durability("none"))
+  return list(memories)
+
+
+def bench_memory(storage_type: str, policy: str) -> float:
+  memory_file = Path(tempfile.mkdtemp()) / "user_memory.json"
+  keys = write_memories(memory_file)
+  manager = MemoryManager(str(memory_file), storage_type=storage_type, fsync_policy=policy)
+  start = time.perf_counter()
+  for i in range(WRITES):
+    manager.update_memory(keys[i % len(keys)], f"更新したメモリ {i}")
+  elapsed = time.perf_counter() - start
+  # groupで残っている同期はcloseで行われる（スループットには含めない）
+  manager.close()
+  return WRITES / elapsed
+
+
+def bench_schedule(storage_type: str, policy: str) -> float:
+  schedule_file = Path(tempfile.mkdtemp()) / "user_schedule.json"
+  manager = ScheduleManager(str(schedule_file), storage_type=storage_type, fsync_policy="none")
+  for i in range(SIZE):
+    manager.add_schedule("202601011200", f"スケジュール {i}", "mid")
+  manager.durability = Durability(policy)
+  start = time.perf_counter()
+  for i in range(WRITES):
+    manager.add_schedule("202601011200", f"追加したスケジュール {i}", "mid")
+  elapsed = time.perf_counter() - start
+  manager.close()
+  return WRITES / elapsed
+
+
+def main():
+  print(f"{SIZE} entries, {WRITES} writes (writes/s)")
+  print(f"{'store':<18}" + "".join(f"{policy:>10}" for policy in FSYNC_POLICIES))
+  for storage_type in MEMORY_STORAGES:
+    rates = [bench_memory(storage_type, policy) for policy in FSYNC_POLICIES]
+    print(f"{'memory/' + storage_type:<18}" + "".join(f"{rate:>10.0f}" for rate in rates))
+  for storage_type in SCHEDULE_STORAGES:
+    rates = [bench_schedule(storage_type, policy) for policy in FSYNC_POLICIES]
+    print(f"{'schedule/' + storage_type:<18}" + "".join(f"{rate:>10.0f}" for rate in rates))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,120 @@
+"""
+重複したメモリの検出のベンチマーク
+
+全メモリ同士をprocess.cdistで比較する方式と、長さの順に並べて類似度がしきい値に届きうる範囲とだけ比較する方式
+（memory_dedup.all_similar_pairs）で、全体のパスの時間と見つけた重複の組の数を比較する。
+あわせて、メモリを1件追加したときの重複のチェック（n-gramインデックスの候補との比較のみ）の時間も測る。
+
+  PYTHONPATH=. uv run benchmarks/bench_memory_dedup.py
+"""
+
+import os
+import random
+import tempfile
+import time
+
+# ベンチマーク中にカレントディレクトリのメモリファイルを触らないようにする
+os.environ.setdefault("USER_MEMORY_FILE", os.path.join(tempfile.mkdtemp(), "user_memory.json"))
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from tools.utils.memory_dedup import DEDUP_THRESHOLD, all_similar_pairs, similar_pairs
+from tools.utils.memory_index import FuzzyChoices, NgramIndex
+
+WORDS = [
+  "ギター",
+  "練習",
+  "毎朝",
+  "散歩",
+  "コーヒー",
+  "Python",
+  "機械学習",
+  "読書",
+  "映画",
+  "旅行",
+  "ランニング",
+  "料理",
+  "スペイン語",
+  "ピアノ",
+  "瞑想",
+  "日記",
+  "週末",
+  "家族",
+  "仕事",
+  "目標",
+]
+# 全メモリ同士の比較は件数の2乗に比例するので10,000件までにする
+SIZES = [1_000, 10_000]
+# 言い換えて保存し直したメモリの割合
+DUPLICATE_RATE = 0.05
+
+
+def make_contents(n: int) -> dict[str, str]:
+  """ランダムな文章と、その一部を少しだけ変えた重複を作る"""
+  rng = random.Random(0)
+  contents: list[str] = []
+  for _ in range(n):
+    if contents and rng.random() < DUPLICATE_RATE:
+      contents.append(rng.choice(contents) + "。")
+    else:
+      contents.append("".join(rng.choices(WORDS, k=rng.randint(8, 16))))
+  return {f"memory_{i:08d}": content for i, content in enumerate(contents)}
+
+
+def bench_full(choices: FuzzyChoices) -> tuple[float, int]:
+  """全メモリ同士をcdistで比較する"""
+  start = time.perf_counter()
+  pairs = 0
+  for begin in range(0, len(choices.choices), 1024):
+    matrix = process.cdist(
+      choices.choices[begin : begin + 1024],
+      choices.choices,
+      scorer=fuzz.ratio,
+      score_cutoff=DEDUP_THRESHOLD,
+      dtype=np.uint8,
+      workers=-1,
+    )
+    pairs += int(np.count_nonzero(matrix)) - len(matrix)
+  # 自分自身との組を除き、(a, b) と (b, a) を1組として数える
+  return time.perf_counter() - start, pairs // 2
+
+
+def bench_blocked(choices: FuzzyChoices) -> tuple[float, int]:
+  """長さの順に並べ、類似度がしきい値に届きうる範囲とだけ比較する"""
+  start = time.perf_counter()
+  pairs = all_similar_pairs(choices)
+  return time.perf_counter() - start, len(pairs)
+
+
+def bench_insert(choices: FuzzyChoices, ngram_index: NgramIndex, contents: dict[str, str]) -> float:
+  """1件追加したときの重複のチェック（100件の平均）"""
+  samples = list(contents.items())[:100]
+  start = time.perf_counter()
+  for key, content in samples:
+    similar_pairs(choices, ngram_index, [(key, content)])
+  return (time.perf_counter() - start) / len(samples)
+
+
+def main():
+  print(f"threshold {DEDUP_THRESHOLD}, {DUPLICATE_RATE:.0%} near-duplicates")
+  print(f"{'memories':>10} {'full (ms)':>11} {'pairs':>7} {'by length (ms)':>15} {'pairs':>7} {'insert (ms)':>12}")
+  for size in SIZES:
+    contents = make_contents(size)
+    choices = FuzzyChoices()
+    ngram_index = NgramIndex()
+    for key, content in contents.items():
+      choices.set(key, content)
+      ngram_index.add(key, content)
+
+    full, full_pairs = bench_full(choices)
+    blocked, blocked_pairs = bench_blocked(choices)
+    insert = bench_insert(choices, ngram_index, contents)
+    print(
+      f"{size:>10} {full * 1000:>11.1f} {full_pairs:>7} {blocked * 1000:>15.1f} {blocked_pairs:>7}"
+      f" {insert * 1000:>12.2f}"
+    )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,74 @@
+"""
+件数の上限に達したメモリの追い出しのベンチマーク
+
+上限に達した表にメモリを1件ずつ追加し、そのたびに1件追い出す。
+追い出すメモリを全メモリの走査（ordered_keys）で選ぶ方式と、表が維持するヒープ（eviction_candidates）から
+取り出す方式で、追加1件あたりの時間を比較する。
+
+  PYTHONPATH=. uv run benchmarks/bench_memory_eviction.py
+"""
+
+import os
+import random
+import tempfile
+import time
+
+# ベンチマーク中にカレントディレクトリのメモリファイルを触らないようにする
+os.environ.setdefault("USER_MEMORY_FILE", os.path.join(tempfile.mkdtemp(), "user_memory.json"))
+
+from tools.utils.memory_table import MemoryTable
+
+TAGS = ["hobby", "habit", "goal"]
+PRIORITIES = ["high", "mid", "low"]
+SIZES = [1_000, 10_000, 100_000]
+INSERTS = 500
+
+
+def make_table(n: int, eviction_policy: str | None) -> MemoryTable:
+  rng = random.Random(0)
+  table = MemoryTable(TAGS, PRIORITIES, eviction_policy=eviction_policy)
+  table.extend(
+    (
+      f"memory_{i:08d}",
+      {
+        "tags": [rng.choice(TAGS)],
+        "content": f"memory {i}",
+        "priority": rng.choice(PRIORITIES),
+        "created_at": "20240101000000",
+        "updated_at": f"2024{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}000000",
+        "reference_count": 0,
+      },
+    )
+    for i in range(n)
+  )
+  # 一部のメモリを参照しておく
+  for key in rng.sample(table.keys, n // 10):
+    table.add_reference(key, rng.randint(1, 5))
+  return table
+
+
+def bench(table: MemoryTable, use_heap: bool) -> float:
+  start = time.perf_counter()
+  for i in range(INSERTS):
+    key = f"new_{i:08d}"
+    table.put(key, ["goal"], "new memory", "mid", "20250101000000", "20250101000000")
+    protected = frozenset([key])
+    if use_heap:
+      evicted = table.eviction_candidates(1, protected)[0]
+    else:
+      evicted = next(k for k in table.ordered_keys("least_useful", 2) if k not in protected)
+    table.remove(evicted)
+  return (time.perf_counter() - start) / INSERTS
+
+
+def main():
+  print(f"policy least_useful, {INSERTS} inserts into a full table")
+  print(f"{'memories':>10} {'scan (ms)':>11} {'heap (ms)':>11} {'speedup':>9}")
+  for size in SIZES:
+    scan = bench(make_table(size, None), use_heap=False)
+    heap = bench(make_table(size, "least_useful"), use_heap=True)
+    print(f"{size:>10} {scan * 1000:>11.3f} {heap * 1000:>11.3f} {scan / heap:>8.1f}x")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,55 @@
+"""
+100k件のメモリを読み込んだMemoryManagerの常駐メモリ（RSS）のベンチマーク
+
+  PYTHONPATH=. uv run benchmarks/bench_memory_rss.py
+
+計測はLinuxの /proc/self/status のVmRSSで行い、読み込みごとに別プロセスを起動する。
+"""
+
+import gc
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# ベンチマーク中にカレントディレクトリのメモリファイルを触らないようにする
+os.environ.setdefault("USER_MEMORY_FILE", os.path.join(tempfile.mkdtemp(), "user_memory.json"))
+os.environ.setdefault("USER_SCHEDULE_FILE", os.path.join(tempfile.mkdtemp(), "user_schedule.json"))
+
+SIZE = 100_000
+
+
+def rss_mib() -> float:
+  with open("/proc/self/status", encoding="utf-8") as f:
+    for line in f:
+      if line.startswith("VmRSS:"):
+        return int(line.split()[1]) / 1024
+  raise RuntimeError("VmRSS is not available")
+
+
+def measure(memory_file: str) -> None:
+  from tools.user_memory_mcp_server import MemoryManager
+
+  gc.collect()
+  before = rss_mib()
+  manager = MemoryManager(memory_file)
+  gc.collect()
+  rss = rss_mib() - before
+  print(f"{manager.get_memory_stats()['total_memories']} memories: {rss:.1f} MiB")
+
+
+def main():
+  from benchmarks.bench_snapshot_load import write_stores
+
+  directory = Path(tempfile.mkdtemp())
+  write_stores(directory)
+  memory_file = str(directory / "user_memory.json")
+  subprocess.run([sys.executable, __file__, memory_file], check=True)
+
+
+if __name__ == "__main__":
+  if len(sys.argv) > 1:
+    measure(sys.argv[1])
+  else:
+    main()
@@ -0,0 +1,109 @@
+"""
+search_memoriesのスコア計算のベンチマーク
+
+従来の方式（クエリごとに{key: content}の辞書を作り直してprocess.extractを呼ぶ）と、
+前処理済みのリストに対してprocess.cdistでまとめて計算する方式、
+さらに文字n-gramのインデックスで候補を絞り込んでから計算する方式を比較する。
+
+  PYTHONPATH=. uv run benchmarks/bench_memory_search.py
+"""
+
+import os
+import random
+import tempfile
+import time
+
+# ベンチマーク中にカレントディレクトリのメモリファイルを触らないようにする
+os.environ.setdefault("USER_MEMORY_FILE", os.path.join(tempfile.mkdtemp(), "user_memory.json"))
+
+from rapidfuzz import fuzz, process
+
+from tools.utils.memory_index import FuzzyChoices, NgramIndex, top_k
+
+WORDS = [
+  "ギター",
+  "練習",
+  "毎朝",
+  "散歩",
+  "コーヒー",
+  "Python",
+  "機械学習",
+  "読書",
+  "映画",
+  "旅行",
+  "ランニング",
+  "料理",
+  "スペイン語",
+  "ピアノ",
+  "瞑想",
+  "日記",
+  "週末",
+  "家族",
+  "仕事",
+  "目標",
+]
+QUERIES = ["ギター練習", "朝の散歩", "Python 機械学習", "コーヒー", "週末の旅行", "ピアノ", "日記を書く", "料理"]
+SIZES = [1_000, 10_000, 100_000]
+SHORTLIST_SIZE = 200
+SCORE_CUTOFF = 20
+REPEAT = 3
+
+
+def make_contents(n: int) -> dict[str, str]:
+  rng = random.Random(0)
+  return {f"memory_{i:08d}": "".join(rng.choices(WORDS, k=rng.randint(3, 10))) for i in range(n)}
+
+
+def bench_extract(contents: dict[str, str]) -> float:
+  """従来の方式: クエリごとに辞書を作ってprocess.extract"""
+  start = time.perf_counter()
+  for query in QUERIES:
+    process.extract(query, {key: content for key, content in contents.items()}, limit=5, scorer=fuzz.partial_ratio)
+  return time.perf_counter() - start
+
+
+def extract(choices: FuzzyChoices, candidates: set[str] | None = None) -> list[list[tuple[str, float]]]:
+  """クエリごとにスコアの高い順で (キー, スコア) を返す"""
+  keys, matrix = choices.scores(QUERIES, candidates, SCORE_CUTOFF)
+  return [top_k(keys, row, 5, SCORE_CUTOFF) for row in matrix]
+
+
+def bench_cdist(choices: FuzzyChoices) -> float:
+  """新しい方式: 前処理済みのリストに対してcdistでまとめて計算"""
+  start = time.perf_counter()
+  extract(choices)
+  return time.perf_counter() - start
+
+
+def bench_ngram(choices: FuzzyChoices, ngram_index: NgramIndex) -> float:
+  """n-gramで候補を絞り込んでからcdistで計算"""
+  start = time.perf_counter()
+  candidates: set[str] = set()
+  for query in QUERIES:
+    candidates.update(ngram_index.shortlist(query, SHORTLIST_SIZE) or [])
+  extract(choices, candidates)
+  return time.perf_counter() - start
+
+
+def main():
+  print(f"{len(QUERIES)} queries per turn, best of {REPEAT}")
+  print(f"{'memories':>10} {'extract (ms)':>14} {'cdist (ms)':>12} {'speedup':>9} {'ngram (ms)':>12} {'speedup':>9}")
+  for size in SIZES:
+    contents = make_contents(size)
+    choices = FuzzyChoices()
+    ngram_index = NgramIndex()
+    for key, content in contents.items():
+      choices.set(key, content)
+      ngram_index.add(key, content)
+
+    baseline = min(bench_extract(contents) for _ in range(REPEAT))
+    batched = min(bench_cdist(choices) for _ in range(REPEAT))
+    shortlisted = min(bench_ngram(choices, ngram_index) for _ in range(REPEAT))
+    print(
+      f"{size:>10} {baseline * 1000:>14.1f} {batched * 1000:>12.1f} {baseline / batched:>8.1f}x"
+      f" {shortlisted * 1000:>12.1f} {baseline / shortlisted:>8.1f}x"
+    )
+
+
+if __name__ == "__main__":
+  main()
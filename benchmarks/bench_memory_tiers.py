@@ -0,0 +1,90 @@
+"""
+メモリの階層化（hot/cold）の検索のベンチマーク
+
+大半のメモリがしばらく参照されていない（cold）ストアで、階層化しない場合と階層化した場合の
+検索1回あたりの時間（キャッシュなし）を比較する。hotの結果が足りない場合にだけ行うcoldの検索
+（ディスク上の全文検索）1回あたりの時間も表示する。
+
+  PYTHONPATH=. uv run benchmarks/bench_memory_tiers.py
+"""
+
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+# ベンチマーク中にカレントディレクトリのメモリファイルを触らないようにする
+os.environ.setdefault("USER_MEMORY_FILE", os.path.join(tempfile.mkdtemp(), "user_memory.json"))
+
+from benchmarks.bench_memory_search import QUERIES, make_contents
+from tools.user_memory_mcp_server import MemoryManager
+
+SIZE = 100_000
+# hotにするメモリ（優先度がhigh）の割合
+HOT_RATE = 0.1
+REPEAT = 3
+
+
+def write_store(memory_file: Path) -> None:
+  rng = random.Random(0)
+  memories = {
+    key: {
+      "tags": [rng.choice(["hobby", "habit", "learning", "goal", "preference"])],
+      "content": content,
+      "priority": "high" if rng.random() < HOT_RATE else rng.choice(["mid", "low"]),
+      "created_at": "20240101000000",
+      "updated_at": "20240101000000",
+      "reference_count": 0,
+    }
+    for key, content in make_contents(SIZE).items()
+  }
+  with open(memory_file, "w", encoding="utf-8") as f:
+    json.dump(memories, f, ensure_ascii=False)
+
+
+def bench(manager: MemoryManager, limit: int) -> float:
+  best = float("inf")
+  for _ in range(REPEAT):
+    # 参照による昇格や順位の変化が測定に影響しないよう、毎回キャッシュを捨てて同じ状態から検索する
+    manager.search_cache.clear()
+    start = time.perf_counter()
+    for query in QUERIES:
+      keys, relevance = manager._match([query], None, False)[0]
+      matched = manager._rank(keys, relevance, limit, 0)
+      if manager.cold_index is not None and len(matched) < limit:
+        manager._match_cold(query, None, False, (query,))
+    best = min(best, time.perf_counter() - start)
+  return best / len(QUERIES)
+
+
+def bench_cold(manager: MemoryManager) -> float:
+  best = float("inf")
+  for _ in range(REPEAT):
+    manager.search_cache.clear()
+    start = time.perf_counter()
+    for query in QUERIES:
+      manager._match_cold(query, None, False, (query,))
+    best = min(best, time.perf_counter() - start)
+  return best / len(QUERIES)
+
+
+def main():
+  memory_file = Path(tempfile.mkdtemp()) / "user_memory.json"
+  write_store(memory_file)
+  flat = MemoryManager(str(memory_file))
+  tiered = MemoryManager(str(memory_file), tiering=True)
+  print(f"{SIZE} memories, {tiered.tier_info()}, best of {REPEAT}")
+  print(f"{'limit':>6} {'flat (ms)':>10} {'tiered (ms)':>12} {'speedup':>9}")
+  for limit in (5, 50):
+    baseline = bench(flat, limit)
+    elapsed = bench(tiered, limit)
+    print(f"{limit:>6} {baseline * 1000:>10.2f} {elapsed * 1000:>12.2f} {baseline / elapsed:>8.1f}x")
+  print(f"cold search: {bench_cold(tiered) * 1000:.2f} ms")
+  flat.close()
+  tiered.close()
+
+
+if __name__ == "__main__":
+  main()
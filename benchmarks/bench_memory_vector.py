@@ -0,0 +1,41 @@
+"""
+hybridモード（ベクトル検索 + ファジー検索）の検索時間のベンチマーク
+
+  PYTHONPATH=. uv run benchmarks/bench_memory_vector.py
+"""
+
+import os
+import tempfile
+import time
+
+# ベンチマーク中にカレントディレクトリのメモリファイルを触らないようにする
+os.environ.setdefault("USER_MEMORY_FILE", os.path.join(tempfile.mkdtemp(), "user_memory.json"))
+
+from benchmarks.bench_memory_search import QUERIES, make_contents
+from tools.utils.memory_index import top_k
+from tools.utils.memory_vector import MIN_SIMILARITY, VectorIndex
+
+SIZES = [10_000, 50_000]
+REPEAT = 20
+SHORTLIST_SIZE = 200
+
+
+def main():
+  print(f"per query, best of {REPEAT}")
+  print(f"{'memories':>10} {'similarities + top-k (ms)':>26}")
+  for size in SIZES:
+    index = VectorIndex()
+    for key, content in make_contents(size).items():
+      index.set(key, content)
+
+    best = float("inf")
+    for _ in range(REPEAT):
+      start = time.perf_counter()
+      for query in QUERIES:
+        top_k(index.keys, index.similarities(query), SHORTLIST_SIZE, MIN_SIMILARITY)
+      best = min(best, (time.perf_counter() - start) / len(QUERIES))
+    print(f"{size:>10} {best * 1000:>26.3f}")
+
+
+if __name__ == "__main__":
+  main()
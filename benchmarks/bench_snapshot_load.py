@@ -0,0 +1,90 @@
+"""
+JSONとバイナリスナップショットでの起動（読み込み）時間のベンチマーク
+
+  PYTHONPATH=. uv run benchmarks/bench_snapshot_load.py
+"""
+
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+# ベンチマーク中にカレントディレクトリのメモリファイルを触らないようにする
+os.environ.setdefault("USER_MEMORY_FILE", os.path.join(tempfile.mkdtemp(), "user_memory.json"))
+os.environ.setdefault("USER_SCHEDULE_FILE", os.path.join(tempfile.mkdtemp(), "user_schedule.json"))
+
+from benchmarks.bench_memory_search import make_contents
+from tools.user_memory_mcp_server import MemoryManager, MemoryTag
+from tools.user_schedule_mcp_server import ScheduleManager
+
+SIZE = 100_000
+REPEAT = 3
+
+
+def write_stores(directory: Path) -> None:
+  rng = random.Random(0)
+  tags = [tag.value for tag in MemoryTag]
+  memories = {
+    key: {
+      "tags": rng.sample(tags, 2),
+      "content": content,
+      "priority": rng.choice(["high", "mid", "low"]),
+      "created_at": f"2025{i:010d}",
+      "updated_at": f"2025{i:010d}",
+      "reference_count": rng.randint(0, 100),
+    }
+    for i, (key, content) in enumerate(make_contents(SIZE).items())
+  }
+  with open(directory / "user_memory.json", "w", encoding="utf-8") as f:
+    json.dump(memories, f, ensure_ascii=False, indent=2)
+
+  schedules = {
+    f"schedule_{i}": {
+      "deadline": f"2025{i % 12 + 1:02d}{i % 28 + 1:02d}1200",
+      "content": memory["content"],
+      "priority": memory["priority"],
+      "created_at": memory["created_at"],
+      "updated_at": memory["updated_at"],
+    }
+    for i, memory in enumerate(memories.values())
+  }
+  with open(directory / "user_schedule.json", "w", encoding="utf-8") as f:
+    json.dump(schedules, f, ensure_ascii=False, indent=2)
+
+
+def best_of(load) -> float:
+  best = float("inf")
+  for _ in range(REPEAT):
+    start = time.perf_counter()
+    load()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+def main():
+  directory = Path(tempfile.mkdtemp())
+  write_stores(directory)
+  memory_file = str(directory / "user_memory.json")
+  schedule_file = str(directory / "user_schedule.json")
+
+  # バイナリスナップショットを作成し、n-gramインデックスも保存しておく（以降の起動では作り直さない）
+  manager = MemoryManager(memory_file, storage_type="binary")
+  manager.storage.append([], manager._snapshot)
+  manager.close()
+  schedules = ScheduleManager(schedule_file, storage_type="binary")
+  schedules._write_schedules()
+
+  print(f"{SIZE} entries, best of {REPEAT}")
+  print(f"{'store':<10} {'json (s)':>10} {'binary (s)':>11}")
+  memory_json = best_of(lambda: MemoryManager(memory_file, storage_type="json"))
+  memory_binary = best_of(lambda: MemoryManager(memory_file, storage_type="binary"))
+  print(f"{'memory':<10} {memory_json:>10.3f} {memory_binary:>11.3f}")
+  schedule_json = best_of(lambda: ScheduleManager(schedule_file, storage_type="json"))
+  schedule_binary = best_of(lambda: ScheduleManager(schedule_file, storage_type="binary"))
+  print(f"{'schedule':<10} {schedule_json:>10.3f} {schedule_binary:>11.3f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# テスト中にカレントディレクトリのメモリ・スケジュールのファイルを触らないようにする
+# （サーバーのモジュールは読み込み時に環境変数から保存先を決める）
+_data_dir = tempfile.mkdtemp()
+os.environ.setdefault("USER_MEMORY_FILE", os.path.join(_data_dir, "user_memory.json"))
+os.environ.setdefault("USER_SCHEDULE_FILE", os.path.join(_data_dir, "user_schedule.json"))
@@ -0,0 +1,37 @@
+from tools.utils.change_feed import ChangeFeed
+
+
+def _put(key: str) -> dict:
+  return {"op": "put", "key": key, "entry": {"content": key}}
+
+
+def test_writer_resumes_after_its_own_records(tmp_path):
+  memory_file = tmp_path / "user_memory.json"
+  writer = ChangeFeed(memory_file)
+  other = ChangeFeed(memory_file)
+  writer.publish(1, [_put("a")])
+  other.publish(2, [_put("b")])
+  writer.publish(3, [_put("c")])
+
+  # 自分の追記の後ろから読むので、自分の変更は読み直さない
+  assert writer._position[1] == memory_file.with_name("user_memory.json.changes").stat().st_size
+  assert writer.read_since(3) == ([], 3)
+
+  other.publish(4, [_put("d")])
+  assert writer.read_since(3) == ([{"version": 4, **_put("d")}], 4)
+  # 最初から読む読み手は全ての変更を読む
+  assert ChangeFeed(memory_file).read_since(0)[1] == 4
+
+
+def test_writer_position_follows_trim(tmp_path):
+  memory_file = tmp_path / "user_memory.json"
+  writer = ChangeFeed(memory_file, max_bytes=512)
+  other = ChangeFeed(memory_file, max_bytes=512)
+  for version in range(1, 21):
+    writer.publish(version, [_put(f"key{version}")])
+  assert writer.read_since(20) == ([], 20)
+
+  other.publish(21, [_put("key21")])
+  assert writer.read_since(20) == ([{"version": 21, **_put("key21")}], 21)
+  # 切り詰められたレコードから読もうとする読み手は全体を読み込み直す
+  assert ChangeFeed(memory_file).read_since(0) is None
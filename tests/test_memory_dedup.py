@@ -0,0 +1,63 @@
+from rapidfuzz import fuzz
+
+from tools.user_memory_mcp_server import MemoryManager
+from tools.utils.memory_dedup import DEDUP_THRESHOLD
+
+SHORT = "毎朝6時に近所の公園でジョギングをしている"
+LONGER = "毎朝6時に近所の公園でジョギングをしています"
+OTHER = "週末に料理教室に通っている"
+
+
+def make_manager(tmp_path, **kwargs) -> MemoryManager:
+  return MemoryManager(str(tmp_path / "user_memory.json"), **kwargs)
+
+
+def add(manager: MemoryManager, *contents: str) -> list[tuple[str, bool]]:
+  return manager.add_memories([{"tags": ["habit"], "content": content, "priority": "mid"} for content in contents])
+
+
+def test_dedup_is_off_by_default(tmp_path):
+  manager = make_manager(tmp_path)
+  results = add(manager, SHORT, SHORT)
+  assert [merged for _, merged in results] == [False, False]
+  assert len(manager.memories) == 2
+
+
+def test_merge_reports_the_surviving_key(tmp_path):
+  manager = make_manager(tmp_path, dedup_mode="merge")
+  [(first, merged)] = add(manager, SHORT)
+  assert not merged
+  [(key, merged)] = add(manager, LONGER)
+  assert merged and key == first
+  assert len(manager.memories) == 1
+  assert manager.memories.content(first) == LONGER
+
+
+def test_threshold_is_inclusive(tmp_path):
+  similarity = fuzz.ratio(SHORT, LONGER)
+  assert similarity < 100
+  above = make_manager(tmp_path / "above", dedup_mode="merge", dedup_threshold=similarity)
+  add(above, SHORT, LONGER)
+  assert len(above.memories) == 1
+  below = make_manager(tmp_path / "below", dedup_mode="merge", dedup_threshold=similarity + 0.1)
+  add(below, SHORT, LONGER)
+  assert len(below.memories) == 2
+
+
+def test_unrelated_memories_are_not_merged(tmp_path):
+  manager = make_manager(tmp_path, dedup_mode="merge")
+  results = add(manager, SHORT, OTHER)
+  assert [merged for _, merged in results] == [False, False]
+  assert len(manager.memories) == 2
+
+
+def test_deduplicate_plan_and_apply(tmp_path):
+  manager = make_manager(tmp_path)
+  add(manager, SHORT, LONGER, OTHER)
+  [group] = manager.deduplicate(apply=False, threshold=DEDUP_THRESHOLD)
+  assert not group.merged and len(manager.memories) == 3
+  [group] = manager.deduplicate(apply=True, threshold=DEDUP_THRESHOLD)
+  assert group.merged and len(group.duplicates) == 1
+  assert len(manager.memories) == 2
+  # 閾値を100にすると完全に一致するものだけが重複になる
+  assert manager.deduplicate(apply=False, threshold=100) == []
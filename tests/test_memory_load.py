@@ -0,0 +1,24 @@
+import json
+
+from tools.user_memory_mcp_server import MemoryManager
+
+
+def test_stringly_typed_reference_count_is_loaded(tmp_path):
+  memory_file = tmp_path / "user_memory.json"
+  item = {
+    "tags": ["hobby"],
+    "content": "ギターを練習している",
+    "priority": "mid",
+    "created_at": "20240101000000",
+    "updated_at": "20240102000000",
+    "reference_count": "3",
+  }
+  memory_file.write_text(json.dumps({"memory_20240101000000": item}), encoding="utf-8")
+
+  manager = MemoryManager(str(memory_file))
+  entry = manager.memories.entry("memory_20240101000000")
+  # 減衰した参照回数がない過去のデータは、更新日時に参照されたものとして補う
+  assert entry["reference_count"] == 3
+  assert entry["decayed_reference_count"] == 3.0
+  assert entry["referenced_at"] == "20240102000000"
+  manager.close()
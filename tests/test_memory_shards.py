@@ -0,0 +1,33 @@
+import pytest
+
+from tools.user_memory_mcp_server import MemoryManager, MemoryShardPool, memory_shard_file
+
+
+@pytest.mark.parametrize("storage_type", ["json", "journal", "binary", "sqlite"])
+def test_legacy_memories_move_to_the_owner_shard(tmp_path, storage_type):
+  legacy_file = tmp_path / "memory" / "user_memory.json"
+  legacy = MemoryManager(str(legacy_file), storage_type=storage_type)
+  legacy.add_memory(["hobby"], "ギターを練習している", "mid")
+  legacy.close()
+
+  pool = MemoryShardPool(str(legacy_file), legacy_owner="alice", storage_type=storage_type)
+  # 先に読み込まれた他のユーザのシャードには移さない
+  assert len(pool.get("bob").memories) == 0
+  assert [entry["content"] for entry in pool.get("alice").memories.entries().values()] == ["ギターを練習している"]
+  pool.close()
+  assert not legacy_file.exists()
+
+
+def test_legacy_memories_stay_without_an_owner(tmp_path):
+  legacy_file = tmp_path / "memory" / "user_memory.json"
+  legacy = MemoryManager(str(legacy_file))
+  legacy.add_memory(["hobby"], "ギターを練習している", "mid")
+  legacy.close()
+
+  # パスを求めるだけではファイルを移さない
+  shard_file = memory_shard_file(legacy_file, "alice")
+  assert not shard_file.exists()
+  pool = MemoryShardPool(str(legacy_file))
+  assert len(pool.get("alice").memories) == 0
+  pool.close()
+  assert legacy_file.exists()
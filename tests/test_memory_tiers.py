@@ -0,0 +1,108 @@
+import pytest
+
+from tools.user_memory_mcp_server import MemoryManager
+from tools.utils.memory_tiers import ColdIndex
+
+
+@pytest.fixture
+def manager(tmp_path):
+  """hotのメモリが1件（優先度がhigh）で、残りがcoldのマネージャー"""
+  manager = MemoryManager(str(tmp_path / "user_memory.json"), tiering=True, hot_days=-1, dedup_mode="off")
+  manager.add_memories(
+    [
+      {"tags": ["hobby"], "content": "ピアノの練習", "priority": "high"},
+      {"tags": ["hobby"], "content": "ギターの練習", "priority": "low"},
+      {"tags": ["hobby"], "content": "水泳の練習", "priority": "low"},
+      {"tags": ["hobby"], "content": "英会話の練習", "priority": "low"},
+    ]
+  )
+  yield manager
+  manager.close()
+
+
+def test_cold_contents_are_offloaded(manager):
+  assert manager.tier_info() == {"hot": 1, "cold": 3}
+  assert manager.memories.offloaded() == 3
+  assert {memory.content for memory in manager.get_all_memories()} == {
+    "ピアノの練習",
+    "ギターの練習",
+    "水泳の練習",
+    "英会話の練習",
+  }
+
+
+@pytest.mark.parametrize("query, expected", [("練習", 3), ("ギ", 1), ("水泳", 1)])
+def test_cold_index_finds_short_queries(manager, query, expected):
+  assert len(manager.cold_index.search(query, 200)) == expected
+
+
+def test_search_falls_back_to_cold_for_short_queries(manager):
+  results = manager.search_memories("練習", limit=5)
+  assert len(results) == 4
+
+
+def test_cold_contents_survive_reload(manager, tmp_path):
+  manager.close()
+  reloaded = MemoryManager(str(tmp_path / "user_memory.json"), tiering=True, hot_days=-1)
+  assert reloaded.memories.offloaded() == 3
+  assert {entry["content"] for entry in reloaded.memories.entries().values()} == {
+    "ピアノの練習",
+    "ギターの練習",
+    "水泳の練習",
+    "英会話の練習",
+  }
+  reloaded.close()
+
+
+def test_hybrid_search_with_tags_skips_cold_memories(tmp_path):
+  manager = MemoryManager(
+    str(tmp_path / "user_memory.json"), search_mode="hybrid", tiering=True, hot_days=-1, dedup_mode="off"
+  )
+  manager.add_memories(
+    [
+      {"tags": ["hobby"], "content": "ピアノの練習", "priority": "high"},
+      {"tags": ["hobby"], "content": "ギターの練習", "priority": "low"},
+    ]
+  )
+  assert manager.tier_info() == {"hot": 1, "cold": 1}
+  results = manager.search_memories("ピアノの練習", tags=["hobby"], limit=1)
+  assert [result.content for result in results] == ["ピアノの練習"]
+  # hotだけでlimit件に満たない場合はcoldのメモリも見つかる
+  results = manager.search_memories("ギターの練習", tags=["hobby"], limit=5)
+  assert {result.content for result in results} == {"ピアノの練習", "ギターの練習"}
+  manager.close()
+
+
+def test_cold_index_search_sees_unflushed_changes(tmp_path):
+  index = ColdIndex(tmp_path / "user_memory.json.cold")
+  index.put("memory_1", "ギターの練習")
+  index.put("memory_2", "水泳の練習")
+  index.flush()
+  index.put("memory_3", "ピアノの練習")
+  index.remove("memory_2")
+  index.put("memory_1", "ギターの演奏")
+  # 書き込んでいない変更を突き合わせ、インデックスの古い内容は使わない
+  assert sorted(index.search("練習", 10)) == ["memory_3"]
+  assert index.search("演奏", 10) == ["memory_1"]
+  assert index._pending
+  index.close()
+
+
+def test_search_does_not_write(tmp_path, monkeypatch):
+  manager = MemoryManager(
+    str(tmp_path / "user_memory.json"), tiering=True, hot_days=-1, tier_rebalance_interval=0, dedup_mode="off"
+  )
+  manager.add_memory(["hobby"], "ピアノの練習", "low")
+
+  def fail(*args, **kwargs):
+    raise AssertionError("search must not write")
+
+  monkeypatch.setattr(manager.cold_index, "flush", fail)
+  monkeypatch.setattr(manager.storage, "append", fail)
+  assert [result.content for result in manager.search_memories("ピアノ", limit=5)] == ["ピアノの練習"]
+  monkeypatch.undo()
+  # 検索で昇格したメモリは、次の書き込みで層を決め直すときに降格する
+  assert manager.tier_info() == {"hot": 1, "cold": 0}
+  manager.add_memory(["hobby"], "水泳の練習", "low")
+  assert manager.tier_info() == {"hot": 0, "cold": 2}
+  manager.close()
@@ -0,0 +1,39 @@
+import pytest
+
+from tools.utils.memory_index import top_k
+from tools.utils.memory_vector import MIN_SIMILARITY, VectorIndex
+
+CONTENTS = {
+  "work": "エンジニアとして働いている",
+  "spanish": "スペイン語を学習している",
+  "coffee": "コーヒーが好きでよく飲む",
+  "tea": "緑茶をよく飲む",
+  "dog": "ペットの犬と散歩する",
+  "running": "毎朝ジョギングをしている",
+}
+
+
+@pytest.fixture
+def index():
+  index = VectorIndex()
+  for key, content in CONTENTS.items():
+    index.set(key, content)
+  return index
+
+
+def search(index: VectorIndex, query: str) -> set[str]:
+  return {key for key, _ in top_k(index.keys, index.similarities(query), 10, MIN_SIMILARITY)}
+
+
+@pytest.mark.parametrize(
+  "query, expected", [("飲み物", {"coffee", "tea"}), ("ペット", {"dog"}), ("ジョギング", {"running"})]
+)
+def test_unrelated_memories_are_not_hit(index, query, expected):
+  assert search(index, query) == expected
+
+
+def test_removed_memories_are_not_hit(index):
+  index.remove("dog")
+  assert search(index, "ペット") == set()
+  index.set("dog", "ペットの猫と暮らしている")
+  assert search(index, "ペット") == {"dog"}
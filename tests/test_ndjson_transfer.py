@@ -0,0 +1,97 @@
+import io
+import json
+
+import pytest
+
+from tools.user_memory_mcp_server import MemoryManager
+from tools.user_schedule_mcp_server import ScheduleManager
+
+
+def memory_line(content: str, key=None) -> str:
+  record = {
+    "tags": ["hobby"],
+    "content": content,
+    "priority": "mid",
+    "created_at": "20240101000000",
+    "updated_at": "20240101000000",
+  }
+  if key is not None:
+    record["key"] = key
+  return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+@pytest.mark.parametrize("storage_type", ["json", "journal", "binary", "sqlite"])
+def test_memory_round_trip(tmp_path, storage_type):
+  source = MemoryManager(str(tmp_path / "source" / "user_memory.json"), storage_type=storage_type)
+  source.add_memories([{"tags": ["hobby"], "content": f"趣味 {i}", "priority": "mid"} for i in range(25)])
+  exported = io.StringIO()
+  assert source.export_ndjson(exported) == 25
+
+  destination_file = tmp_path / "destination" / "user_memory.json"
+  destination = MemoryManager(str(destination_file), storage_type=storage_type)
+  reported = []
+  imported, skipped = destination.import_ndjson(
+    io.StringIO(exported.getvalue()), batch_size=10, progress=reported.append
+  )
+  assert (imported, skipped) == (25, 0)
+  assert reported == [10, 20, 25]
+  destination.close()
+
+  reloaded = MemoryManager(str(destination_file), storage_type=storage_type)
+  assert reloaded.memories.entries() == source.memories.entries()
+  # 同じキーで取り込み直すと上書きになる
+  assert reloaded.import_ndjson(io.StringIO(exported.getvalue())) == (25, 0)
+  assert len(reloaded.memories) == 25
+  source.close()
+  reloaded.close()
+
+
+def test_memory_import_skips_invalid_lines(tmp_path):
+  manager = MemoryManager(str(tmp_path / "user_memory.json"))
+  lines = [
+    memory_line("キーあり", key="memory_20240101000000"),
+    "not json\n",
+    "\n",
+    "[1, 2]\n",
+    json.dumps({"content": "日時なし", "tags": ["hobby"]}) + "\n",
+    memory_line("キーなし"),
+  ]
+  assert manager.import_ndjson(io.StringIO("".join(lines))) == (2, 3)
+  assert manager.memories.content("memory_20240101000000") == "キーあり"
+  assert len(manager.memories) == 2
+
+
+def test_memory_import_skips_badly_typed_fields(tmp_path):
+  manager = MemoryManager(str(tmp_path / "user_memory.json"))
+  valid = json.loads(memory_line("数字の文字列"))
+  lines = [
+    json.dumps({**valid, "reference_count": "3"}) + "\n",
+    json.dumps({**valid, "reference_count": "many"}) + "\n",
+    json.dumps({**valid, "tags": None}) + "\n",
+    json.dumps({**valid, "tags": [{"name": "hobby"}]}) + "\n",
+  ]
+  # 数字の文字列はモデルで変換して取り込み、変換できない値やリストでないタグの行は飛ばす
+  assert manager.import_ndjson(io.StringIO("".join(lines)), batch_size=1) == (2, 2)
+  assert sorted(entry["reference_count"] for entry in manager.memories.entries().values()) == [0, 3]
+
+
+def test_memory_import_counts_repeated_keys_once(tmp_path):
+  manager = MemoryManager(str(tmp_path / "user_memory.json"))
+  lines = memory_line("古い", key="memory_20240101000000") + memory_line("新しい", key="memory_20240101000000")
+  assert manager.import_ndjson(io.StringIO(lines)) == (1, 0)
+  assert manager.memories.content("memory_20240101000000") == "新しい"
+
+
+@pytest.mark.parametrize("storage_type", ["json", "binary"])
+def test_schedule_round_trip(tmp_path, storage_type):
+  source = ScheduleManager(str(tmp_path / "source" / "user_schedule.json"), storage_type)
+  for i in range(12):
+    source.add_schedule("20991231000000", f"予定 {i}", "high")
+  exported = io.StringIO()
+  assert source.export_ndjson(exported) == 12
+
+  destination_file = str(tmp_path / "destination" / "user_schedule.json")
+  destination = ScheduleManager(destination_file, storage_type)
+  text = exported.getvalue() + json.dumps({"content": "締め切りなし"}) + "\n"
+  assert destination.import_ndjson(io.StringIO(text), batch_size=5) == (12, 1)
+  assert ScheduleManager(destination_file, storage_type).schedules == source.schedules
@@ -0,0 +1,74 @@
+import pytest
+
+from tools.user_memory_mcp_server import MemoryManager
+from tools.user_schedule_mcp_server import ScheduleManager
+from tools.utils.pagination import encode_cursor, sort_page
+
+
+def _pages(list_page, **kwargs) -> list[list[str]]:
+  """カーソルをたどって全ページのキーを返す"""
+  pages = []
+  cursor = None
+  while True:
+    page = list_page(cursor=cursor, **kwargs)
+    pages.append([item.get("key", item.get("schedule_id")) for item in page.items])
+    cursor = page.next_cursor
+    if cursor is None:
+      return pages
+
+
+def test_sort_page_breaks_ties_by_key():
+  items = [((1,), "a"), ((0,), "b"), ((1,), "c"), ((1,), "b")]
+  # 値が同じものはキーの大きい順
+  assert sort_page(items, 10) == [((0,), "b"), ((1,), "c"), ((1,), "b"), ((1,), "a")]
+  # カーソルが同じ値の途中を指していても、その続きから始まる
+  assert sort_page(items, 10, ((1,), "c")) == [((1,), "b"), ((1,), "a")]
+
+
+@pytest.fixture
+def manager(tmp_path):
+  manager = MemoryManager(str(tmp_path / "user_memory.json"), dedup_mode="off")
+  # まとめて追加したメモリは作成・更新日時が同じになる
+  manager.add_memories([{"tags": ["hobby"], "content": f"趣味 {i}", "priority": "mid"} for i in range(7)])
+  yield manager
+  manager.close()
+
+
+@pytest.mark.parametrize("order_by", ["recency", "priority", "reference_count", "least_useful"])
+def test_memory_pages_with_ties(manager, order_by):
+  pages = _pages(manager.list_memories, order_by=order_by, limit=3)
+  assert [len(page) for page in pages] == [3, 3, 1]
+  keys = [key for page in pages for key in page]
+  assert keys == [item["key"] for item in manager.list_memories(order_by=order_by, limit=100).items]
+  assert set(keys) == set(manager.memories)
+
+
+def test_memory_pages_skip_nothing_across_changes(manager):
+  first = manager.list_memories(order_by="priority", limit=3)
+  seen = [item["key"] for item in first.items]
+  # ページの間に同じ値の項目を削除しても、続きのページに重複や抜けは起きない
+  manager.delete_memory(seen[0])
+  remaining = sorted(set(manager.memories) - set(seen), reverse=True)
+  rest = manager.list_memories(order_by="priority", limit=100, cursor=first.next_cursor)
+  assert [item["key"] for item in rest.items] == remaining
+
+
+def test_memory_cursor_for_another_order_is_rejected(manager):
+  cursor = manager.list_memories(order_by="recency", limit=3).next_cursor
+  with pytest.raises(ValueError):
+    manager.list_memories(order_by="priority", cursor=cursor)
+
+
+def test_schedule_pages_with_ties(tmp_path):
+  manager = ScheduleManager(str(tmp_path / "user_schedule.json"))
+  for i in range(5):
+    manager.add_schedule("209912310000", f"予定 {i}", "high")
+  pages = _pages(manager.list_schedules, order_by="deadline", limit=2)
+  assert [len(page) for page in pages] == [2, 2, 1]
+  keys = [key for page in pages for key in page]
+  assert keys == sorted(manager.schedules, reverse=True)
+
+  # 最後の項目を指すカーソルの後ろには何もない
+  last = manager.list_schedules(order_by="deadline", limit=5).items[-1]["schedule_id"]
+  values = manager._sort_values("deadline", manager.schedules[last])
+  assert manager.list_schedules(order_by="deadline", cursor=encode_cursor("deadline", values, last)).items == []
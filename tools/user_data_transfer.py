@@ -0,0 +1,67 @@
+"""
+メモリ・スケジュールのNDJSON（1行1件のJSON）でのエクスポート・インポート
+
+  PYTHONPATH=. uv run tools/user_data_transfer.py export memory memories.ndjson [--user-id USER]
+  PYTHONPATH=. uv run tools/user_data_transfer.py import schedule schedules.ndjson [--batch-size 1000]
+
+ファイルに"-"を指定すると標準入出力を使う。保存先と保存方式は各MCPサーバーと同じ環境変数
+（USER_MEMORY_FILE・USER_MEMORY_STORAGE・USER_SCHEDULE_FILEなど）で指定する。
+ファイルは1行ずつ読み書きし、全体を読み込んだ写しは作らない。ただしインポートしたメモリは
+マネージャーの表に載るので、メモリの数に比例したメモリを使う（階層化するとcoldのメモリの内容はディスクに置く）。
+インポートはjournal・sqliteの保存方式ではバッチごとに、全体を書き直すjson・binaryでは最後に1回だけ書き込む。
+"""
+
+import argparse
+import contextlib
+import sys
+from typing import IO, ContextManager
+
+from tools.utils.ndjson import TRANSFER_BATCH_SIZE
+
+
+def _open(path: str, mode: str) -> ContextManager[IO[str]]:
+  # 標準入出力は閉じない
+  if path == "-":
+    return contextlib.nullcontext(sys.stdout if mode == "w" else sys.stdin)
+  return open(path, mode, encoding="utf-8", newline="\n" if mode == "w" else None)
+
+
+def _manager(kind: str, user_id: str | None):
+  # 使う方のモジュールだけを読み込む（読み込み時に保存先を開くため）
+  if kind == "memory":
+    from tools.user_memory_mcp_server import get_memory_manager
+
+    return get_memory_manager(user_id)
+  from tools.user_schedule_mcp_server import schedule_manager
+
+  return schedule_manager
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Export or import memories and schedules as NDJSON.")
+  parser.add_argument("command", choices=["export", "import"])
+  parser.add_argument("kind", choices=["memory", "schedule"])
+  parser.add_argument("file", help='NDJSON file ("-" for stdin/stdout)')
+  parser.add_argument("--user-id", help="user whose memories to transfer (default: USER_ID)")
+  parser.add_argument("--batch-size", type=int, default=TRANSFER_BATCH_SIZE, help="entries written per transaction")
+  args = parser.parse_args()
+  if args.batch_size < 1:
+    parser.error("--batch-size must be at least 1")
+
+  manager = _manager(args.kind, args.user_id)
+
+  def progress(count: int) -> None:
+    print(f"\r{args.command}: {count} {args.kind} entries", end="", file=sys.stderr, flush=True)
+
+  if args.command == "export":
+    with _open(args.file, "w") as f:
+      count = manager.export_ndjson(f, progress)
+    print(f"\rexported {count} {args.kind} entries", file=sys.stderr)
+  else:
+    with _open(args.file, "r") as f:
+      imported, skipped = manager.import_ndjson(f, args.batch_size, progress)
+    print(f"\rimported {imported} {args.kind} entries, skipped {skipped} invalid lines", file=sys.stderr)
+
+
+if __name__ == "__main__":
+  main()
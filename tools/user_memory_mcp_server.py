@@ -1,13 +1,45 @@
+import asyncio
+import atexit
 import datetime
-import json
+import itertools
 import os
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from enum import Enum
 from pathlib import Path
-from typing import Any, List, Optional, Tuple
+from typing import IO, Annotated, Any, List, Literal, Optional, Tuple
+from urllib.parse import quote
 
+import numpy as np
 from mcp.server.fastmcp import FastMCP
 from pydantic import BaseModel, Field
-from rapidfuzz import fuzz, process
+
+# stdioサーバーとして単体で起動された場合でもtoolsパッケージを参照できるようにする
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+  sys.path.insert(0, project_root)
+
+from tools.utils.binary_snapshot import paused_gc
+from tools.utils.change_feed import ChangeFeed
+from tools.utils.durability import Durability
+from tools.utils.memory_dedup import DEDUP_THRESHOLD, all_similar_pairs, cluster_pairs, merge_entries, similar_pairs
+from tools.utils.memory_eviction import EVICTION_POLICIES, MemoryArchive
+from tools.utils.memory_index import FuzzyChoices, NgramIndex, contents_fingerprint, fuzzy_scores, top_k
+from tools.utils.memory_keys import MemoryKeyGenerator
+from tools.utils.memory_ranking import MIN_RELEVANCE, MemoryRanker, current_seconds, seconds_to_timestamp
+from tools.utils.memory_stats import LATEST_CONTENTS, save_stats
+from tools.utils.memory_storage import MemoryRecord, MemorySnapshot, create_memory_storage, migrate_store
+from tools.utils.memory_table import MemoryTable
+from tools.utils.memory_tiers import HOT_PRIORITIES, HOT_TAGS, ColdIndex
+from tools.utils.memory_vector import MIN_SIMILARITY, VectorIndex
+from tools.utils.ndjson import TRANSFER_BATCH_SIZE, Progress, read_records, write_records
+from tools.utils.pagination import decode_cursor, encode_cursor, project
+from tools.utils.search_cache import SearchCache, normalize_query
+from tools.utils.write_coalescer import DebouncedFlusher
 
 
 class MemoryTag(Enum):
@@ -43,6 +75,17 @@ class MemoryPriority(Enum):
   LOW = "low"
 
 
+# ツールのスキーマに埋め込むタグと優先度の列挙
+# （モデルがget_memory_tag_list・get_memory_priority_listを呼ばなくても選べる値が分かるようにする）
+MemoryTagName = Literal[tuple(tag.value for tag in MemoryTag)]
+MemoryPriorityName = Literal[tuple(priority.value for priority in MemoryPriority)]
+
+MEMORY_TAGS_DESCRIPTION = "Tags of the memory. Choose one or more of:\n" + "".join(
+  f"- {tag.value}: {MEMORY_TAG_EXAMPLES[tag]}\n" for tag in MemoryTag
+)
+MEMORY_PRIORITY_DESCRIPTION = "Priority level of the memory (high, mid, low)."
+
+
 class MemoryEntry(BaseModel):
   """メモリエントリの構造"""
 
@@ -52,6 +95,10 @@ class MemoryEntry(BaseModel):
   created_at: str = Field(..., description="作成日時")
   updated_at: str = Field(..., description="更新日時")
   reference_count: int = Field(default=0, description="参照された回数")
+  decayed_reference_count: float = Field(
+    default=0.0, description="最後に参照した時点の、時間とともに減衰させた参照回数"
+  )
+  referenced_at: str = Field(default="", description="最後に参照された日時（参照されていない場合は空）")
 
 
 class MemorySearchResult(BaseModel):
@@ -67,168 +114,1154 @@ class MemorySearchResult(BaseModel):
   score: float = Field(..., description="類似度スコア")
 
 
+class MemoryAddItem(BaseModel):
+  """A memory to add with add_memories"""
+
+  tags: List[MemoryTagName] = Field(..., description=MEMORY_TAGS_DESCRIPTION)
+  content: str = Field(..., description="Memory content. Provide detailed description.")
+  priority: MemoryPriorityName = Field(..., description=MEMORY_PRIORITY_DESCRIPTION)
+
+
+class MemoryUpdateItem(BaseModel):
+  """A memory update for update_memories"""
+
+  key: str = Field(..., description="Key of the memory to update, as returned by search_memories or get_all_memories.")
+  content: str = Field(..., description="New memory content. Replaces existing content.")
+
+
+MemoryOrder = Literal["recency", "priority", "reference_count", "least_useful"]
+MemoryFieldName = Literal[
+  "key",
+  "tags",
+  "content",
+  "priority",
+  "created_at",
+  "updated_at",
+  "reference_count",
+  "decayed_reference_count",
+  "referenced_at",
+]
+
+
+class MemoryPage(BaseModel):
+  """One page of get_all_memories"""
+
+  items: List[dict[str, Any]] = Field(..., description="Memories in this page, with only the requested fields")
+  next_cursor: Optional[str] = Field(default=None, description="Cursor for the next page (null on the last page)")
+  total: int = Field(..., description="Total number of memories")
+
+
+class MemoryOperationResult(BaseModel):
+  """Result of one item of a batch operation"""
+
+  key: Optional[str] = Field(default=None, description="Key of the memory (the new key for added memories)")
+  success: bool = Field(..., description="Operation success/failure")
+  message: str = Field(..., description="Result message")
+  merged_into: Optional[str] = Field(
+    default=None, description="Key of the existing memory an added memory was merged into (None if not merged)"
+  )
+
+
+class MemoryMergeGroup(BaseModel):
+  """A group of near-duplicate memories found by deduplicate_memories"""
+
+  keep: str = Field(..., description="Key of the memory that is kept (the oldest one)")
+  duplicates: List[str] = Field(..., description="Keys of the memories that are merged into keep and deleted")
+  similarity: float = Field(..., description="Lowest content similarity (0-100) between the linked memories")
+  content: str = Field(..., description="Content after merging (the most recently updated content)")
+  tags: List[str] = Field(..., description="Tags after merging (all tags of the group)")
+  priority: str = Field(..., description="Priority after merging (the highest priority of the group)")
+  merged: bool = Field(..., description="True if the group was merged, False if this is only a plan")
+
+
 class MemoryManager:
   """メモリの管理を行うクラス"""
 
-  def __init__(self, memory_file: str = "user_memory.json"):
+  def __init__(
+    self,
+    memory_file: str = "user_memory.json",
+    storage_type: str = "json",
+    ref_flush_threshold: int = 50,
+    ref_flush_interval: float = 30.0,
+    search_workers: int = -1,
+    search_shortlist_size: int = 200,
+    search_mode: str = "fuzzy",
+    vector_weight: float = 0.5,
+    search_cache_size: int = 256,
+    priority_weight: float = 0.1,
+    recency_weight: float = 0.1,
+    popularity_weight: float = 0.05,
+    recency_half_life_days: float = 30.0,
+    reference_half_life_days: float = 30.0,
+    dedup_mode: str = "off",
+    dedup_threshold: float = DEDUP_THRESHOLD,
+    capacity: int = 0,
+    eviction_policy: str = "least_useful",
+    tiering: bool = False,
+    hot_days: float = 30.0,
+    tier_rebalance_interval: float = 3600.0,
+    fsync_policy: str = "always",
+    fsync_interval_ms: int = 100,
+    deferred_writes: bool = False,
+  ):
     self.memory_file = Path(memory_file)
     # メモリディレクトリを自動作成
     self.memory_file.parent.mkdir(parents=True, exist_ok=True)
-    self.memories: dict[str, MemoryEntry] = {}
+    # メモリの件数の上限（0は上限なし）。超えた分はeviction_policyの順に追い出して保管場所（.archive）に移す
+    if eviction_policy not in EVICTION_POLICIES:
+      raise ValueError(f"Unknown eviction policy: {eviction_policy}")
+    self.capacity = capacity
+    # メモリは列ごとの配列で保持する（pydanticのモデルはMCPツールに返すときにだけ作る）
+    # 参照回数はreference_half_life_daysごとに半分になるよう減衰させた値も持つ
+    self.memories = MemoryTable(
+      [t.value for t in MemoryTag],
+      [p.value for p in MemoryPriority],
+      reference_half_life_days=reference_half_life_days,
+      eviction_policy=eviction_policy if capacity > 0 else None,
+    )
+    # ファジー検索用の前処理済みメモリ内容（search_workersはスコア計算に使うスレッド数、-1で全コア）
+    self.fuzzy_choices = FuzzyChoices(workers=search_workers)
+    # 文字n-gram -> キー の転置インデックス（ファジー検索の前に候補をsearch_shortlist_size件まで絞り込む）
+    self.ngram_index = NgramIndex()
+    self.ngram_index_file = self.memory_file.with_name(self.memory_file.name + ".ngram")
+    self.search_shortlist_size = search_shortlist_size
+    # fuzzy: ファジー検索のみ / hybrid: ベクトル検索の類似度とファジー検索のスコアを重み付きで合算する
+    if search_mode not in ("fuzzy", "hybrid"):
+      raise ValueError(f"Unknown search mode: {search_mode}")
+    self.vector_index: Optional[VectorIndex] = VectorIndex() if search_mode == "hybrid" else None
+    self.vector_weight = vector_weight
+    # tiering=Trueの場合、hotのメモリ（優先度が高い・個人情報やAIへの指示のタグ・hot_days以内に参照/更新された）だけを
+    # メモリ上の検索インデックスに置き、それ以外（cold）は内容ごとディスク上の全文検索インデックス（.cold）に置く
+    # （coldのメモリの表には優先度・日時などの列だけを残し、内容は必要なときに読み出す）。
+    # coldのメモリはhotの検索結果がlimit件に満たない場合だけ検索し、検索結果に含まれたらhotに昇格する。
+    # hotでなくなったメモリは、書き込みのたびに（前回からtier_rebalance_interval秒経っていれば）coldに降格する
+    # （検索ではディスクに書き込まない。参照回数をまとめて書き込むタイマーからも行われる）
+    self.cold_index = ColdIndex(self.memory_file.with_name(self.memory_file.name + ".cold")) if tiering else None
+    if self.cold_index is not None:
+      self.memories.load_content = self.cold_index.content
+    self.hot_days = hot_days
+    self.tier_rebalance_interval = tier_rebalance_interval
+    self._cold: set[str] = set()
+    # 層を移したメモリがあると増える（検索結果のキャッシュのキーに含める）
+    self._tier_version = 0
+    self._rebalanced_at = time.monotonic()
+    # 検索結果のLRUキャッシュ（メモリが変更されると表のバージョンが変わり、古い結果には当たらなくなる）
+    self.search_cache = SearchCache(search_cache_size)
+    # 検索結果の順位付け（関連度に優先度・新しさ・参照回数を重み付きで加味する）
+    self.ranker = MemoryRanker(priority_weight, recency_weight, popularity_weight, recency_half_life_days)
+    # off: 追加したメモリをそのまま保存する / merge: 内容の類似度がdedup_threshold以上の既存のメモリがあればまとめる
+    if dedup_mode not in ("off", "merge"):
+      raise ValueError(f"Unknown dedup mode: {dedup_mode}")
+    self.dedup_mode = dedup_mode
+    self.dedup_threshold = dedup_threshold
+    # json: 変更のたびに全体を書き直す / journal: 変更を追記ログに書き込む / binary: 変更のたびにバイナリ形式で全体を書き直す
+    # fsync_policy: always: 書き込みごとにfsync / group: fsync_interval_msごとにまとめてfsync / none: OSに任せる
+    self.storage = create_memory_storage(self.memory_file, storage_type, Durability(fsync_policy, fsync_interval_ms))
+    # 書き込んだ変更を他のプロセスに知らせる変更フィード（差分を読めないストレージでは他のプロセスの変更もここから読む）
+    self.change_feed = ChangeFeed(self.memory_file)
+    self.archive = MemoryArchive(self.memory_file, self.storage.durability)
+    # タイマースレッドからの書き込みと競合しないようにするためのロック
+    # （他のプロセスとの排他はstorage.lock()で行う。取る順序は常に self._lock -> storage.lock()）
+    self._lock = threading.RLock()
+
+    # 検索による参照回数の増加はメモリ上に溜めておき、まとめて書き込む
+    # クラッシュ時に失われるのは最大でもref_flush_threshold回分の増加のみ
+    self.ref_flush_threshold = ref_flush_threshold
+    self.ref_flush_interval = ref_flush_interval
+    # キー -> 書き込み待ちの参照回数の増加分（他のプロセスの変更を取り込むときに上乗せし直す）
+    self._pending_refs: dict[str, int] = {}
+    self._pending_ref_count = 0
+    self._ref_flush_timer: Optional[threading.Timer] = None
+    # deferred_writes=Trueの場合、変更はメモリ上にだけ反映し、flush()が呼ばれたときにまとめて書き込む
+    # キー -> 書き込み待ちの変更（"put" / "delete"）。他のプロセスの変更より新しいものとして扱う
+    self.deferred_writes = deferred_writes
+    self._dirty: dict[str, str] = {}
+    # 新しいメモリのキー（時系列順に並び、同じ秒に追加しても衝突しない）
+    self._keys = MemoryKeyGenerator()
+
     self._load_memories()
 
   def _load_memories(self):
     """メモリファイルからデータを読み込む"""
-    if self.memory_file.exists():
+    self.memories.clear()
+    self.fuzzy_choices.clear()
+    self.ngram_index.clear()
+    self._cold.clear()
+    if self.vector_index is not None:
+      self.vector_index.clear()
+    # 読み込み中に作るオブジェクトは全て生き残るのでGCを止めておく
+    with paused_gc():
+      snapshot = self.storage.load()
+      if self.storage.validated:
+        # 保存時に検証済みのデータは過去データの補完やタグのチェックを省略してそのまま表に入れる
+        entries = snapshot.items()
+      else:
+        valid_tags = {t.value for t in MemoryTag}
+        entries = []
+        for key, item in snapshot.items():
+          entry = self._normalize_item(item, valid_tags)
+          if entry is not None:
+            entries.append((key, entry))
+
+      self.memories.extend(entries)
+      if self.cold_index is not None:
+        hot = self.memories.hot_rows(HOT_PRIORITIES, HOT_TAGS, self._hot_since())
+        self._cold.update(self.memories.keys[row] for row in np.flatnonzero(~hot).tolist())
+      for key in self.memories.keys:
+        if key not in self._cold:
+          self._index_hot(key, with_ngrams=False)
+
+    # n-gramインデックスは保存済みのものがメモリの内容と一致すれば作り直さない
+    if not self.ngram_index.load(self.ngram_index_file, self._contents_fingerprint()):
+      for key in self.fuzzy_choices.keys:
+        self.ngram_index.add(key, self.memories.content(key))
+    if self.cold_index is not None:
+      self.cold_index.reconcile(
+        ((key, self.memories.content(key)) for key in self._cold),
+        lambda key: self.memories.content(key) if key in self.memories else None,
+      )
+      for key in self._cold:
+        self.memories.offload(key)
+
+  @staticmethod
+  def _normalize_item(item: dict[str, Any], valid_tags: set[str]) -> Optional[dict[str, Any]]:
+    """保存されていたメモリを検証し、過去のデータの形式を補完する（不正なデータはNone）"""
+    # 過去のデータにpriorityフィールドがない場合は"mid"をデフォルト値として設定
+    if "priority" not in item:
+      item["priority"] = "mid"
+    # 過去のデータにreference_countフィールドがない場合は0をデフォルト値として設定
+    if "reference_count" not in item:
+      item["reference_count"] = 0
+    # タグがENUMのリストにあるかチェック（リストでないタグはモデルの検証で不正なデータにする）
+    tags = item.get("tags", [])
+    if isinstance(tags, list):
+      tmp_tags = [tag for tag in tags if isinstance(tag, str) and tag in valid_tags]
+      item["tags"] = tmp_tags if tmp_tags else [MemoryTag.PERSONALITY.value]
+
+    try:
+      entry = MemoryEntry(**item).model_dump()
+    except Exception as e:
+      print(f"Warning: Failed to load memory item: {e}, item: {item}", file=sys.stderr)
+      return None
+    # 減衰した参照回数がない過去のデータは、累計の参照回数を更新日時に参照されたものとして扱う
+    # （文字列で保存された回数なども変換されるよう、モデルで検証した後に行う）
+    if entry["reference_count"] > 0 and not entry["referenced_at"]:
+      entry["decayed_reference_count"] = float(entry["reference_count"])
+      entry["referenced_at"] = entry["updated_at"]
+    return entry
+
+  @contextmanager
+  def _transaction(self):
+    """
+    他のプロセスと排他し、他のプロセスの変更を取り込んだ最新の状態で変更を行う
+
+    変更は取り込んだ状態に対して適用されるため、異なるメモリへの変更は互いに失われない。
+    """
+    with self._lock, self.storage.lock():
+      self._sync()
+      yield
+
+  def _refresh(self):
+    """
+    他のプロセスが書き込んでいれば変更を取り込む
+
+    読み出し系の操作の最初にself._lockを取って呼び、読み出しが終わるまでロックを持ち続ける
+    （バックグラウンドの書き込みが変更を取り込んで表を書き換えるのと競合しないようにするため）。
+    """
+    if self.storage.changed():
+      with self.storage.lock():
+        self._sync()
+
+  def _sync(self):
+    """最後に同期してから他のプロセスが書き込んだ変更を取り込む（self._lockとstorage.lock()を取って呼ぶ）"""
+    if not self.storage.changed():
+      return
+    records = self.storage.read_changes()
+    if records is None:
+      records = self._read_feed()
+    if records is None:
+      records = self._diff(self.storage.load())
+
+    valid_tags = {t.value for t in MemoryTag}
+    for record in records:
+      key = record["key"]
+      # まだ書き込んでいない自分の変更の方が新しい
+      if key in self._dirty:
+        continue
+      if key in self.memories:
+        self._index_remove(key)
+      if record["op"] == "delete":
+        self.memories.remove(key)
+        self._pending_refs.pop(key, None)
+        continue
+      entry = self._normalize_item(dict(record["entry"]), valid_tags)
+      if entry is None:
+        self.memories.remove(key)
+        continue
+      self.memories.put(key, **entry)
+      # まだ書き込んでいない参照回数の増加分は取り込んだ値に上乗せする
+      pending = self._pending_refs.get(key, 0)
+      if pending:
+        self.memories.add_reference(key, pending)
+      self._index_put(key)
+
+  def _read_feed(self) -> Optional[List[MemoryRecord]]:
+    """変更フィードから最後に同期してからの変更を読む（ロックを取って呼ぶ。読めない場合はNone）"""
+    changes = self.change_feed.read_since(self.storage.version)
+    if changes is None:
+      return None
+    records, version = changes
+    # 現在のバージョンまで欠けずに読めた場合だけ使う（ロックを取っているので書き込み中のプロセスはない）
+    if version != self.storage.store_version.read():
+      return None
+    self.storage.version = version
+    return records
+
+  def _diff(self, snapshot: MemorySnapshot) -> List[MemoryRecord]:
+    """読み込み直した全メモリと現在のメモリの差分を変更レコードにする"""
+    records: List[MemoryRecord] = [{"op": "delete", "key": key} for key in self.memories if key not in snapshot]
+    for key, item in snapshot.items():
+      if key not in self.memories:
+        records.append({"op": "put", "key": key, "entry": item})
+        continue
+      # 書き込んでいない参照があるメモリは、減衰した参照回数が一致しないため常に取り込み直す
+      current = self.memories.entry(key)
+      if key in self._pending_refs or item != current:
+        records.append({"op": "put", "key": key, "entry": item})
+    return records
+
+  def _contents_fingerprint(self) -> int:
+    """メモリ上の検索インデックスにあるメモリ（階層化しない場合は全メモリ）の内容のフィンガープリント"""
+    return contents_fingerprint((key, self.memories.content(key)) for key in self.fuzzy_choices.keys)
+
+  def save_ngram_index(self):
+    """n-gramインデックスをメモリファイルと同じ場所に保存する"""
+    with self._lock:
+      self.ngram_index.save(self.ngram_index_file, self._contents_fingerprint())
+
+  def _index_put(self, key: str, with_ngrams: bool = True):
+    """追加・更新されたメモリをインデックスに反映する（階層化する場合、coldのメモリはディスク上のインデックスに置く）"""
+    if self.cold_index is not None and not self.memories.is_hot(key, HOT_PRIORITIES, HOT_TAGS, self._hot_since()):
+      self._demote(key)
+      return
+    self._index_hot(key, with_ngrams)
+
+  def _index_hot(self, key: str, with_ngrams: bool = True):
+    """メモリ上の検索インデックスにメモリを置く"""
+    content = self.memories.content(key)
+    self.fuzzy_choices.set(key, content)
+    if self.vector_index is not None:
+      self.vector_index.set(key, content)
+    if with_ngrams:
+      self.ngram_index.add(key, content)
+
+  def _index_remove(self, key: str):
+    """削除・更新されるメモリをインデックスから取り除く"""
+    self._unindex_hot(key)
+    if self.cold_index is not None:
+      # 取り除いた後も（削除前の保管や上書きまでの間に）内容を読めるよう、表に戻しておく
+      self.memories.restore(key)
+      self._cold.discard(key)
+      self.cold_index.remove(key)
+
+  def _unindex_hot(self, key: str):
+    self.fuzzy_choices.remove(key)
+    if self.vector_index is not None:
+      self.vector_index.remove(key)
+    self.ngram_index.remove(key)
+
+  def _hot_since(self) -> int:
+    """これ以降に参照・更新されたメモリをhotにする時刻（current_secondsの秒数）"""
+    return current_seconds() - int(self.hot_days * 86400)
+
+  def _demote(self, key: str):
+    """メモリをcoldにする（内容はディスク上のインデックスに移し、表からは手放す）"""
+    self._cold.add(key)
+    self.cold_index.put(key, self.memories.content(key))
+    self.memories.offload(key)
+
+  def _promote(self, keys: List[str]):
+    """coldのメモリをhotに昇格する（ディスク上のインデックスには残しておく）"""
+    promoted = [key for key in keys if key in self._cold]
+    for key in promoted:
+      self._cold.discard(key)
+      self.memories.restore(key)
+      self._index_hot(key)
+    if promoted:
+      self._tier_version += 1
+
+  def _rebalance_tiers(self, force: bool = False):
+    """
+    参照・更新の日時からメモリの層を決め直す（_write_pending()から呼ぶ。ディスク上のインデックスへの書き込みも同じ時に行う）
+
+    前回からtier_rebalance_interval秒経っていなければ何もしない（forceの場合は常に行う）。
+    """
+    if self.cold_index is None:
+      return
+    if not force and time.monotonic() - self._rebalanced_at < self.tier_rebalance_interval:
+      return
+    self._rebalanced_at = time.monotonic()
+    hot = self.memories.hot_rows(HOT_PRIORITIES, HOT_TAGS, self._hot_since())
+    cold = {self.memories.keys[row] for row in np.flatnonzero(~hot).tolist()}
+    demoted = [key for key in cold if key not in self._cold]
+    for key in demoted:
+      self._unindex_hot(key)
+      self._demote(key)
+    self._promote([key for key in self._cold if key not in cold])
+    if demoted:
+      self._tier_version += 1
+
+  def tier_info(self) -> Optional[dict[str, int]]:
+    """hot・coldの層のメモリの数（階層化しない場合はNone）"""
+    with self._lock:
+      if self.cold_index is None:
+        return None
+      return {"hot": len(self.fuzzy_choices), "cold": len(self._cold)}
+
+  def _snapshot(self) -> MemorySnapshot:
+    """全メモリを辞書形式に変換する"""
+    return self.memories.entries()
+
+  def _save_memories(self, keys: List[str]):
+    """
+    変更したメモリをストレージに書き込む（_transaction()の中で呼ぶ）
+
+    溜まっている参照回数も一緒に書き込む。deferred_writesの場合は書き込み待ちにしてflush()で書き込む。
+    """
+    for key in keys:
+      self._dirty[key] = "put" if key in self.memories else "delete"
+    if not self.deferred_writes:
+      self._write_pending()
+
+  def _put_record(self, key: str) -> MemoryRecord:
+    return {"op": "put", "key": key, "entry": self.memories.entry(key)}
+
+  def _write_pending(self):
+    """
+    書き込み待ちの変更と参照回数をストレージに書き込む（_transaction()の中で呼ぶ）
+
+    階層化する場合はここでメモリの層を決め直し、ディスク上のインデックスへの変更もまとめて書き込む。
+    """
+    self._rebalance_tiers()
+    records = [self._put_record(key) for key in self._pending_refs if key in self.memories and key not in self._dirty]
+    for key, op in self._dirty.items():
+      records.append(self._put_record(key) if op == "put" else {"op": "delete", "key": key})
+    # 書き込みに失敗した場合（appendが例外を送出した場合）は書き込み待ちのまま残す
+    if records:
+      self.storage.append(records, self._snapshot)
+      # 他のプロセスがメモリを読み込み直さずに済むよう、変更フィードと統計情報を書き込んだバージョンと一緒に保存する
+      # （保存できなくても読み出し側で作り直せるため、書き込み自体は失敗にしない）
       try:
-        with open(self.memory_file, "r", encoding="utf-8") as f:
-          data = json.load(f)
-          for key, item in data.items():
-            # 過去のデータにpriorityフィールドがない場合は"mid"をデフォルト値として設定
-            if "priority" not in item:
-              item["priority"] = "mid"
-            # 過去のデータにreference_countフィールドがない場合は0をデフォルト値として設定
-            if "reference_count" not in item:
-              item["reference_count"] = 0
-            # タグがENUMのリストにあるかチェック
-            tmp_tags = []
-            for tag in item["tags"]:
-              if tag in [t.value for t in MemoryTag]:
-                tmp_tags.append(tag)
-            item["tags"] = tmp_tags if tmp_tags else [MemoryTag.PERSONALITY.value]
-
-            try:
-              self.memories[key] = MemoryEntry(**item)
-            except Exception as e:
-              print(f"Warning: Failed to load memory item: {e}, item: {item}")
-              continue
-      except (json.JSONDecodeError, KeyError):
-        self.memories = {}
-    else:
-      self.memories = {}
-
-  def _save_memories(self):
-    """メモリをファイルに保存する"""
-    self.memory_file.parent.mkdir(parents=True, exist_ok=True)
-    # MemoryEntryオブジェクトを辞書形式に変換して保存
-    memories_dict = {key: memory.model_dump() for key, memory in self.memories.items()}
-    with open(self.memory_file, "w", encoding="utf-8") as f:
-      json.dump(memories_dict, f, ensure_ascii=False, indent=2)
+        self.change_feed.publish(self.storage.version, records)
+        save_stats(self.memory_file, self.storage.version, self._stats())
+      except OSError as e:
+        print(f"Warning: Failed to publish memory changes: {e}", file=sys.stderr)
+    if self.cold_index is not None:
+      self.cold_index.flush()
+    self._dirty.clear()
+    self._pending_refs.clear()
+    self._pending_ref_count = 0
+    if self._ref_flush_timer is not None:
+      self._ref_flush_timer.cancel()
+      self._ref_flush_timer = None
+
+  def _add_references(self, keys: List[str]):
+    """参照回数をインクリメントする（書き込みは閾値・タイマー・終了時にまとめて行う）"""
+    with self._lock:
+      for key in keys:
+        self.memories.add_reference(key)
+        self._pending_refs[key] = self._pending_refs.get(key, 0) + 1
+      self._pending_ref_count += len(keys)
+
+      if self._pending_ref_count >= self.ref_flush_threshold:
+        self.flush()
+      elif self._pending_refs and self._ref_flush_timer is None:
+        self._ref_flush_timer = threading.Timer(self.ref_flush_interval, self.flush)
+        self._ref_flush_timer.daemon = True
+        self._ref_flush_timer.start()
+
+  def flush(self):
+    """書き込み待ちの変更と溜まっている参照回数をストレージに書き込む"""
+    with self._lock:
+      if not self._dirty and not self._pending_refs:
+        return
+      with self._transaction():
+        self._write_pending()
+
+  def search_cache_info(self) -> dict[str, int]:
+    """検索結果のキャッシュのヒット・ミスの回数と件数・容量（容量の調整用）"""
+    with self._lock:
+      return self.search_cache.info()
+
+  def close(self):
+    """書き込み待ちの変更と参照回数を書き込み、n-gramインデックスを保存してストレージを閉じる"""
+    self.flush()
+    self.save_ngram_index()
+    if self.cold_index is not None:
+      with self._lock:
+        self.cold_index.close()
+    self.storage.close()
+
+  def _new_key(self, now: datetime.datetime) -> str:
+    """新しいメモリのキーを発行する（_transaction()の中で呼ぶ）"""
+    key = self._keys.next(now)
+    # 他のプロセスの識別子と偶然一致した場合に備え、取り込んだメモリと重なるキーは使わない
+    while key in self.memories:
+      key = self._keys.next(now)
+    return key
+
+  def add_memory(self, tags: List[str], content: str, priority: str) -> Tuple[str, bool]:
+    """新しいメモリを追加し、(キー, 既存のメモリにまとめたか) を返す"""
+    return self.add_memories([{"tags": tags, "content": content, "priority": priority}])[0]
+
+  def add_memories(self, items: List[dict[str, Any]]) -> List[Tuple[str, bool]]:
+    """
+    複数のメモリをまとめて追加し、(発行したキー, 他のメモリにまとめたか) を追加した順に返す
+
+    itemsはtags・content・priorityを持つ辞書のリストで、ストレージへの書き込みは1回にまとめて行う。
+    未知のタグを含むものがある場合はValueErrorを送出し、1件も追加しない。
+    dedup_modeがmergeの場合、既存のメモリや同時に追加するメモリと重複するものはまとめ、まとめた先のキーを返す
+    （まとめた先が追加したメモリ自身の場合はまとめていないものとする）。
+    件数がcapacityを超えた場合は、追加したもの以外からeviction_policyの順に追い出す。
+    """
+    now = datetime.datetime.now()
+    timestamp = now.strftime("%Y%m%d%H%M%S")
+    with self._transaction():
+      entries = [
+        (
+          self._new_key(now),
+          {
+            "tags": item["tags"],
+            "content": item["content"],
+            "priority": item["priority"],
+            "created_at": timestamp,
+            "updated_at": timestamp,
+            "reference_count": 0,
+          },
+        )
+        for item in items
+      ]
+      self.memories.extend(entries)
+      keys = [key for key, _ in entries]
+      for key in keys:
+        self._index_put(key)
+      added = set(keys)
+      changed = list(keys)
+      results = [(key, False) for key in keys]
+      if self.dedup_mode == "merge":
+        survivors, merged = self._merge_duplicates(keys)
+        results = [(survivors.get(key, key), survivors.get(key, key) != key) for key in keys]
+        changed += merged
+      changed += self._evict(frozenset(key for key, _ in results))
+      # 追加してすぐにまとめたメモリはまだ書き込んでいないので削除を書き込まない
+      self._save_memories([key for key in dict.fromkeys(changed) if key in self.memories or key not in added])
+    return results
 
-  def add_memory(self, tags: List[str], content: str, priority: str) -> bool:
-    """新しいメモリを追加"""
-    now = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    memory = MemoryEntry(
-      tags=tags,
-      content=content,
-      priority=priority,
-      created_at=now,
-      updated_at=now,
-      reference_count=0,
+  def _evict(self, protected: frozenset[str]) -> List[str]:
+    """
+    件数がcapacityを超えていれば超えた分を追い出して保管場所に移し、追い出したキーを返す
+    （_transaction()の中で呼ぶ。書き込みは呼び出し側で行う）
+
+    protectedのキー（追加したばかりのメモリ）は追い出さない。保管場所に書き込めない場合は追い出さない。
+    """
+    if self.capacity <= 0 or len(self.memories) <= self.capacity:
+      return []
+    evicted = self.memories.eviction_candidates(len(self.memories) - self.capacity, protected)
+    if not evicted:
+      return []
+    try:
+      self.archive.append([(key, self.memories.entry(key)) for key in evicted], self.memories.eviction_policy)
+    except OSError as e:
+      print(f"Warning: Failed to archive evicted memories: {e}", file=sys.stderr)
+      return []
+    for key in evicted:
+      self._index_remove(key)
+      self.memories.remove(key)
+      self._pending_refs.pop(key, None)
+    return evicted
+
+  def _merge_duplicates(self, keys: List[str]) -> Tuple[dict[str, str], List[str]]:
+    """
+    keysのメモリと重複しているメモリをまとめる（_transaction()の中で呼ぶ。書き込みは呼び出し側で行う）
+
+    n-gramインデックスの候補とだけ比較する。(まとめたメモリのキー -> 残したキー, 変更・削除したキー) を返す。
+    """
+    items = [(key, self.memories.content(key)) for key in keys]
+    pairs = similar_pairs(self.fuzzy_choices, self.ngram_index, items, self.dedup_threshold)
+    survivors: dict[str, str] = {}
+    changed: List[str] = []
+    now = current_seconds()
+    for members, similarity in cluster_pairs(pairs):
+      group = self._merge_group(members, similarity, True, now)
+      survivors.update((key, group.keep) for key in members)
+      changed += [group.keep, *group.duplicates]
+    return survivors, changed
+
+  def _merge_group(self, keys: List[str], similarity: float, apply: bool, now: int) -> MemoryMergeGroup:
+    """
+    重複したメモリのまとめ方を求め、applyの場合はまとめる（self._lockを取って呼ぶ。書き込みは呼び出し側で行う）
+
+    減衰させた参照回数はnow（current_secondsの秒数）まで減衰させてから合計し、nowに参照されたものとする。
+    """
+    keep, duplicates, entry = merge_entries(
+      [(key, self.memories.entry(key)) for key in keys], self.memories.priority_names
     )
-    self.memories[f"memory_{now}"] = memory
-    self._save_memories()
-    return True
+    if apply:
+      decayed = float(self.memories.decayed_references(keys, now).sum())
+      for key in keys:
+        self._index_remove(key)
+      for key in duplicates:
+        self.memories.remove(key)
+        self._pending_refs.pop(key, None)
+      referenced_at = seconds_to_timestamp(now) if decayed > 0 else ""
+      self.memories.put(keep, **entry, decayed_reference_count=decayed, referenced_at=referenced_at)
+      self._index_put(keep)
+    return MemoryMergeGroup(
+      keep=keep,
+      duplicates=duplicates,
+      similarity=similarity,
+      content=entry["content"],
+      tags=entry["tags"],
+      priority=entry["priority"],
+      merged=apply,
+    )
+
+  def deduplicate(self, apply: bool = False, threshold: Optional[float] = None) -> List[MemoryMergeGroup]:
+    """
+    全メモリから重複したメモリのまとまりを探す
+
+    applyがFalseの場合はまとめ方の計画だけを返し、Trueの場合はまとめてストレージに書き込む。
+    thresholdを省略した場合はdedup_thresholdを使う。
+    """
+    threshold = self.dedup_threshold if threshold is None else threshold
+    if not apply:
+      with self._lock:
+        self._refresh()
+        return [self._merge_group(keys, score, False, 0) for keys, score in self._find_duplicates(threshold)]
+    with self._transaction():
+      now = current_seconds()
+      groups = [self._merge_group(keys, score, True, now) for keys, score in self._find_duplicates(threshold)]
+      changed = [key for group in groups for key in (group.keep, *group.duplicates)]
+      if changed:
+        self._save_memories(changed)
+      return groups
+
+  def _find_duplicates(self, threshold: float) -> List[Tuple[List[str], float]]:
+    """全メモリの重複したまとまり（キーのリスト, 最小の類似度）を返す（self._lockを取って呼ぶ）"""
+    choices = self.fuzzy_choices
+    if self._cold:
+      # coldのメモリはメモリ上のインデックスにないので、全メモリの前処理済みの内容を一時的に作る
+      choices = FuzzyChoices(workers=self.fuzzy_choices.workers)
+      for key in self.memories.keys:
+        choices.set(key, self.memories.content(key))
+    return cluster_pairs(all_similar_pairs(choices, threshold))
 
   def update_memory(self, key: str, content: str) -> bool:
     """指定されたキーのメモリを更新"""
+    return self.update_memories([(key, content)])[0]
+
+  def update_memories(self, updates: List[Tuple[str, str]]) -> List[bool]:
+    """
+    複数のメモリの内容をまとめて更新し、(キー, 内容) ごとの成否を返す
+
+    存在しないキーは更新せずFalseを返す。ストレージへの書き込みは1回にまとめて行う。
+    """
     now = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    if key in self.memories.keys():
-      self.memories[key].content = content
-      self.memories[key].updated_at = now
-      self._save_memories()
-      return True
-    return False
+    results: List[bool] = []
+    with self._transaction():
+      for key, content in updates:
+        if key not in self.memories:
+          results.append(False)
+          continue
+        self._index_remove(key)
+        self.memories.set_content(key, content, now)
+        self._index_put(key)
+        results.append(True)
+      updated = [key for (key, _), result in zip(updates, results) if result]
+      if updated:
+        self._save_memories(updated)
+    return results
 
   def get_memory_by_key(self, key: str) -> Optional[MemoryEntry]:
     """指定されたキーのメモリを取得"""
-    return self.memories.get(key)
-
-  def search_memories(self, query: str, tag: Optional[str] = None) -> List[MemorySearchResult]:
-    """メモリを検索"""
-    results: List[MemorySearchResult] = []
-    filtered_memories: dict[str, MemoryEntry] = {}
-
-    # contentからMemoryを参照するための辞書
-    # contentが重複している場合は最後のものが優先される
-
+    with self._lock:
+      self._refresh()
+      if key not in self.memories:
+        return None
+      return MemoryEntry(**self.memories.entry(key))
+
+  def search_memories(
+    self,
+    query: str,
+    tags: Optional[List[str] | str] = None,
+    match_all: bool = False,
+    limit: int = 5,
+    min_score: float = 0,
+  ) -> List[MemorySearchResult]:
+    """
+    メモリを検索
+
+    tagsを指定した場合はタグのビットマスクで候補を絞り込む。
+    match_all=Trueで全てのタグを持つもの（AND）、Falseでいずれかのタグを持つもの（OR）が対象になる。
+    スコア（関連度に優先度・新しさ・参照回数を加味したもの）の高い順にmin_score以上のものを最大limit件返す。
+    """
+    return self.search_memories_batch([query], tags, match_all, limit, min_score)[0]
+
+  def search_memories_batch(
+    self,
+    queries: List[str],
+    tags: Optional[List[str] | str] = None,
+    match_all: bool = False,
+    limit: int = 5,
+    min_score: float = 0,
+  ) -> List[List[MemorySearchResult]]:
+    """
+    複数のクエリでメモリを検索（スコアは1回の呼び出しでまとめて計算する）
+
+    関連度は (正規化したクエリ, タグ, match_all, 表のバージョン) をキーにキャッシュし、
+    メモリが変更されるまでは同じクエリの関連度を計算し直さない。優先度・新しさ・参照回数を加味した順位付けは
+    呼び出しごとに現在の値で行う。キャッシュに当たった場合も参照回数は増やす。
+    """
+    with self._lock:
+      self._refresh()
+
+      if isinstance(tags, str):
+        tags = [tags]
+      tag_filter = tuple(sorted(set(tags))) if tags else None
+      cache_keys = [
+        (normalize_query(query), tag_filter, match_all, self.memories.version, self._tier_version) for query in queries
+      ]
+      relevant = [self.search_cache.get(cache_key) for cache_key in cache_keys]
+      missing = [i for i, matched in enumerate(relevant) if matched is None]
+      if missing:
+        computed = self._match([queries[i] for i in missing], tags, match_all)
+        for i, matched in zip(missing, computed):
+          relevant[i] = matched
+          self.search_cache.put(cache_keys[i], matched)
+      matched_memories = [self._rank(keys, relevance, limit, min_score) for keys, relevance in relevant]
+
+      # hotのメモリだけでlimit件に満たない場合はcoldのメモリも検索し、見つかったものはhotに昇格する
+      if self.cold_index is not None and self._cold:
+        for i, matched in enumerate(matched_memories):
+          if len(matched) >= limit:
+            continue
+          cold_keys, cold_relevance = self._match_cold(queries[i], tags, match_all, cache_keys[i])
+          if cold_keys:
+            keys, relevance = relevant[i]
+            matched_memories[i] = self._rank(
+              keys + cold_keys, np.concatenate([relevance, cold_relevance]), limit, min_score
+            )
+        self._promote([key for matched in matched_memories for key, _ in matched])
+
+      # 参照回数をインクリメントする（ファイルへの書き込みは行わない）
+      self._add_references([key for matched in matched_memories for key, _ in matched])
+
+      results: List[List[MemorySearchResult]] = []
+      for matched in matched_memories:
+        query_results: List[MemorySearchResult] = []
+        for key, score in matched:
+          query_results.append(MemorySearchResult(key=key, score=score, **self.memories.entry(key)))
+        results.append(query_results)
+      return results
+
+  def _match(
+    self, queries: List[str], tags: Optional[List[str]], match_all: bool
+  ) -> List[Tuple[List[str], np.ndarray]]:
+    """
+    クエリごとに関連度がMIN_RELEVANCE以上のメモリの (キーのリスト, 関連度の配列) を返す（self._lockを取って呼ぶ）
+
+    n-gramインデックスでクエリごとに候補を絞り込み、その和集合に対してだけファジー検索のスコアを計算する。
+    hybridモードではベクトル検索の上位も候補に加え、ファジー検索のスコア（0-100）とコサイン類似度（x100）を
+    vector_weightで重み付けして合算したものをスコアにする。コサイン類似度がMIN_SIMILARITY未満のものは0として扱う。
+    """
     # タグによるフィルタ
-    if tag:
-      filtered_memories = {key: memory for key, memory in self.memories.items() if tag in memory.tags}
-    else:
-      filtered_memories = self.memories.copy()
+    tagged_keys = self.memories.select_tags(tags, match_all) if tags else None
+
+    # n-gramによる候補の絞り込み（n-gramを作れない短いクエリがある場合はタグで絞り込んだ全件が対象）
+    candidates: Optional[set[str]] = set()
+    for query in queries:
+      shortlist = self.ngram_index.shortlist(query, self.search_shortlist_size, tagged_keys)
+      if shortlist is None:
+        candidates = tagged_keys
+        break
+      candidates.update(shortlist)
+
+    # ベクトル検索（クエリごとに1回の行列ベクトル積で全メモリとの類似度を計算する）
+    similarities = []
+    if self.vector_index is not None:
+      vector_keys = self.vector_index.keys
+      # タグで絞り込んだキーにはcoldのメモリも含まれるので、ベクトルのインデックスにあるもの（hot）だけにする
+      allowed_rows = (
+        self.vector_index.rows_of([key for key in tagged_keys if key in self.vector_index])
+        if tagged_keys is not None
+        else None
+      )
+      for query in queries:
+        query_similarities = self.vector_index.similarities(query)
+        similarities.append(query_similarities)
+        if candidates is None:
+          continue
+        if allowed_rows is None:
+          ranked = top_k(vector_keys, query_similarities, self.search_shortlist_size, MIN_SIMILARITY)
+        else:
+          allowed_keys = [vector_keys[row] for row in allowed_rows]
+          ranked = top_k(allowed_keys, query_similarities[allowed_rows], self.search_shortlist_size, MIN_SIMILARITY)
+        candidates.update(key for key, _ in ranked)
 
     # 類似度検索
-    matched_memories = process.extract(
-      query,
-      {key: memory.content for key, memory in filtered_memories.items()},
-      limit=5,
-      scorer=fuzz.partial_ratio,
-      score_cutoff=20,
-    )
-
-    for _, score, key in matched_memories:
-      # 参照回数をインクリメントする
-      self.memories[key].reference_count += 1
-
-      results.append(
-        MemorySearchResult(
-          key=key,
-          tags=filtered_memories[key].tags,
-          content=filtered_memories[key].content,
-          priority=filtered_memories[key].priority,
-          created_at=filtered_memories[key].created_at,
-          updated_at=filtered_memories[key].updated_at,
-          reference_count=filtered_memories[key].reference_count,
-          score=score,
-        )
-      )
-    self._save_memories()
-    return results
+    keys, scores = self.fuzzy_choices.scores(queries, candidates)
+    if similarities:
+      rows = self.vector_index.rows_of(keys)
+      for i, query_similarities in enumerate(similarities):
+        vector_scores = query_similarities[rows]
+        vector_scores = np.where(vector_scores >= MIN_SIMILARITY, np.minimum(vector_scores, 1), 0) * 100
+        scores[i] = (1 - self.vector_weight) * scores[i] + self.vector_weight * vector_scores
+    matched = []
+    for row in scores:
+      relevant = np.flatnonzero(row >= MIN_RELEVANCE)
+      matched.append(([keys[i] for i in relevant.tolist()], row[relevant]))
+    return matched
+
+  def _match_cold(
+    self, query: str, tags: Optional[List[str]], match_all: bool, cache_key: tuple
+  ) -> Tuple[List[str], np.ndarray]:
+    """
+    coldのメモリのうちクエリとの関連度がMIN_RELEVANCE以上のものの (キーのリスト, 関連度の配列) を返す
+
+    ディスク上の全文検索インデックスで候補を絞り込み、表の内容でファジー検索のスコアを計算する。
+    結果はhotの結果と同じキャッシュに別のキーで入れる。
+    """
+    cache_key = (*cache_key, "cold")
+    cached = self.search_cache.get(cache_key)
+    if cached is not None:
+      return cached
+    tagged_keys = self.memories.select_tags(tags, match_all) if tags else None
+    candidates = [
+      key
+      for key in self.cold_index.search(query, self.search_shortlist_size)
+      if key in self._cold and (tagged_keys is None or key in tagged_keys)
+    ]
+    scores = fuzzy_scores(query, [self.memories.content(key) for key in candidates], self.fuzzy_choices.workers)
+    relevant = np.flatnonzero(scores >= MIN_RELEVANCE)
+    matched = ([candidates[i] for i in relevant.tolist()], scores[relevant])
+    self.search_cache.put(cache_key, matched)
+    return matched
+
+  def _rank(self, keys: List[str], relevance: np.ndarray, limit: int, min_score: float) -> List[Tuple[str, float]]:
+    """関連度に優先度・新しさ・参照回数を加味したスコアの高い順に、min_score以上の (キー, スコア) を最大limit件返す"""
+    if not keys:
+      return []
+    priority_codes, updated_at, reference_counts = self.memories.signals(keys)
+    scores = self.ranker.scores(relevance, self.memories.priority_names, priority_codes, updated_at, reference_counts)
+    return top_k(keys, scores, limit, min_score)
 
   def get_all_memories(self) -> List[MemorySearchResult]:
     """全てのメモリを取得"""
-    return [
-      MemorySearchResult(
-        key=key,
-        tags=memory.tags,
-        content=memory.content,
-        priority=memory.priority,
-        created_at=memory.created_at,
-        updated_at=memory.updated_at,
-        reference_count=memory.reference_count,
-        score=0,
-      )
-      for key, memory in self.memories.items()
-    ]
+    with self._lock:
+      self._refresh()
+      return [MemorySearchResult(key=key, score=0, **self.memories.entry(key)) for key in self.memories]
+
+  def list_memories(
+    self,
+    order_by: str = "recency",
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    preview_chars: Optional[int] = None,
+  ) -> MemoryPage:
+    """
+    メモリを1ページ分取得する
+
+    order_by: recency（更新が新しい順） / priority（優先度の高い順） / reference_count（参照回数の多い順） /
+              least_useful（減衰させた参照回数の少ない順。しばらく参照されていないメモリが前に並ぶ）
+    cursorには前のページのnext_cursorを渡す。fieldsで返すフィールドを、preview_charsでcontentの長さを絞れる。
+    """
+    after = decode_cursor(cursor, order_by) if cursor else None
+    with self._lock:
+      self._refresh()
+      # 次のページがあるかどうかを知るため1件多く取得する
+      keys = self.memories.ordered_keys(order_by, limit + 1, after)
+      page_keys = keys[:limit]
+      items = [project({"key": key, **self.memories.entry(key)}, fields, preview_chars) for key in page_keys]
+      next_cursor = None
+      if len(keys) > limit and page_keys:
+        last = page_keys[-1]
+        next_cursor = encode_cursor(order_by, self.memories.sort_values(order_by, last), last)
+      return MemoryPage(items=items, next_cursor=next_cursor, total=len(self.memories))
+
+  def _stats(self) -> dict[str, Any]:
+    return self.memories.stats.summary(self.memories.latest_contents(LATEST_CONTENTS))
+
+  def get_memory_stats(self) -> dict[str, Any]:
+    """メモリの統計情報を取得（変更のたびに更新している集計を返す）"""
+    with self._lock:
+      self._refresh()
+      return self._stats()
 
   def delete_memory(self, key: str) -> bool:
     """指定されたキーのメモリを削除"""
-    if key in self.memories:
-      del self.memories[key]
-      self._save_memories()
-      return True
-    return False
+    return self.delete_memories([key])[0]
+
+  def delete_memories(self, keys: List[str]) -> List[bool]:
+    """
+    複数のメモリをまとめて削除し、キーごとの成否を返す
+
+    存在しないキーはFalseを返す。ストレージへの書き込みは1回にまとめて行う。
+    """
+    results: List[bool] = []
+    with self._transaction():
+      for key in keys:
+        if key not in self.memories:
+          results.append(False)
+          continue
+        self._index_remove(key)
+        self.memories.remove(key)
+        results.append(True)
+      deleted = [key for key, result in zip(keys, results) if result]
+      if deleted:
+        self._save_memories(deleted)
+    return results
+
+  def export_ndjson(self, f: IO[str], progress: Optional[Progress] = None) -> int:
+    """
+    全メモリを1行1件のJSON（NDJSON）でfに書き出し、書き出した件数を返す
+
+    各行は {"key": キー, 保存形式のフィールド...}。1件ずつ辞書にして書き出すので全体の写しは作らない。
+    書き出している間、他のスレッドからの変更は待たせる。
+    """
+    with self._lock:
+      self._refresh()
+      return write_records(f, ({"key": key, **self.memories.entry(key)} for key in self.memories), progress)
+
+  def import_ndjson(
+    self, f: IO[str], batch_size: int = TRANSFER_BATCH_SIZE, progress: Optional[Progress] = None
+  ) -> Tuple[int, int]:
+    """
+    NDJSONのメモリを読み込んで保存し、(取り込んだメモリの数, 飛ばした行数) を返す
+
+    batch_size行ごとに1回のトランザクションで表に入れ、読み込んだ行はそこで手放す（表には全メモリが載る。
+    階層化する場合、coldのメモリの内容はディスク上のインデックスに移る）。
+    変更を追記する保存方式（journal・sqlite）ではバッチごとに書き込み、全体を書き直す保存方式（json・binary）では
+    最後に1回だけ書き込む。keyがある行はそのキーで追加・上書きし、ない行には新しいキーを発行する。
+    同じバッチ内で同じキーの行は後のものだけを1件として数える。検証できない行は飛ばす。
+    移行したデータをそのまま保存するため、重複のまとめと件数の上限による追い出しは行わない。
+    """
+    valid_tags = {t.value for t in MemoryTag}
+    imported = skipped = 0
+    for batch in itertools.batched(read_records(f), batch_size):
+      entries: List[Tuple[Optional[str], dict[str, Any]]] = []
+      for number, record in batch:
+        key = record.pop("key", None) if record is not None else None
+        entry = self._normalize_item(record, valid_tags) if record is not None else None
+        if entry is None or (key is not None and not isinstance(key, str)):
+          print(f"Warning: Skipped invalid memory at line {number}", file=sys.stderr)
+          skipped += 1
+          continue
+        entries.append((key, entry))
+      if entries:
+        imported += self._import_batch(entries)
+      if progress is not None:
+        progress(imported)
+    self.flush()
+    return imported, skipped
+
+  def _import_batch(self, entries: List[Tuple[Optional[str], dict[str, Any]]]) -> int:
+    """インポートした1回分のメモリを表に入れ、入れたメモリの数を返す（キーが同じ行は後のものを使う）"""
+    now = datetime.datetime.now()
+    with self._transaction():
+      batch = {key if key is not None else self._new_key(now): entry for key, entry in entries}
+      for key in batch:
+        if key in self.memories:
+          self._index_remove(key)
+          self._pending_refs.pop(key, None)
+      self.memories.extend(batch.items())
+      for key in batch:
+        self._index_put(key)
+      for key in batch:
+        self._dirty[key] = "put"
+      # 全体を書き直す保存方式では、書き込みはimport_ndjsonの最後にまとめる
+      if not self.storage.rewrites_snapshot:
+        self._write_pending()
+    return len(batch)
+
+
+def memory_shard_file(memory_file: str | Path, user_id: Optional[str] = None) -> Path:
+  """
+  ユーザごとのメモリファイル（シャード）のパス
+
+  memory_fileと同じディレクトリの users/<user_id>/ 以下に同じファイル名で保存する。
+  user_idを省略した場合は従来どおりmemory_fileそのものを使う。パスを返すだけでファイルには触らない。
+  """
+  memory_file = Path(memory_file)
+  if not user_id:
+    return memory_file
+  # パスとして安全な文字だけにする（"."も変換して ".." などでディレクトリを抜けられないようにする）
+  shard_name = quote(user_id, safe="").replace(".", "%2E")
+  return memory_file.parent / "users" / shard_name / memory_file.name
+
+
+class MemoryShardPool:
+  """
+  ユーザごとに分割したメモリ（シャード）を管理するクラス
+
+  シャードは最初にアクセスされたときに読み込み、常駐しているシャードがmax_residentを超えたら
+  最も長く使われていないものから書き込みを済ませて閉じる。
+  legacy_ownerを指定した場合、ユーザごとに分割する前のメモリ（memory_fileにあるもの）は
+  そのユーザのシャードを読み込むときに移す（指定しない場合は移さず、どのユーザからも見えない）。
+  """
+
+  def __init__(
+    self, memory_file: str, max_resident: int = 64, legacy_owner: Optional[str] = None, **manager_options: Any
+  ):
+    self.memory_file = Path(memory_file)
+    self.max_resident = max_resident
+    self.legacy_owner = legacy_owner
+    self.manager_options = manager_options
+    self._shards: OrderedDict[Optional[str], MemoryManager] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, user_id: Optional[str] = None) -> MemoryManager:
+    """ユーザのメモリマネージャーを取得（常駐していなければ読み込む）"""
+    with self._lock:
+      manager = self._shards.get(user_id)
+      if manager is not None:
+        self._shards.move_to_end(user_id)
+        return manager
+
+      shard_file = memory_shard_file(self.memory_file, user_id)
+      if user_id and user_id == self.legacy_owner and migrate_store(self.memory_file, shard_file):
+        print(f"Moved memories in {self.memory_file} to the shard of user {user_id}", file=sys.stderr)
+      manager = MemoryManager(str(shard_file), **self.manager_options)
+      self._shards[user_id] = manager
+      while len(self._shards) > self.max_resident:
+        _, evicted = self._shards.popitem(last=False)
+        evicted.close()
+      return manager
+
+  def resident_users(self) -> List[Optional[str]]:
+    """常駐しているシャードのユーザID（古い順）"""
+    with self._lock:
+      return list(self._shards.keys())
+
+  def flush(self):
+    """常駐している全てのシャードの書き込み待ちの変更を書き込む"""
+    with self._lock:
+      managers = list(self._shards.values())
+    for manager in managers:
+      manager.flush()
+
+  def close(self):
+    """全てのシャードを閉じる"""
+    with self._lock:
+      while self._shards:
+        _, manager = self._shards.popitem()
+        manager.close()
 
 
 # 環境変数からメモリファイルの保存場所を取得
 USER_MEMORY_FILE = os.environ.get("USER_MEMORY_FILE", "user_memory.json")
 
-# メモリマネージャーのインスタンス
-memory_manager = MemoryManager(USER_MEMORY_FILE)
+# メモリの保存方式 (json: 従来のJSONファイル / journal: スナップショット + 追記ログ / sqlite: SQLite / binary: バイナリスナップショット)
+USER_MEMORY_STORAGE = os.environ.get("USER_MEMORY_STORAGE", "json")
+
+# 書き込んだメモリをディスクに同期（fsync）する方針
+# (always: 書き込みごと / group: USER_MEMORY_FSYNC_INTERVAL_MSミリ秒ごとにまとめて / none: OSに任せる)
+USER_MEMORY_FSYNC = os.environ.get("USER_MEMORY_FSYNC", "always")
+USER_MEMORY_FSYNC_INTERVAL_MS = int(os.environ.get("USER_MEMORY_FSYNC_INTERVAL_MS", "100"))
+
+# メモリの検索方式 (fuzzy: ファジー検索 / hybrid: ベクトル検索とファジー検索の合算)
+USER_MEMORY_SEARCH_MODE = os.environ.get("USER_MEMORY_SEARCH_MODE", "fuzzy")
+
+# 検索結果の順位付けで関連度に加味する優先度・新しさ・参照回数の重み（0-1、合計1以下）と、新しさが半分になる日数
+USER_MEMORY_RANK_PRIORITY_WEIGHT = float(os.environ.get("USER_MEMORY_RANK_PRIORITY_WEIGHT", "0.1"))
+USER_MEMORY_RANK_RECENCY_WEIGHT = float(os.environ.get("USER_MEMORY_RANK_RECENCY_WEIGHT", "0.1"))
+USER_MEMORY_RANK_POPULARITY_WEIGHT = float(os.environ.get("USER_MEMORY_RANK_POPULARITY_WEIGHT", "0.05"))
+USER_MEMORY_RANK_HALF_LIFE_DAYS = float(os.environ.get("USER_MEMORY_RANK_HALF_LIFE_DAYS", "30"))
+
+# 参照回数を減衰させる半減期（日）。least_usefulの並び順と検索結果の順位付けに使う
+USER_MEMORY_REFERENCE_HALF_LIFE_DAYS = float(os.environ.get("USER_MEMORY_REFERENCE_HALF_LIFE_DAYS", "30"))
+
+# 追加したメモリの重複の扱い (off: そのまま追加する / merge: 内容が似た既存のメモリにまとめる) と、重複とみなす類似度（0-100）
+# mergeは数値だけが違うメモリ（「800点」と「900点」など）もまとめてしまうので、必要な場合だけ有効にする
+USER_MEMORY_DEDUP = os.environ.get("USER_MEMORY_DEDUP", "off")
+USER_MEMORY_DEDUP_THRESHOLD = float(os.environ.get("USER_MEMORY_DEDUP_THRESHOLD", str(DEDUP_THRESHOLD)))
+
+# ユーザごとのメモリの件数の上限（0は上限なし）と、上限を超えたときに追い出すメモリの選び方
+# (least_useful: 減衰させた参照回数の少ないもの / least_recently_referenced: 最後の参照が古いもの / low_priority: 優先度の低いもの)
+USER_MEMORY_CAPACITY = int(os.environ.get("USER_MEMORY_CAPACITY", "0"))
+USER_MEMORY_EVICTION_POLICY = os.environ.get("USER_MEMORY_EVICTION_POLICY", "least_useful")
+
+# メモリの階層化 (on: hotのメモリだけをメモリ上の検索インデックスに置き、coldのメモリはディスク上のインデックスで検索する / off)
+# と、参照・更新されてからhotに置いておく日数
+USER_MEMORY_TIERING = os.environ.get("USER_MEMORY_TIERING", "off")
+USER_MEMORY_HOT_DAYS = float(os.environ.get("USER_MEMORY_HOT_DAYS", "30"))
+
+# 検索結果をキャッシュするクエリの数（シャードごと）。0の場合はキャッシュしない
+USER_MEMORY_SEARCH_CACHE_SIZE = int(os.environ.get("USER_MEMORY_SEARCH_CACHE_SIZE", "256"))
+
+# このサーバーが扱うユーザのID（エージェントごとに起動されるstdioサーバーには起動時に渡される）
+USER_ID = os.environ.get("USER_ID") or None
+
+# メモリの変更をまとめて書き込む間隔（ミリ秒）。0の場合は変更のたびに書き込む
+USER_MEMORY_WRITE_DELAY_MS = int(os.environ.get("USER_MEMORY_WRITE_DELAY_MS", "200"))
+
+# メモリに常駐させるシャード（ユーザ）の最大数
+USER_MEMORY_MAX_RESIDENT_SHARDS = int(os.environ.get("USER_MEMORY_MAX_RESIDENT_SHARDS", "64"))
+
+# ユーザごとに分割する前のメモリ（USER_MEMORY_FILEにあるもの）を移す先のユーザのID（省略時は移さない）
+USER_MEMORY_LEGACY_OWNER = os.environ.get("USER_MEMORY_LEGACY_OWNER") or None
+
+# ユーザごとのメモリマネージャーのプール
+memory_shards = MemoryShardPool(
+  USER_MEMORY_FILE,
+  USER_MEMORY_MAX_RESIDENT_SHARDS,
+  USER_MEMORY_LEGACY_OWNER,
+  storage_type=USER_MEMORY_STORAGE,
+  search_mode=USER_MEMORY_SEARCH_MODE,
+  search_cache_size=USER_MEMORY_SEARCH_CACHE_SIZE,
+  priority_weight=USER_MEMORY_RANK_PRIORITY_WEIGHT,
+  recency_weight=USER_MEMORY_RANK_RECENCY_WEIGHT,
+  popularity_weight=USER_MEMORY_RANK_POPULARITY_WEIGHT,
+  recency_half_life_days=USER_MEMORY_RANK_HALF_LIFE_DAYS,
+  reference_half_life_days=USER_MEMORY_REFERENCE_HALF_LIFE_DAYS,
+  dedup_mode=USER_MEMORY_DEDUP,
+  dedup_threshold=USER_MEMORY_DEDUP_THRESHOLD,
+  capacity=USER_MEMORY_CAPACITY,
+  eviction_policy=USER_MEMORY_EVICTION_POLICY,
+  tiering=USER_MEMORY_TIERING == "on",
+  hot_days=USER_MEMORY_HOT_DAYS,
+  fsync_policy=USER_MEMORY_FSYNC,
+  fsync_interval_ms=USER_MEMORY_FSYNC_INTERVAL_MS,
+  deferred_writes=USER_MEMORY_WRITE_DELAY_MS > 0,
+)
+# 終了時に書き込み待ちの変更を含めて全て書き込む
+atexit.register(memory_shards.close)
+
+# ツールのハンドラで行った変更をバックグラウンドでまとめて書き込む
+memory_writer = DebouncedFlusher(memory_shards.flush, USER_MEMORY_WRITE_DELAY_MS / 1000)
+
+
+def get_memory_manager(user_id: Optional[str] = None) -> MemoryManager:
+  """ユーザのメモリマネージャーを取得（省略時は環境変数USER_IDのユーザ）"""
+  return memory_shards.get(user_id or USER_ID)
+
 
 # MCPサーバーの作成
 mcp = FastMCP("user_memory_mcp_server", log_level="ERROR")
 
 
 @mcp.tool("add_memory")
-async def add_memory(tags: List[str], content: str, priority: str) -> Tuple[bool, str]:
-  tag_list = ""
-  for tag in MemoryTag:
-    tag_list += f"- {tag.value}({MEMORY_TAG_EXAMPLES[tag]})\n"
-
-  f"""
+async def add_memory(
+  tags: Annotated[List[MemoryTagName], Field(description=MEMORY_TAGS_DESCRIPTION)],
+  content: str,
+  priority: Annotated[MemoryPriorityName, Field(description=MEMORY_PRIORITY_DESCRIPTION)],
+) -> Tuple[bool, str]:
+  """
   Add a new memory with user's information.
+  To add several memories at once, use add_memories instead.
+  If the server merges near-duplicates and an existing memory says almost the same thing,
+  the new memory is merged into it instead of being added, and the message says which memory it was merged into.
+  If the number of memories exceeds the server's limit, the least useful older memories are moved to an archive.
 
   When to use:
       - When you want to record a new memory, experience, or observation
@@ -238,13 +1271,12 @@ async def add_memory(tags: List[str], content: str, priority: str) -> Tuple[bool
       - When you want to track progress or changes over time
 
   Args:
-      tags (List[str]): List of tags.
-      {tag_list}
+      tags (List[str]): List of tags. The available tags are listed in the parameter schema.
       content (str): Memory content. Provide detailed description.
       priority (str): Priority level ("high", "mid", "low"). Must be specified.
 
   Returns:
-      Tuple[bool, str]: Tuple containing operation result 
+      Tuple[bool, str]: Tuple containing operation result
           - success (bool): Operation success/failure
           - message (str): Result message
   """
@@ -260,8 +1292,11 @@ async def add_memory(tags: List[str], content: str, priority: str) -> Tuple[bool
     if priority not in valid_priorities:
       return False, f"Invalid priority: {priority}"
 
-    is_success = memory_manager.add_memory(tags, content, priority)
-    return is_success, "Success to add memory"
+    key, merged = await asyncio.to_thread(lambda: get_memory_manager().add_memory(tags, content, priority))
+    memory_writer.mark_dirty()
+    if merged:
+      return True, f"Merged into existing memory {key}"
+    return True, "Success to add memory"
   except Exception as e:
     return False, f"Error: {str(e)}"
 
@@ -279,8 +1314,8 @@ async def update_memory(key: str, content: str) -> Tuple[bool, str]:
       - When you want to change the categorization of a memory
 
   Args:
-      key (str): Key of the memory to update. Must be in YYYYMMDDHHMMSS format.
-                 Example: "memory_20240115103000"
+      key (str): Key of the memory to update, as returned by search_memories or get_all_memories.
+                 Example: "memory_20240115103000123456_1a2b" (older keys such as "memory_20240115103000" are also valid)
       content (str): New memory content. Replaces existing content.
 
   Returns:
@@ -290,8 +1325,9 @@ async def update_memory(key: str, content: str) -> Tuple[bool, str]:
 
   """
   try:
-    is_success = memory_manager.update_memory(key, content)
+    is_success = await asyncio.to_thread(lambda: get_memory_manager().update_memory(key, content))
     if is_success:
+      memory_writer.mark_dirty()
       return True, "Success to update memory"
     else:
       return False, "Failed to update memory"
@@ -300,11 +1336,13 @@ async def update_memory(key: str, content: str) -> Tuple[bool, str]:
 
 
 @mcp.tool("search_memories")
-async def search_memories(query: str, tags: Optional[str] = None) -> List[MemorySearchResult]:
-  tag_list = ""
-  for tag in MemoryTag:
-    tag_list += f"- {tag.value}({MEMORY_TAG_EXAMPLES[tag]})\n"
-
+async def search_memories(
+  query: str,
+  tags: Optional[List[MemoryTagName]] = None,
+  match_all_tags: bool = False,
+  limit: Annotated[int, Field(ge=1, le=50)] = 5,
+  min_score: Annotated[float, Field(ge=0, le=100)] = 0,
+) -> List[MemorySearchResult]:
   """
   Search memories with flexible query and tag-based filtering.
 
@@ -319,43 +1357,106 @@ async def search_memories(query: str, tags: Optional[str] = None) -> List[Memory
   Args:
       query (str): Search query. Specify text that appears in memory content or tags.
                    Example: "guitar" or "practice"
-      tags (Optional[str]): Target tags for search. If specified, only memories with these tags are searched.
-                                  {tag_list}
+      tags (Optional[List[str]]): Target tags for search. If specified, only memories with these tags are searched.
+      match_all_tags (bool): If True, only memories that have all of the tags are searched (AND).
+                             If False, memories that have any of the tags are searched (OR). Default: False
+      limit (int): Maximum number of results (1-50). Default: 5
+      min_score (float): Only return results whose score is at least this value (0-100). Default: 0
 
   Returns:
-      List[MemorySearchResult]: List of search results
+      List[MemorySearchResult]: Search results, best first. The score combines how well the text matches the query
+                                with the memory's priority, how recently it was updated and how often it was referenced.
   """
   try:
-    results = memory_manager.search_memories(query, tags)
+    results = await asyncio.to_thread(
+      lambda: get_memory_manager().search_memories(query, tags, match_all_tags, limit, min_score)
+    )
     return results
   except Exception:
     return []
 
 
+@mcp.tool("search_memories_batch")
+async def search_memories_batch(
+  queries: List[str],
+  tags: Optional[List[MemoryTagName]] = None,
+  match_all_tags: bool = False,
+  limit: Annotated[int, Field(ge=1, le=50)] = 5,
+  min_score: Annotated[float, Field(ge=0, le=100)] = 0,
+) -> List[List[MemorySearchResult]]:
+  """
+  Search memories with several queries at once.
+
+  When to use:
+      - When you need to look up several topics in the same turn
+      - Prefer this over calling search_memories repeatedly
+
+  Args:
+      queries (List[str]): Search queries. Each query is searched independently.
+                   Example: ["guitar", "morning routine"]
+      tags (Optional[List[str]]): Target tags for search. If specified, only memories with these tags are searched.
+      match_all_tags (bool): If True, only memories that have all of the tags are searched (AND).
+                             If False, memories that have any of the tags are searched (OR). Default: False
+      limit (int): Maximum number of results per query (1-50). Default: 5
+      min_score (float): Only return results whose score is at least this value (0-100). Default: 0
+
+  Returns:
+      List[List[MemorySearchResult]]: Search results for each query, in the same order as queries
+  """
+  try:
+    return await asyncio.to_thread(
+      lambda: get_memory_manager().search_memories_batch(queries, tags, match_all_tags, limit, min_score)
+    )
+  except Exception:
+    return [[] for _ in queries]
+
+
 @mcp.tool("get_all_memories")
-async def get_all_memories() -> List[MemorySearchResult]:
+async def get_all_memories(
+  order_by: MemoryOrder = "recency",
+  limit: Annotated[int, Field(ge=1, le=500)] = 50,
+  cursor: Optional[str] = None,
+  fields: Optional[List[MemoryFieldName]] = None,
+  preview_chars: Optional[Annotated[int, Field(ge=1)]] = None,
+) -> MemoryPage:
   """
-  Retrieve all stored memory entries.
+  Retrieve stored memory entries page by page.
 
   When to use:
-      - When you need to display a complete list of all memories
+      - When you need to display a list of all memories
       - When building dashboards or overview pages
       - When you want to analyze all stored data for patterns or insights
       - When performing bulk operations on all memories
       - When you need to export or backup all memory data
       - When building administrative interfaces for memory management
+      - When looking for memories that have not been referenced for a while (order_by="least_useful")
 
   Args:
-      None (no parameters required)
+      order_by (str): Order of the memories. Default: "recency"
+                 - "recency": most recently updated first
+                 - "priority": high priority first, then most recently updated
+                 - "reference_count": most referenced first, then most recently updated
+                 - "least_useful": least useful first. Recent references count more than old ones, so memories
+                   that have not been referenced for a while come first (candidates for deletion)
+      limit (int): Maximum number of memories in the page (1-500). Default: 50
+      cursor (Optional[str]): next_cursor of the previous page. Omit to get the first page.
+                 Use the same order_by as the previous page.
+      fields (Optional[List[str]]): Fields to return for each memory. Omit to return all fields.
+                 Example: ["key", "content"] to get only keys and contents
+      preview_chars (Optional[int]): If specified, content is cut to this many characters.
 
   Returns:
-      List[MemorySearchResult]: List of all memories
+      MemoryPage: Page of memories
+          - items (List[dict]): Memories in this page
+          - next_cursor (Optional[str]): Cursor for the next page (null on the last page)
+          - total (int): Total number of memories
   """
   try:
-    memories = memory_manager.get_all_memories()
-    return memories
+    return await asyncio.to_thread(
+      lambda: get_memory_manager().list_memories(order_by, limit, cursor, fields, preview_chars)
+    )
   except Exception:
-    return []
+    return MemoryPage(items=[], next_cursor=None, total=0)
 
 
 @mcp.tool("delete_memory")
@@ -372,8 +1473,8 @@ async def delete_memory(key: str) -> Tuple[bool, str]:
       - When correcting data integrity issues
 
   Args:
-      key (str): Key of the memory to delete. Must be in YYYYMMDDHHMMSS format.
-                 Example: "20240115103000"
+      key (str): Key of the memory to delete, as returned by search_memories or get_all_memories.
+                 Example: "memory_20240115103000123456_1a2b" (older keys such as "memory_20240115103000" are also valid)
 
   Returns:
       Tuple[bool, str]: Tuple containing operation result
@@ -382,8 +1483,9 @@ async def delete_memory(key: str) -> Tuple[bool, str]:
 
   """
   try:
-    is_success = memory_manager.delete_memory(key)
+    is_success = await asyncio.to_thread(lambda: get_memory_manager().delete_memory(key))
     if is_success:
+      memory_writer.mark_dirty()
       return True, "Success to delete memory"
     else:
       return False, "Failed to delete memory"
@@ -391,6 +1493,143 @@ async def delete_memory(key: str) -> Tuple[bool, str]:
     return False, f"Error: {str(e)}"
 
 
+@mcp.tool("add_memories")
+async def add_memories(memories: List[MemoryAddItem]) -> List[MemoryOperationResult]:
+  """
+  Add several memories with user's information in one call.
+
+  When to use:
+      - When the user tells you several things worth remembering in the same turn
+      - Prefer this over calling add_memory repeatedly
+
+  Args:
+      memories (List[MemoryAddItem]): Memories to add. Each has tags, content and priority.
+                 The available tags and priorities are listed in the parameter schema.
+
+  Returns:
+      List[MemoryOperationResult]: Result for each memory, in the same order as memories
+          - key (str): Key of the added memory. If the server merges near-duplicates and the memory is
+            a near-duplicate of an existing memory, it is merged into that memory and its key is returned instead.
+          - success (bool): Operation success/failure
+          - message (str): Result message
+          - merged_into (str): Set to the key of the existing memory when the memory was merged into it
+  """
+  try:
+    items = [memory.model_dump() for memory in memories]
+    results = await asyncio.to_thread(lambda: get_memory_manager().add_memories(items))
+  except Exception as e:
+    return [MemoryOperationResult(success=False, message=f"Error: {str(e)}") for _ in memories]
+  memory_writer.mark_dirty()
+  return [
+    MemoryOperationResult(key=key, success=True, message="Merged into existing memory", merged_into=key)
+    if merged
+    else MemoryOperationResult(key=key, success=True, message="Success to add memory")
+    for key, merged in results
+  ]
+
+
+@mcp.tool("update_memories")
+async def update_memories(updates: List[MemoryUpdateItem]) -> List[MemoryOperationResult]:
+  """
+  Update several memory entries in one call.
+
+  When to use:
+      - When new information changes several existing memories at once
+      - Prefer this over calling update_memory repeatedly
+
+  Args:
+      updates (List[MemoryUpdateItem]): Updates to apply. Each has the key of the memory and its new content.
+
+  Returns:
+      List[MemoryOperationResult]: Result for each update, in the same order as updates.
+          An update of a key that does not exist fails without affecting the others.
+  """
+  try:
+    pairs = [(update.key, update.content) for update in updates]
+    results = await asyncio.to_thread(lambda: get_memory_manager().update_memories(pairs))
+  except Exception as e:
+    return [MemoryOperationResult(key=update.key, success=False, message=f"Error: {str(e)}") for update in updates]
+  if any(results):
+    memory_writer.mark_dirty()
+  return [
+    MemoryOperationResult(
+      key=update.key,
+      success=result,
+      message="Success to update memory" if result else "Failed to update memory",
+    )
+    for update, result in zip(updates, results)
+  ]
+
+
+@mcp.tool("delete_memories")
+async def delete_memories(keys: List[str]) -> List[MemoryOperationResult]:
+  """
+  Delete several memory entries in one call.
+
+  When to use:
+      - When several memories are outdated, duplicated or contradicted at once
+      - Prefer this over calling delete_memory repeatedly
+
+  Args:
+      keys (List[str]): Keys of the memories to delete, as returned by search_memories or get_all_memories.
+
+  Returns:
+      List[MemoryOperationResult]: Result for each key, in the same order as keys.
+          Deleting a key that does not exist fails without affecting the others.
+  """
+  try:
+    results = await asyncio.to_thread(lambda: get_memory_manager().delete_memories(keys))
+  except Exception as e:
+    return [MemoryOperationResult(key=key, success=False, message=f"Error: {str(e)}") for key in keys]
+  if any(results):
+    memory_writer.mark_dirty()
+  return [
+    MemoryOperationResult(
+      key=key,
+      success=result,
+      message="Success to delete memory" if result else "Failed to delete memory",
+    )
+    for key, result in zip(keys, results)
+  ]
+
+
+@mcp.tool("deduplicate_memories")
+async def deduplicate_memories(
+  apply: bool = False,
+  threshold: Optional[Annotated[float, Field(ge=50, le=100)]] = None,
+) -> List[MemoryMergeGroup]:
+  """
+  Find groups of near-duplicate memories (the same fact saved with slightly different wording) and merge them.
+
+  When to use:
+      - When search results or the memory list show the same fact several times
+      - When cleaning up memories. Call with apply=False first to review the plan, then with apply=True
+
+  Args:
+      apply (bool): If False, only return the merge plan. If True, merge each group into one memory. Default: False
+                 A merged memory keeps the oldest key, the most recent content, all tags and the highest priority,
+                 and its reference count is the sum of the group.
+      threshold (Optional[float]): Content similarity (50-100) at which memories are treated as duplicates.
+                 Omit to use the server setting (90 by default).
+
+  Returns:
+      List[MemoryMergeGroup]: Groups of near-duplicate memories
+          - keep (str): Key of the memory that is kept
+          - duplicates (List[str]): Keys of the memories merged into keep and deleted
+          - similarity (float): Lowest similarity between the linked memories
+          - content, tags, priority: The memory after merging
+          - merged (bool): Whether the group was merged
+  """
+  try:
+    # 全メモリを比較するのでイベントループを止めないよう別スレッドで行う
+    groups = await asyncio.to_thread(lambda: get_memory_manager().deduplicate(apply, threshold))
+  except Exception:
+    return []
+  if apply and groups:
+    memory_writer.mark_dirty()
+  return groups
+
+
 @mcp.tool("get_memory_tag_list")
 async def get_memory_tag_list() -> List[str]:
   """
@@ -410,7 +1649,8 @@ async def get_memory_priority_list() -> List[str]:
 @mcp.tool("get_memory_stats")
 async def get_memory_stats() -> dict[str, Any]:
   """
-  Retrieve memory statistics. Provides analytical data including total count, key range, and tag usage frequency.
+  Retrieve memory statistics. Provides analytical data including total count, key range, and tag and priority usage
+  frequency. The statistics are maintained on every change, so this call does not scan the memories.
 
   When to use:
       - When you need to display dashboard metrics and analytics
@@ -427,38 +1667,36 @@ async def get_memory_stats() -> dict[str, Any]:
   Returns:
       dict: Dictionary containing statistics
         - total_memories (int): Total number of memories
-        - key_range (dict): Range of keys
-            - earliest (str): Oldest key (YYYYMMDDHHMMSS format)
-            - latest (str): Newest key (YYYYMMDDHHMMSS format)
+        - key_range (dict): Range of creation times of the memories. Keys have the form
+          "memory_<YYYYMMDDHHMMSS><microseconds>_<node>" and sort in creation order,
+          so this is also the range of their timestamps.
+            - earliest (str): Creation time of the oldest memory (YYYYMMDDHHMMSS format)
+            - latest (str): Creation time of the newest memory (YYYYMMDDHHMMSS format)
         - tag_counts (dict): Usage count for each tag
             - Key: Tag name (e.g., "趣味")
             - Value: Usage count
+        - priority_counts (dict): Number of memories for each priority
         - most_used_tags (List[tuple]): Top 5 most used tags
             - Each element: Tuple of (tag_name, usage_count)
+        - latest_memory_contents (List[str]): Contents of the 10 most recently added memories (oldest first)
+        - search_cache (dict): Hits, misses, size and capacity of this server's search result cache
+        - tiers (dict): Number of hot and cold memories (only when tiering is enabled)
   """
   try:
-    memories = memory_manager.get_all_memories()
-
-    # タグの統計
-    tag_counts: dict[str, int] = {}
-    for memory in memories:
-      for tag in memory.tags:
-        tag_counts[tag] = tag_counts.get(tag, 0) + 1
-
-    # キー範囲
-    keys = [memory.created_at for memory in memories]
-    keys.sort()
-
-    return {
-      "total_memories": len(memories),
-      "key_range": {"earliest": keys[0] if keys else None, "latest": keys[-1] if keys else None},
-      "tag_counts": tag_counts,
-      "most_used_tags": sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)[:5],
-    }
+    return await asyncio.to_thread(_memory_stats)
   except Exception:
     return {}
 
 
+def _memory_stats() -> dict:
+  manager = get_memory_manager()
+  stats = {**manager.get_memory_stats(), "search_cache": manager.search_cache_info()}
+  tiers = manager.tier_info()
+  if tiers is not None:
+    stats["tiers"] = tiers
+  return stats
+
+
 if __name__ == "__main__":
   # # Test code
   # import asyncio
@@ -484,4 +1722,6 @@ if __name__ == "__main__":
 
   # asyncio.run(test())
 
+  # SIGTERMで終了された場合もatexitで書き込み待ちの変更を書き込む
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
   mcp.run(transport="stdio")
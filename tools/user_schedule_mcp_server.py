@@ -1,16 +1,34 @@
+import asyncio
+import atexit
 import datetime
+import itertools
 import json
 import os
 import re
+import signal
+import sys
 import uuid
+from contextlib import contextmanager
 from datetime import timedelta, timezone
 from enum import Enum
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import IO, Annotated, Any, List, Literal, Optional, Tuple
 
 from mcp.server.fastmcp import FastMCP
 from pydantic import BaseModel, Field
 
+# stdioサーバーとして単体で起動された場合でもtoolsパッケージを参照できるようにする
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+  sys.path.insert(0, project_root)
+
+from tools.utils.binary_snapshot import paused_gc, read_entries, write_entries
+from tools.utils.durability import Durability
+from tools.utils.file_lock import FileLock, StoreVersion
+from tools.utils.ndjson import TRANSFER_BATCH_SIZE, Progress, read_records, write_records
+from tools.utils.pagination import SortValues, decode_cursor, encode_cursor, project, sort_page
+from tools.utils.write_coalescer import DebouncedFlusher
+
 JST = timezone(timedelta(hours=9), name="JST")
 
 
@@ -22,6 +40,13 @@ class SchedulePriority(Enum):
   LOW = "low"
 
 
+# ツールのスキーマに埋め込む優先度の列挙（モデルがget_schedule_priority_listを呼ばなくても選べる値が分かるようにする）
+SchedulePriorityName = Literal[tuple(priority.value for priority in SchedulePriority)]
+
+# 優先度の高い順の順位
+_PRIORITY_RANKS = {priority.value: rank for rank, priority in enumerate(SchedulePriority)}
+
+
 class ScheduleEntry(BaseModel):
   """Schedule entry"""
 
@@ -32,6 +57,11 @@ class ScheduleEntry(BaseModel):
   updated_at: str = Field(..., description="Schedule updated at")
 
 
+# バイナリスナップショットに保存するスケジュールの形式のバージョン
+# フィールドや値の制約を変えた場合は上げる（古いスナップショットは検証しながら読み込まれる）
+SCHEDULE_SCHEMA_VERSION = 1
+
+
 class ScheduleSearchResult(BaseModel):
   """Schedule search result"""
 
@@ -43,43 +73,165 @@ class ScheduleSearchResult(BaseModel):
   updated_at: str = Field(..., description="Schedule updated at")
 
 
+ScheduleOrder = Literal["deadline", "recency", "priority"]
+ScheduleFieldName = Literal["schedule_id", "deadline", "content", "priority", "created_at", "updated_at"]
+
+
+class SchedulePage(BaseModel):
+  """One page of get_all_schedules"""
+
+  items: List[dict[str, Any]] = Field(..., description="Schedules in this page, with only the requested fields")
+  next_cursor: Optional[str] = Field(default=None, description="Cursor for the next page (null on the last page)")
+  total: int = Field(..., description="Total number of schedules")
+
+
+def _time_value(value: str) -> int:
+  """YYYYMMDDHHMM(SS)形式の日時を並べ替え用の整数にする（数字でない場合は0）"""
+  return int(value) if value.isdigit() else 0
+
+
 class ScheduleManager:
   """メモリの管理を行うクラス"""
 
-  def __init__(self, schedule_file: str = "user_schedule.json"):
+  def __init__(
+    self,
+    schedule_file: str = "user_schedule.json",
+    storage_type: str = "json",
+    fsync_policy: str = "always",
+    fsync_interval_ms: int = 100,
+    deferred_writes: bool = False,
+  ):
     self.schedule_file = Path(schedule_file)
+    # json: JSONファイル / binary: バイナリスナップショット（<schedule_file>.bin）
+    if storage_type not in ("json", "binary"):
+      raise ValueError(f"Unknown schedule storage type: {storage_type}")
+    self.storage_type = storage_type
+    self.snapshot_file = self.schedule_file.with_suffix(".bin")
+    # always: 書き込みごとにfsync / group: fsync_interval_msごとにまとめてfsync / none: OSに任せる
+    self.durability = Durability(fsync_policy, fsync_interval_ms)
     # スケジュールディレクトリを自動作成
     self.schedule_file.parent.mkdir(parents=True, exist_ok=True)
     self.schedules: dict[str, ScheduleEntry] = {}
-    self._load_schedules()
+    # 同じファイルを使う他のプロセス（セッションごとに起動されるMCPサーバー）との排他と、
+    # 他のプロセスの書き込みを検知するためのバージョン番号
+    self.file_lock = FileLock(self.schedule_file.with_name(self.schedule_file.name + ".lock"))
+    self.store_version = StoreVersion(self.schedule_file.with_name(self.schedule_file.name + ".version"))
+    self._version = 0
+    # deferred_writes=Trueの場合、変更はメモリ上にだけ反映し、flush()が呼ばれたときにまとめて書き込む
+    # （まだ書き込んでいない変更のキーは、他のプロセスの変更より新しいものとして扱う）
+    self.deferred_writes = deferred_writes
+    self._dirty: set[str] = set()
+    with self.file_lock:
+      self._load_schedules()
+
+  @contextmanager
+  def _transaction(self):
+    """
+    他のプロセスと排他し、他のプロセスの変更を読み込み直した最新の状態で変更を行う
+
+    変更は読み込み直した状態に対して適用されるため、異なるスケジュールへの変更は互いに失われない。
+    """
+    with self.file_lock:
+      if self.store_version.read() != self._version:
+        self._load_schedules()
+      yield
+
+  def _refresh(self):
+    """他のプロセスが書き込んでいれば読み込み直す（読み出し系の操作の前に呼ぶ）"""
+    if self.store_version.read() != self._version:
+      with self._transaction():
+        pass
 
   def _load_schedules(self):
-    """スケジュールファイルからデータを読み込む"""
-    if self.schedule_file.exists():
-      try:
-        with open(self.schedule_file, "r", encoding="utf-8") as f:
-          data = json.load(f)
-          for key, item in data.items():
-            # 過去のデータにpriorityフィールドがない場合は"mid"をデフォルト値として設定
-            if "priority" not in item:
-              item["priority"] = "mid"
-            try:
-              self.schedules[key] = ScheduleEntry(**item)
-            except Exception as e:
-              print(f"Warning: Failed to load schedule item: {e}, item: {item}")
-              continue
-      except (json.JSONDecodeError, KeyError):
-        self.schedules = {}
-    else:
-      self.schedules = {}
+    """
+    スケジュールファイルからデータを読み込む（file_lockを取って呼ぶ）
+
+    まだ書き込んでいない変更は読み込んだ状態に上書きし直す。読み出し中の辞書は書き換えず、
+    読み込み終えた辞書に差し替える。
+    """
+    self._version = self.store_version.read()
+    schedules = self._read_schedules()
+    for key in self._dirty:
+      schedule = self.schedules.get(key)
+      if schedule is None:
+        schedules.pop(key, None)
+      else:
+        schedules[key] = schedule
+    self.schedules = schedules
+
+  def _read_schedules(self) -> dict[str, ScheduleEntry]:
+    """保存されている全てのスケジュールを読み込む"""
+    schedules: dict[str, ScheduleEntry] = {}
+    # 読み込み中に作るオブジェクトは全て生き残るのでGCを止めておく
+    with paused_gc():
+      # バイナリスナップショットがまだない場合は既存のJSONファイルを取り込む
+      if self.storage_type == "binary" and self.snapshot_file.exists():
+        loaded = read_entries(self.snapshot_file)
+        if loaded is None:
+          return schedules
+        schema_version, data = loaded
+        if schema_version == SCHEDULE_SCHEMA_VERSION:
+          # 保存時に検証済みのデータは過去データの補完を省略する
+          return {key: ScheduleEntry.model_validate(item) for key, item in data.items()}
+      elif self.schedule_file.exists():
+        try:
+          with open(self.schedule_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        except json.JSONDecodeError:
+          return schedules
+      else:
+        return schedules
+
+      for key, item in data.items():
+        # 過去のデータにpriorityフィールドがない場合は"mid"をデフォルト値として設定
+        if "priority" not in item:
+          item["priority"] = "mid"
+        try:
+          schedules[key] = ScheduleEntry(**item)
+        except Exception as e:
+          print(f"Warning: Failed to load schedule item: {e}, item: {item}", file=sys.stderr)
+          continue
+    return schedules
+
+  def _save_schedules(self, keys: List[str]):
+    """
+    変更したスケジュールをファイルに保存する（_transaction()の中で呼ぶ）
+
+    deferred_writesの場合は書き込み待ちにしてflush()で書き込む。
+    """
+    self._dirty.update(keys)
+    if not self.deferred_writes:
+      self._write_schedules()
 
-  def _save_schedules(self):
-    """スケジュールをファイルに保存する"""
+  def _write_schedules(self):
+    """全てのスケジュールをファイルに書き込む（_transaction()の中で呼ぶ）"""
     self.schedule_file.parent.mkdir(parents=True, exist_ok=True)
     # ScheduleEntryオブジェクトを辞書形式に変換して保存
     schedules_dict = {key: schedule.model_dump() for key, schedule in self.schedules.items()}
-    with open(self.schedule_file, "w", encoding="utf-8") as f:
-      json.dump(schedules_dict, f, ensure_ascii=False, indent=2)
+    if self.storage_type == "binary":
+      write_entries(self.snapshot_file, SCHEDULE_SCHEMA_VERSION, schedules_dict, self.durability)
+    else:
+      # 他のプロセスが書き込み途中のファイルを読まないよう、一時ファイルに書いてからリネームする
+      tmp_path = self.schedule_file.with_name(self.schedule_file.name + ".tmp")
+      with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(schedules_dict, f, ensure_ascii=False, indent=2)
+        self.durability.sync_before_replace(f)
+      self.durability.replace(tmp_path, self.schedule_file)
+    self._version = self.store_version.bump()
+    self._dirty.clear()
+
+  def flush(self):
+    """書き込み待ちの変更をファイルに書き込む"""
+    with self.file_lock:
+      if not self._dirty:
+        return
+      with self._transaction():
+        self._write_schedules()
+
+  def close(self):
+    """書き込み待ちの変更を書き込み、グループコミットを待っている書き込みをディスクに同期する"""
+    self.flush()
+    self.durability.close()
 
   def add_schedule(self, deadline: str, content: str, priority: str) -> bool:
     """新しいスケジュールを追加"""
@@ -92,26 +244,30 @@ class ScheduleManager:
       created_at=now,
       updated_at=now,
     )
-    self.schedules[schedule_id] = schedule
-    self._save_schedules()
+    with self._transaction():
+      self.schedules[schedule_id] = schedule
+      self._save_schedules([schedule_id])
     return True
 
   def update_schedule(self, schedule_id: str, content: str) -> bool:
     """指定されたキーのスケジュールを更新"""
     now = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    if schedule_id in self.schedules.keys():
-      self.schedules[schedule_id].content = content
-      self.schedules[schedule_id].updated_at = now
-      self._save_schedules()
-      return True
+    with self._transaction():
+      if schedule_id in self.schedules.keys():
+        self.schedules[schedule_id].content = content
+        self.schedules[schedule_id].updated_at = now
+        self._save_schedules([schedule_id])
+        return True
     return False
 
   def get_schedule_by_key(self, schedule_id: str) -> Optional[ScheduleEntry]:
     """指定されたキーのスケジュールを取得"""
+    self._refresh()
     return self.schedules.get(schedule_id)
 
   def search_schedules(self, before_date: int, after_date: int) -> List[ScheduleSearchResult]:
     """スケジュールを検索"""
+    self._refresh()
     results: List[ScheduleSearchResult] = []
 
     # 今日の日付を基準に検索範囲を計算
@@ -141,6 +297,7 @@ class ScheduleManager:
 
   def get_all_schedules(self) -> List[ScheduleSearchResult]:
     """全てのメモリを取得"""
+    self._refresh()
     return [
       ScheduleSearchResult(
         schedule_id=key,
@@ -153,27 +310,138 @@ class ScheduleManager:
       for key, schedule in self.schedules.items()
     ]
 
+  def _sort_values(self, order_by: str, schedule: ScheduleEntry) -> SortValues:
+    """並び順でのスケジュールの値（小さいほど前に並ぶ）"""
+    if order_by == "deadline":
+      return (_time_value(schedule.deadline),)
+    if order_by == "recency":
+      return (-_time_value(schedule.updated_at),)
+    if order_by == "priority":
+      return (_PRIORITY_RANKS.get(schedule.priority, len(_PRIORITY_RANKS)), _time_value(schedule.deadline))
+    raise ValueError(f"Unknown order: {order_by}")
+
+  def list_schedules(
+    self,
+    order_by: str = "deadline",
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    preview_chars: Optional[int] = None,
+  ) -> SchedulePage:
+    """
+    スケジュールを1ページ分取得する
+
+    order_by: deadline（期限の近い順） / recency（更新が新しい順） / priority（優先度の高い順、同じ優先度は期限の近い順）
+    cursorには前のページのnext_cursorを渡す。fieldsで返すフィールドを、preview_charsでcontentの長さを絞れる。
+    """
+    after = decode_cursor(cursor, order_by) if cursor else None
+    self._refresh()
+    schedules = self.schedules
+    # 次のページがあるかどうかを知るため1件多く取得する
+    page = sort_page(
+      ((self._sort_values(order_by, schedule), key) for key, schedule in schedules.items()), limit + 1, after
+    )
+    items = [
+      project({"schedule_id": key, **schedules[key].model_dump()}, fields, preview_chars) for _, key in page[:limit]
+    ]
+    next_cursor = encode_cursor(order_by, *page[limit - 1]) if len(page) > limit else None
+    return SchedulePage(items=items, next_cursor=next_cursor, total=len(schedules))
+
   def delete_schedule(self, schedule_id: str) -> bool:
     """指定されたキーのスケジュールを削除"""
-    if schedule_id in self.schedules:
-      del self.schedules[schedule_id]
-      self._save_schedules()
-      return True
+    with self._transaction():
+      if schedule_id in self.schedules:
+        del self.schedules[schedule_id]
+        self._save_schedules([schedule_id])
+        return True
     return False
 
+  def export_ndjson(self, f: IO[str], progress: Optional[Progress] = None) -> int:
+    """
+    全スケジュールを1行1件のJSON（NDJSON）でfに書き出し、書き出した件数を返す
+
+    各行は {"schedule_id": ID, 保存形式のフィールド...}。
+    """
+    self._refresh()
+    schedules = list(self.schedules.items())
+    return write_records(f, ({"schedule_id": key, **schedule.model_dump()} for key, schedule in schedules), progress)
+
+  def import_ndjson(
+    self, f: IO[str], batch_size: int = TRANSFER_BATCH_SIZE, progress: Optional[Progress] = None
+  ) -> Tuple[int, int]:
+    """
+    NDJSONのスケジュールを読み込んで保存し、(取り込んだスケジュールの数, 飛ばした行数) を返す
+
+    batch_size行ごとに1回のトランザクションで反映し、ファイルは全体を書き直すので最後に1回だけ書き込む。
+    schedule_idがある行はそのIDで追加・上書きし、ない行には新しいIDを発行する。
+    同じバッチ内で同じIDの行は後のものだけを1件として数える。検証できない行は飛ばす。
+    """
+    imported = skipped = 0
+    for batch in itertools.batched(read_records(f), batch_size):
+      schedules: dict[str, ScheduleEntry] = {}
+      for number, record in batch:
+        if record is None:
+          print(f"Warning: Skipped invalid schedule at line {number}", file=sys.stderr)
+          skipped += 1
+          continue
+        schedule_id = str(record.pop("schedule_id", None) or uuid.uuid4())
+        # 過去のデータにpriorityフィールドがない場合は"mid"をデフォルト値として設定
+        record.setdefault("priority", "mid")
+        try:
+          schedules[schedule_id] = ScheduleEntry(**record)
+        except Exception as e:
+          print(f"Warning: Skipped invalid schedule at line {number}: {e}", file=sys.stderr)
+          skipped += 1
+          continue
+      if schedules:
+        with self._transaction():
+          self.schedules.update(schedules)
+          self._dirty.update(schedules)
+      imported += len(schedules)
+      if progress is not None:
+        progress(imported)
+    self.flush()
+    return imported, skipped
+
 
 # 環境変数からメモリファイルの保存場所を取得
 USER_SCHEDULE_FILE = os.environ.get("USER_SCHEDULE_FILE", "memory/user_schedule.json")
 
+# スケジュールの保存方式 (json: JSONファイル / binary: バイナリスナップショット)
+USER_SCHEDULE_STORAGE = os.environ.get("USER_SCHEDULE_STORAGE", "json")
+
+# 書き込んだスケジュールをディスクに同期（fsync）する方針
+# (always: 書き込みごと / group: USER_SCHEDULE_FSYNC_INTERVAL_MSミリ秒ごとにまとめて / none: OSに任せる)
+USER_SCHEDULE_FSYNC = os.environ.get("USER_SCHEDULE_FSYNC", "always")
+USER_SCHEDULE_FSYNC_INTERVAL_MS = int(os.environ.get("USER_SCHEDULE_FSYNC_INTERVAL_MS", "100"))
+
+# スケジュールの変更をまとめて書き込む間隔（ミリ秒）。0の場合は変更のたびに書き込む
+USER_SCHEDULE_WRITE_DELAY_MS = int(os.environ.get("USER_SCHEDULE_WRITE_DELAY_MS", "200"))
+
 # スケジュールマネージャーのインスタンス
-schedule_manager = ScheduleManager(USER_SCHEDULE_FILE)
+schedule_manager = ScheduleManager(
+  USER_SCHEDULE_FILE,
+  USER_SCHEDULE_STORAGE,
+  USER_SCHEDULE_FSYNC,
+  USER_SCHEDULE_FSYNC_INTERVAL_MS,
+  deferred_writes=USER_SCHEDULE_WRITE_DELAY_MS > 0,
+)
+# 終了時に書き込み待ちの変更を含めて全て書き込む
+atexit.register(schedule_manager.close)
+
+# ツールのハンドラで行った変更をバックグラウンドでまとめて書き込む
+schedule_writer = DebouncedFlusher(schedule_manager.flush, USER_SCHEDULE_WRITE_DELAY_MS / 1000)
 
 # MCPサーバーの作成
 mcp = FastMCP("user_schedule_mcp_server", log_level="ERROR")
 
 
 @mcp.tool("add_schedule")
-async def add_schedule(deadline: str, content: str, priority: str) -> Tuple[bool, str]:
+async def add_schedule(
+  deadline: str,
+  content: str,
+  priority: Annotated[SchedulePriorityName, Field(description="Priority level of the schedule (high, mid, low).")],
+) -> Tuple[bool, str]:
   """
   Add a new schedule with user's information.
 
@@ -202,7 +470,8 @@ async def add_schedule(deadline: str, content: str, priority: str) -> Tuple[bool
     if priority not in valid_priorities:
       return False, f"Invalid priority: {priority}"
 
-    is_success = schedule_manager.add_schedule(deadline, content, priority)
+    is_success = await asyncio.to_thread(schedule_manager.add_schedule, deadline, content, priority)
+    schedule_writer.mark_dirty()
     return is_success, "Success to add schedule"
   except Exception as e:
     return False, f"Error: {str(e)}"
@@ -230,8 +499,9 @@ async def update_schedule(schedule_id: str, content: str) -> Tuple[bool, str]:
 
   """
   try:
-    is_success = schedule_manager.update_schedule(schedule_id, content)
+    is_success = await asyncio.to_thread(schedule_manager.update_schedule, schedule_id, content)
     if is_success:
+      schedule_writer.mark_dirty()
       return True, "Success to update schedule"
     else:
       return False, "Failed to update schedule"
@@ -257,19 +527,25 @@ async def search_schedules(before_date: int, after_date: int) -> List[ScheduleSe
       List[ScheduleSearchResult]: List of search results
   """
   try:
-    results = schedule_manager.search_schedules(before_date, after_date)
+    results = await asyncio.to_thread(schedule_manager.search_schedules, before_date, after_date)
     return results
   except Exception:
     return []
 
 
 @mcp.tool("get_all_schedules")
-async def get_all_schedules() -> List[ScheduleSearchResult]:
+async def get_all_schedules(
+  order_by: ScheduleOrder = "deadline",
+  limit: Annotated[int, Field(ge=1, le=500)] = 50,
+  cursor: Optional[str] = None,
+  fields: Optional[List[ScheduleFieldName]] = None,
+  preview_chars: Optional[Annotated[int, Field(ge=1)]] = None,
+) -> SchedulePage:
   """
-  Retrieve all stored schedule entries.
+  Retrieve stored schedule entries page by page.
 
   When to use:
-      - When you need to display a complete list of all schedules
+      - When you need to display a list of all schedules
       - When building dashboards or overview pages
       - When you want to analyze all stored data for patterns or insights
       - When performing bulk operations on all schedules
@@ -277,16 +553,27 @@ async def get_all_schedules() -> List[ScheduleSearchResult]:
       - When building administrative interfaces for schedule management
 
   Args:
-      None (no parameters required)
+      order_by (str): Order of the schedules. Default: "deadline"
+                 - "deadline": earliest deadline first
+                 - "recency": most recently updated first
+                 - "priority": high priority first, then earliest deadline
+      limit (int): Maximum number of schedules in the page (1-500). Default: 50
+      cursor (Optional[str]): next_cursor of the previous page. Omit to get the first page.
+                 Use the same order_by as the previous page.
+      fields (Optional[List[str]]): Fields to return for each schedule. Omit to return all fields.
+                 Example: ["schedule_id", "deadline", "content"]
+      preview_chars (Optional[int]): If specified, content is cut to this many characters.
 
   Returns:
-      List[ScheduleSearchResult]: List of all schedules
+      SchedulePage: Page of schedules
+          - items (List[dict]): Schedules in this page
+          - next_cursor (Optional[str]): Cursor for the next page (null on the last page)
+          - total (int): Total number of schedules
   """
   try:
-    schedules = schedule_manager.get_all_schedules()
-    return schedules
+    return await asyncio.to_thread(schedule_manager.list_schedules, order_by, limit, cursor, fields, preview_chars)
   except Exception:
-    return []
+    return SchedulePage(items=[], next_cursor=None, total=0)
 
 
 @mcp.tool("delete_schedule")
@@ -309,8 +596,9 @@ async def delete_schedule(schedule_id: str) -> Tuple[bool, str]:
 
   """
   try:
-    is_success = schedule_manager.delete_schedule(schedule_id)
+    is_success = await asyncio.to_thread(schedule_manager.delete_schedule, schedule_id)
     if is_success:
+      schedule_writer.mark_dirty()
       return True, "Success to delete schedule"
     else:
       return False, "Failed to delete schedule"
@@ -355,4 +643,6 @@ if __name__ == "__main__":
 
   # asyncio.run(test())
 
+  # SIGTERMで終了された場合もatexitで書き込み待ちの変更を書き込む
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
   mcp.run(transport="stdio")
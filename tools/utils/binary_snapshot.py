@@ -0,0 +1,77 @@
+import gc
+import marshal
+import os
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from tools.utils.durability import Durability
+
+# ファイル形式
+#   ヘッダ: MAGIC, 形式のバージョン(u16), スキーマのバージョン(u32), 件数(u32)
+#   本体: {キー: エントリ} をmarshalで直列化したもの（デコードがCだけで完結するためJSONより速い）
+MAGIC = b"WSNP"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<4sHII")
+
+SnapshotEntries = dict[str, dict[str, Any]]
+
+
+def write_entries(
+  path: Path, schema_version: int, entries: SnapshotEntries, durability: Optional[Durability] = None
+) -> None:
+  """
+  {キー: エントリ} をバイナリ形式で保存する
+
+  一時ファイルに書き込んでからリネームするため、途中でクラッシュしても元のファイルは壊れない。
+  durabilityを省略した場合はfsyncしない。
+  """
+  path.parent.mkdir(parents=True, exist_ok=True)
+  tmp_path = path.with_name(path.name + ".tmp")
+  with open(tmp_path, "wb") as f:
+    f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, schema_version, len(entries)))
+    marshal.dump(entries, f)
+    if durability is not None:
+      durability.sync_before_replace(f)
+  if durability is not None:
+    durability.replace(tmp_path, path)
+  else:
+    os.replace(tmp_path, path)
+
+
+def read_entries(path: Path) -> Optional[tuple[int, SnapshotEntries]]:
+  """
+  バイナリ形式のスナップショットを読み込み、(スキーマのバージョン, {キー: エントリ}) を返す
+
+  ファイルがない・壊れている場合はNoneを返す。
+  """
+  try:
+    with open(path, "rb") as f:
+      magic, format_version, schema_version, count = _HEADER.unpack(f.read(_HEADER.size))
+      if magic != MAGIC or format_version != FORMAT_VERSION:
+        return None
+      with paused_gc():
+        entries = marshal.loads(f.read())
+  except (OSError, struct.error, EOFError, ValueError, TypeError):
+    return None
+  if not isinstance(entries, dict) or len(entries) != count:
+    return None
+  return schema_version, entries
+
+
+@contextmanager
+def paused_gc() -> Iterator[None]:
+  """
+  大量のオブジェクトを作る間だけ循環参照のGCを止める
+
+  読み込み中に作られるオブジェクトは全て生き残るため、途中で走るGCは無駄な走査にしかならない。
+  """
+  enabled = gc.isenabled()
+  gc.disable()
+  try:
+    yield
+  finally:
+    if enabled:
+      gc.enable()
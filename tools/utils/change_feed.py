@@ -0,0 +1,162 @@
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from tools.utils.memory_storage import MemoryRecord, MemorySnapshot, apply_record, create_memory_storage
+
+
+class ChangeFeed:
+  """
+  メモリの変更フィード（`<memory_file>.changes`）
+
+  MemoryManagerはストレージに書き込むたびに、書き込んだ変更レコードをストアのバージョンと一緒に追記する。
+  他のプロセス（他のMCPサーバー・APIのプロンプト作成など）は最後に読んだバージョン以降のレコードだけを読み、
+  ストア全体を読み込み直さずに手元の状態やインデックスを更新できる。
+
+    {"op": "feed", "id": "..."}                                  先頭行（ファイルごとのID）
+    {"version": 3, "op": "put", "key": "...", "entry": {...}}
+    {"version": 4, "op": "delete", "key": "..."}
+
+  ファイルがmax_bytesを超えたら後半だけを残した新しいファイル（新しいID）に置き換える。
+  読み手が読んでいないレコードが捨てられた場合や、書き込んだプロセスがフィードへの追記の前に落ちた場合は
+  バージョンが連続しなくなるので、read_sinceはNoneを返す（読み手はストア全体を読み込み直す）。
+  フィードはストアから作り直せる補助的なデータなのでfsyncはしない。
+  """
+
+  def __init__(self, memory_file: Path, max_bytes: int = 4 * 1024 * 1024):
+    self.path = memory_file.with_name(memory_file.name + ".changes")
+    self.max_bytes = max_bytes
+    # 最後に読んだ位置 (ファイルのID, バイト位置, そこまでに読んだバージョン)
+    self._position: Optional[tuple[str, int, int]] = None
+
+  def publish(self, version: int, records: list[MemoryRecord]) -> None:
+    """
+    書き込んだ変更レコードを追記する（ストアのロックを取り、バージョンを進めた後に呼ぶ）
+
+    書き込んだプロセスは自分の変更を読み直す必要がないので、追記した後の位置を最後に読んだ位置にする
+    （次のread_sinceは先頭から読み直さずにその位置から続ける）。
+    """
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    with open(self.path, "a+b") as f:
+      if f.seek(0, os.SEEK_END) == 0:
+        feed_id = uuid.uuid4().hex
+        f.write(_dump({"op": "feed", "id": feed_id}))
+      else:
+        f.seek(0)
+        header = _parse(f.readline())
+        feed_id = header.get("id") if header is not None else None
+      f.write(b"".join(_dump({"version": version, **record}) for record in records))
+      f.flush()
+      size = f.tell()
+    if size > self.max_bytes:
+      feed_id, size = self._trim()
+    self._position = (feed_id, size, version) if feed_id is not None else None
+
+  def _trim(self) -> tuple[str, int]:
+    """後半のレコードだけを残した新しいファイルに置き換える（バージョンの途中で切らない。新しいIDとサイズを返す）"""
+    with open(self.path, "rb") as f:
+      f.readline()
+      lines = f.readlines()
+    start = len(lines) // 2
+    while 0 < start < len(lines) and _version(lines[start]) == _version(lines[start - 1]):
+      start += 1
+    tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+    feed_id = uuid.uuid4().hex
+    with open(tmp_path, "wb") as f:
+      f.write(_dump({"op": "feed", "id": feed_id}))
+      f.writelines(lines[start:])
+      size = f.tell()
+    os.replace(tmp_path, self.path)
+    return feed_id, size
+
+  def read_since(self, version: int) -> Optional[tuple[list[MemoryRecord], int]]:
+    """
+    versionより後の変更レコードと、読んだ最後のバージョンを返す
+
+    前回読んだ位置から続けて読める場合はその位置から読む。versionの次からのレコードが残っていない場合はNone。
+    """
+    try:
+      with open(self.path, "rb") as f:
+        header = _parse(f.readline())
+        feed_id = header.get("id") if header is not None else None
+        if feed_id is None:
+          return None
+        if self._position is not None and self._position[0] == feed_id and self._position[2] == version:
+          f.seek(self._position[1])
+
+        records: list[MemoryRecord] = []
+        last = version
+        offset = f.tell()
+        for line in f:
+          # 書き込み途中の行はまだ読まない
+          if not line.endswith(b"\n"):
+            break
+          record = _parse(line)
+          if record is None:
+            return None
+          record_version = record.get("version", 0)
+          if record_version > version:
+            # 同じバージョンの続きか、次のバージョンでなければ途中のレコードが欠けている
+            if record_version not in (last, last + 1):
+              return None
+            records.append(record)
+            last = record_version
+          offset += len(line)
+        self._position = (feed_id, offset, last)
+        return records, last
+    except FileNotFoundError:
+      return [], version
+
+
+def _dump(record: dict) -> bytes:
+  return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _parse(line: bytes) -> Optional[dict]:
+  try:
+    record = json.loads(line)
+  except (json.JSONDecodeError, UnicodeDecodeError):
+    return None
+  return record if isinstance(record, dict) else None
+
+
+def _version(line: bytes) -> Optional[int]:
+  record = _parse(line)
+  return record.get("version") if record is not None else None
+
+
+class MemoryView:
+  """
+  メモリの読み出し専用の写し（MCPサーバー以外のプロセスがメモリを読むためのもの）
+
+  最初に全メモリを読み込み、その後はentries()のたびに変更フィードから差分だけを取り込む。
+  差分を取り込めない場合（フィードが切り詰められた場合など）だけ全体を読み込み直す。
+  """
+
+  def __init__(self, memory_file: str | Path, storage_type: str = "json"):
+    self.memory_file = Path(memory_file)
+    self.storage = create_memory_storage(self.memory_file, storage_type)
+    self.feed = ChangeFeed(self.memory_file)
+    self.version = -1
+    self._state: MemorySnapshot = {}
+
+  def entries(self) -> MemorySnapshot:
+    """最新の全メモリ（キー -> 保存されている形式のメモリ）"""
+    if self.storage.store_version.read() == self.version:
+      return self._state
+    # 書き込み中のプロセスがフィードに追記し終わるのを待つためにロックを取る
+    with self.storage.lock():
+      current = self.storage.store_version.read()
+      changes = self.feed.read_since(self.version) if self.version >= 0 else None
+      if changes is not None and changes[1] == current:
+        for record in changes[0]:
+          apply_record(self._state, record)
+      else:
+        self._state = self.storage.load()
+      self.version = current
+    return self._state
+
+  def close(self) -> None:
+    self.storage.close()
@@ -0,0 +1,100 @@
+import os
+import threading
+from pathlib import Path
+from typing import IO, Optional
+
+# fsyncの方針
+#   always: 書き込みごとにfsyncする（保存が返った時点で電源断・OSのクラッシュにも耐える）
+#   group: fsyncをバックグラウンドスレッドでinterval_msごとにまとめて行う（直近interval_ms分の書き込みを失いうる。
+#          全体を書き直すファイルは、ファイルシステムによっては直近interval_ms以内に書き直したものが空になりうる）
+#   none: fsyncせずOSのバッファに任せる（OSがクラッシュすると直近の書き込みを失いうる）
+FSYNC_POLICIES = ("always", "group", "none")
+
+
+class Durability:
+  """
+  書き込んだファイルをディスクに同期（fsync）する方針
+
+  保存は方針によらず一時ファイルへの書き込みとリネームで行うため、プロセスがクラッシュしても
+  元のファイルが途中まで書かれた状態になることはない。方針が決めるのは、保存が返った後に
+  OSのクラッシュや電源断が起きた場合にどこまでの書き込みが残るかだけである。
+
+  groupでは追記したファイルも、全体を書き直してリネームしたファイルとそのディレクトリも、次のグループコミットで
+  まとめてfsyncする（書き込みのたびにfsyncしない）。リネームがファイルの中身より先にディスクに届く
+  ファイルシステムでは、グループコミットの前にOSがクラッシュすると書き直したファイルが空になりうるので、
+  それを許容できない場合はalwaysを使う。
+  """
+
+  def __init__(self, policy: str = "always", interval_ms: int = 100):
+    if policy not in FSYNC_POLICIES:
+      raise ValueError(f"Unknown fsync policy: {policy}")
+    self.policy = policy
+    self.interval = interval_ms / 1000
+    self._lock = threading.Lock()
+    # 次のグループコミットでfsyncするファイルとディレクトリ
+    self._pending: set[Path] = set()
+    self._timer: Optional[threading.Timer] = None
+
+  def sync(self, f: IO, path: Path) -> None:
+    """追記したファイルを同期する（groupの場合は次のグループコミットで行う）"""
+    f.flush()
+    if self.policy == "always":
+      os.fsync(f.fileno())
+    elif self.policy == "group":
+      self._defer(path)
+
+  def sync_before_replace(self, f: IO) -> None:
+    """リネームする前の一時ファイルを同期する（groupの場合はreplaceでリネーム後のファイルの同期を予約する）"""
+    f.flush()
+    if self.policy == "always":
+      os.fsync(f.fileno())
+
+  def replace(self, tmp_path: Path, path: Path) -> None:
+    """
+    一時ファイルをリネームして置き換え、ディレクトリを同期する
+
+    groupの場合は、置き換えたファイルとディレクトリの同期を次のグループコミットで行う。
+    """
+    os.replace(tmp_path, path)
+    if self.policy == "always":
+      _fsync_path(path.parent)
+    elif self.policy == "group":
+      self._defer(path)
+      self._defer(path.parent)
+
+  def _defer(self, path: Path) -> None:
+    with self._lock:
+      self._pending.add(path)
+      if self._timer is None:
+        self._timer = threading.Timer(self.interval, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+  def flush(self) -> None:
+    """グループコミットを待っているファイルとディレクトリを同期する"""
+    with self._lock:
+      pending, self._pending = self._pending, set()
+      self._timer = None
+    for path in pending:
+      _fsync_path(path)
+
+  def close(self) -> None:
+    with self._lock:
+      if self._timer is not None:
+        self._timer.cancel()
+    self.flush()
+
+
+def _fsync_path(path: Path) -> None:
+  """パスで指定したファイル・ディレクトリを同期する（他のプロセスが移動・削除していれば何もしない）"""
+  try:
+    fd = os.open(path, os.O_RDONLY)
+  except OSError:
+    return
+  try:
+    os.fsync(fd)
+  except OSError:
+    # ディレクトリのfsyncに対応していないプラットフォーム（Windowsなど）
+    pass
+  finally:
+    os.close(fd)
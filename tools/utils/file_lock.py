@@ -0,0 +1,100 @@
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Self
+
+try:
+  import fcntl
+except ImportError:  # Windows
+  fcntl = None
+  import msvcrt
+
+
+def _lock_fd(fd: int) -> None:
+  if fcntl is not None:
+    fcntl.flock(fd, fcntl.LOCK_EX)
+  else:
+    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+
+def _unlock_fd(fd: int) -> None:
+  if fcntl is not None:
+    fcntl.flock(fd, fcntl.LOCK_UN)
+  else:
+    os.lseek(fd, 0, os.SEEK_SET)
+    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+  """
+  ロックファイルによるプロセス間の排他ロック
+
+  同じプロセス内では再入可能で、スレッド間の排他も兼ねる。
+  （flockは開いたファイルごとのロックなので、同じプロセス内でもロックファイルは1回だけ開く）
+  """
+
+  def __init__(self, path: Path):
+    self.path = path
+    self._lock = threading.RLock()
+    self._depth = 0
+    self._fd: Optional[int] = None
+
+  def acquire(self) -> None:
+    self._lock.acquire()
+    if self._depth == 0:
+      try:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+          _lock_fd(fd)
+        except BaseException:
+          os.close(fd)
+          raise
+      except BaseException:
+        self._lock.release()
+        raise
+      self._fd = fd
+    self._depth += 1
+
+  def release(self) -> None:
+    self._depth -= 1
+    if self._depth == 0:
+      _unlock_fd(self._fd)
+      os.close(self._fd)
+      self._fd = None
+    self._lock.release()
+
+  def __enter__(self) -> Self:
+    self.acquire()
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    self.release()
+
+
+class StoreVersion:
+  """
+  ストアが変更されるたびに増えるバージョン番号
+
+  ファイルに保存してプロセス間で共有する。各プロセスは最後に同期したときの番号と比べて、
+  他のプロセスが書き込んだかどうかを判定する（bumpはFileLockを取った状態で呼ぶ）。
+  """
+
+  def __init__(self, path: Path):
+    self.path = path
+
+  def read(self) -> int:
+    try:
+      with open(self.path, "r", encoding="utf-8") as f:
+        return int(f.read())
+    except (OSError, ValueError):
+      return 0
+
+  def bump(self) -> int:
+    version = self.read() + 1
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = self.path.with_name(self.path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+      f.write(str(version))
+    os.replace(tmp_path, self.path)
+    return version
@@ -2,7 +2,7 @@ import asyncio
 import json
 import logging
 import os
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from google.adk.tools.mcp_tool import StdioConnectionParams
 from google.adk.tools.mcp_tool.mcp_session_manager import StreamableHTTPServerParams
@@ -69,7 +69,7 @@ class MCPConnector:
 
     return names, tools
 
-  def _load_stdio_all_tools(self) -> tuple[list[str], list[MCPToolset]]:
+  def _load_stdio_all_tools(self, user_id: Optional[str] = None) -> tuple[list[str], list[MCPToolset]]:
     tools: list[MCPToolset] = []
     names: list[str] = []
 
@@ -81,10 +81,13 @@ class MCPConnector:
         if "env" in server and "GOOGLE_API_KEY" in server["env"]:
           server["env"]["GOOGLE_API_KEY"] = GOOGLE_API_KEY
 
+        env = server["env"] if "env" in server else None
+        # ユーザごとのデータを扱えるようにサーバーにユーザIDを渡す
+        if user_id is not None:
+          env = {**(env or {}), "USER_ID": user_id}
+
         conn = StdioConnectionParams(
-          server_params=StdioServerParameters(
-            command=server["command"], args=server["args"], env=server["env"] if "env" in server else None
-          )
+          server_params=StdioServerParameters(command=server["command"], args=server["args"], env=env)
         )
         tool = MCPToolset(connection_params=conn)
         tools.append(tool)
@@ -98,6 +101,6 @@ class MCPConnector:
     names, tools = await self._load_http_all_tools()
     return names, tools.copy()
 
-  def get_stdio_tools(self) -> tuple[list[str], list[MCPToolset]]:
-    names, tools = self._load_stdio_all_tools()
+  def get_stdio_tools(self, user_id: Optional[str] = None) -> tuple[list[str], list[MCPToolset]]:
+    names, tools = self._load_stdio_all_tools(user_id)
     return names, tools.copy()
@@ -0,0 +1,157 @@
+from typing import Any, Iterable
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from tools.utils.memory_index import FuzzyChoices, NgramIndex
+
+# 重複とみなす内容の類似度（rapidfuzzのratio、0-100）の下限
+DEDUP_THRESHOLD = 90
+
+# 重複の候補としてn-gramインデックスから取り出すメモリの数（重複はn-gramのほとんどを共有するので上位だけで足りる）
+DEDUP_SHORTLIST_SIZE = 20
+
+# 1回のcdistでまとめて比較するメモリの数
+DEDUP_BATCH_SIZE = 256
+
+
+def similar_pairs(
+  choices: FuzzyChoices,
+  index: NgramIndex,
+  items: Iterable[tuple[str, str]],
+  threshold: float = DEDUP_THRESHOLD,
+  shortlist_size: int = DEDUP_SHORTLIST_SIZE,
+) -> list[tuple[str, str, float]]:
+  """
+  (キー, 内容) ごとに、内容の類似度がthreshold以上の他のメモリとの組 (キー, 相手のキー, 類似度) を返す
+
+  追加したメモリのチェック用。比較するのはn-gramインデックスで絞り込んだ候補だけで、
+  DEDUP_BATCH_SIZE件ずつ候補の和集合とcdistで比較する。n-gramを作れない短い内容は対象にしない。
+  """
+  pairs: list[tuple[str, str, float]] = []
+  batch: list[tuple[str, str]] = []
+  for item in items:
+    batch.append(item)
+    if len(batch) == DEDUP_BATCH_SIZE:
+      pairs.extend(_batch_pairs(choices, index, batch, threshold, shortlist_size))
+      batch = []
+  if batch:
+    pairs.extend(_batch_pairs(choices, index, batch, threshold, shortlist_size))
+  return pairs
+
+
+def _batch_pairs(
+  choices: FuzzyChoices, index: NgramIndex, batch: list[tuple[str, str]], threshold: float, shortlist_size: int
+) -> list[tuple[str, str, float]]:
+  queries: list[tuple[str, str]] = []
+  candidates: set[str] = set()
+  for key, content in batch:
+    # 自分自身も候補に入るので1件多く取り出す
+    shortlist = index.shortlist(content, shortlist_size + 1)
+    if shortlist:
+      queries.append((key, content))
+      candidates.update(shortlist)
+  if not queries:
+    return []
+  keys, matrix = choices.scores([content for _, content in queries], candidates, threshold, scorer=fuzz.ratio)
+  rows, columns = np.nonzero(matrix >= threshold)
+  return [
+    (queries[row][0], keys[column], float(matrix[row, column]))
+    for row, column in zip(rows.tolist(), columns.tolist())
+    if queries[row][0] != keys[column]
+  ]
+
+
+def all_similar_pairs(choices: FuzzyChoices, threshold: float = DEDUP_THRESHOLD) -> list[tuple[str, str, float]]:
+  """
+  全メモリのうち内容の類似度がthreshold以上の組 (キー, 相手のキー, 類似度) を返す（全体のパス用）
+
+  ratioは長さの比が threshold / (200 - threshold) 未満の組では必ずthreshold未満になるので、
+  前処理済みの内容を長さの順に並べ、DEDUP_BATCH_SIZE件ずつ自分以上かつ長さが範囲内のものとだけcdistで比較する
+  （n-gramの候補を1件ずつ求めるよりも速く、見落としもない）。空の内容は対象にしない。
+  """
+  lengths = np.fromiter((len(choice) for choice in choices.choices), dtype=np.int64, count=len(choices))
+  order = np.argsort(lengths, kind="stable")
+  order = order[lengths[order] > 0]
+  sorted_lengths = lengths[order]
+  min_ratio = threshold / (200 - threshold)
+  pairs: list[tuple[str, str, float]] = []
+  for begin in range(0, len(order), DEDUP_BATCH_SIZE):
+    rows = order[begin : begin + DEDUP_BATCH_SIZE].tolist()
+    end = int(np.searchsorted(sorted_lengths, sorted_lengths[begin + len(rows) - 1] / min_ratio, side="right"))
+    columns = order[begin:end].tolist()
+    matrix = process.cdist(
+      [choices.choices[i] for i in rows],
+      [choices.choices[j] for j in columns],
+      scorer=fuzz.ratio,
+      score_cutoff=threshold,
+      dtype=np.float64,
+      workers=choices.workers,
+    )
+    # 列も同じ位置から始まるので、対角より右だけを取れば各組を1回ずつ数える
+    found_rows, found_columns = np.nonzero(np.triu(matrix >= threshold, k=1))
+    pairs.extend(
+      (choices.keys[rows[row]], choices.keys[columns[column]], float(matrix[row, column]))
+      for row, column in zip(found_rows.tolist(), found_columns.tolist())
+    )
+  return pairs
+
+
+def cluster_pairs(pairs: Iterable[tuple[str, str, float]]) -> list[tuple[list[str], float]]:
+  """
+  類似した組をつないだまとまり（キーのリスト, まとまりの中の組の最小の類似度）にする
+
+  AとB、BとCが類似していればAとCが類似していなくても同じまとまりになるので、thresholdは高めにして使う。
+  """
+  parents: dict[str, str] = {}
+
+  def find(key: str) -> str:
+    root = key
+    while parents.setdefault(root, root) != root:
+      root = parents[root]
+    while parents[key] != root:
+      parents[key], key = root, parents[key]
+    return root
+
+  pairs = list(pairs)
+  for a, b, _ in pairs:
+    root_a, root_b = find(a), find(b)
+    if root_a != root_b:
+      parents[root_b] = root_a
+  scores: dict[str, float] = {}
+  for a, _, score in pairs:
+    root = find(a)
+    scores[root] = min(score, scores.get(root, score))
+
+  clusters: dict[str, list[str]] = {}
+  for key in parents:
+    clusters.setdefault(find(key), []).append(key)
+  return [(members, scores[root]) for root, members in clusters.items()]
+
+
+def merge_entries(
+  entries: list[tuple[str, dict[str, Any]]], priority_names: list[str]
+) -> tuple[str, list[str], dict[str, Any]]:
+  """
+  重複したメモリを1つにまとめる（entriesは (キー, 保存用の辞書形式のメモリ) のリスト）
+
+  作成日時の最も古いメモリ（同じ場合はキーの小さいもの）を残し、(残すキー, 削除するキー, まとめたメモリ) を返す。
+  内容は最も新しく更新されたもの、タグは全ての和、優先度は最も高いもの（priority_namesで前にあるもの）にし、
+  参照回数は合計する。減衰させた参照回数は日時によって減衰の度合いが異なるため、呼び出し側で合計して設定する。
+  """
+  ordered = sorted(entries, key=lambda item: (item[1]["created_at"], item[0]))
+  keep, _ = ordered[0]
+  latest = max(entries, key=lambda item: (item[1]["updated_at"], item[0]))[1]
+  ranks = {priority: rank for rank, priority in enumerate(priority_names)}
+  tags: dict[str, None] = {}
+  for _, entry in ordered:
+    tags.update(dict.fromkeys(entry["tags"]))
+  merged = {
+    "tags": list(tags),
+    "content": latest["content"],
+    "priority": min((entry["priority"] for _, entry in entries), key=lambda priority: ranks.get(priority, len(ranks))),
+    "created_at": ordered[0][1]["created_at"],
+    "updated_at": latest["updated_at"],
+    "reference_count": sum(entry.get("reference_count", 0) for _, entry in entries),
+  }
+  return keep, [key for key, _ in ordered[1:]], merged
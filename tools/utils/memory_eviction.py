@@ -0,0 +1,113 @@
+import datetime
+import heapq
+import json
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from tools.utils.durability import Durability
+
+# メモリの件数が上限を超えたときに追い出すメモリの選び方
+#   low_priority: 優先度の低いもの（同じ優先度では更新が古いもの）
+#   least_recently_referenced: 最後に参照されたのが古いもの（一度も参照されていないものが先。同じものは更新が古い順）
+#   least_useful: 減衰させた参照回数の少ないもの（get_all_memoriesのorder_by="least_useful"と同じ順）
+EVICTION_POLICIES = ("low_priority", "least_recently_referenced", "least_useful")
+
+EvictionScore = tuple[int, ...]
+
+
+class EvictionQueue:
+  """
+  追い出す順（値の小さい順、同じ値はキーの小さい順）にメモリを並べたヒープ
+
+  値が変わるたびに新しい値を積み、古い値は取り出すときに読み飛ばす（遅延削除）。
+  読み飛ばす値がヒープの半分を超えたら積み直すので、追加・更新・取り出しはならしてO(log n)。
+  値は時間が経っても変わらないもの（優先度・日時・有用度）だけで作るので、メモリが変更されたときだけ積めばよい。
+  """
+
+  def __init__(self):
+    self._heap: list[tuple[EvictionScore, str]] = []
+    self._scores: dict[str, EvictionScore] = {}
+
+  def __len__(self) -> int:
+    return len(self._scores)
+
+  def update(self, key: str, score: EvictionScore) -> None:
+    if self._scores.get(key) == score:
+      return
+    self._scores[key] = score
+    heapq.heappush(self._heap, (score, key))
+    self._compact()
+
+  def remove(self, key: str) -> None:
+    if self._scores.pop(key, None) is not None:
+      self._compact()
+
+  def rebuild(self, scores: dict[str, EvictionScore]) -> None:
+    """全てのメモリの値から作り直す（まとめて読み込んだ後用。O(n)）"""
+    self._scores = scores
+    self._heap = [(score, key) for key, score in scores.items()]
+    heapq.heapify(self._heap)
+
+  def clear(self) -> None:
+    self._heap.clear()
+    self._scores.clear()
+
+  def pop(self, protected: frozenset[str] = frozenset()) -> Optional[str]:
+    """次に追い出すメモリのキーを取り出す（protectedのキーは飛ばす。追い出せるものがない場合はNone）"""
+    skipped: list[tuple[EvictionScore, str]] = []
+    found = None
+    while self._heap:
+      score, key = heapq.heappop(self._heap)
+      if self._scores.get(key) != score:
+        continue
+      if key in protected:
+        skipped.append((score, key))
+        continue
+      del self._scores[key]
+      found = key
+      break
+    for item in skipped:
+      heapq.heappush(self._heap, item)
+    return found
+
+  def _compact(self) -> None:
+    if len(self._heap) > 2 * len(self._scores) + 1024:
+      self.rebuild(self._scores)
+
+
+class MemoryArchive:
+  """
+  追い出したメモリの保管場所（`<memory_file>.archive`）
+
+  追い出したメモリを1行1件のJSONで追記する。ストレージから削除する前に書き込むので、
+  書き込みの途中でクラッシュしても失われない（同じメモリが重複して残ることはある）。
+
+    {"key": "...", "entry": {...}, "archived_at": "YYYYMMDDHHMMSS", "policy": "least_useful"}
+  """
+
+  def __init__(self, memory_file: Path, durability: Optional[Durability] = None):
+    self.path = memory_file.with_name(memory_file.name + ".archive")
+    self.durability = durability or Durability()
+
+  def append(self, entries: list[tuple[str, dict[str, Any]]], policy: str) -> None:
+    archived_at = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    lines = [
+      json.dumps({"key": key, "entry": entry, "archived_at": archived_at, "policy": policy}, ensure_ascii=False) + "\n"
+      for key, entry in entries
+    ]
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    with open(self.path, "a", encoding="utf-8") as f:
+      f.writelines(lines)
+      self.durability.sync(f, self.path)
+
+  def read(self) -> Iterator[dict[str, Any]]:
+    """追い出したメモリを古い順に返す（書き込み途中の行は飛ばす）"""
+    try:
+      with open(self.path, "r", encoding="utf-8") as f:
+        for line in f:
+          try:
+            yield json.loads(line)
+          except json.JSONDecodeError:
+            continue
+    except FileNotFoundError:
+      return
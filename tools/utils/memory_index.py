@@ -0,0 +1,251 @@
+import marshal
+import os
+import zlib
+from array import array
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+from rapidfuzz import fuzz, process, utils
+
+
+class FuzzyChoices:
+  """
+  ファジー検索用に前処理済みのメモリ内容を連続したリストで保持する
+
+  メモリの追加・更新・削除のたびに差分だけを更新し、検索のたびに全メモリの文字列を
+  作り直さないようにする。削除は末尾の要素と入れ替えて行うため、リストに穴は空かない。
+  スコアはrapidfuzzのcdistでまとめて計算し、複数のクエリも1回の呼び出しで処理する。
+  """
+
+  def __init__(self, workers: int = -1):
+    self.workers = workers
+    self.keys: list[str] = []
+    self.choices: list[str] = []
+    self._slots: dict[str, int] = {}
+
+  def __len__(self) -> int:
+    return len(self.keys)
+
+  def set(self, key: str, content: str) -> None:
+    choice = utils.default_process(content)
+    slot = self._slots.get(key)
+    if slot is None:
+      self._slots[key] = len(self.keys)
+      self.keys.append(key)
+      self.choices.append(choice)
+    else:
+      self.choices[slot] = choice
+
+  def remove(self, key: str) -> None:
+    slot = self._slots.pop(key, None)
+    if slot is None:
+      return
+    last_key = self.keys.pop()
+    last_choice = self.choices.pop()
+    if slot < len(self.keys):
+      self.keys[slot] = last_key
+      self.choices[slot] = last_choice
+      self._slots[last_key] = slot
+
+  def clear(self) -> None:
+    self.keys.clear()
+    self.choices.clear()
+    self._slots.clear()
+
+  def scores(
+    self,
+    queries: list[str],
+    candidates: Optional[Iterable[str]] = None,
+    score_cutoff: float = 0,
+    scorer: Callable[..., float] = fuzz.partial_ratio,
+  ) -> tuple[list[str], np.ndarray]:
+    """
+    クエリ x 候補 のスコア行列を計算する（列の順序は返り値のキーのリストと同じ）
+
+    candidatesを指定した場合はそのキーのみを対象にする（指定しない場合は全メモリが対象）。
+    scorerは検索では部分一致（partial_ratio）、重複の検出では全体の一致（ratio）を使う。
+    """
+    if candidates is None:
+      keys, choices = self.keys, self.choices
+    else:
+      slots = [self._slots[key] for key in candidates if key in self._slots]
+      keys = [self.keys[slot] for slot in slots]
+      choices = [self.choices[slot] for slot in slots]
+    if not queries or not choices:
+      return keys, np.zeros((len(queries), len(choices)), dtype=np.float64)
+
+    # クエリを行にすると、前処理済みのクエリを使い回しながらworkersで行ごとに並列に計算される
+    matrix = process.cdist(
+      [utils.default_process(query) for query in queries],
+      choices,
+      scorer=scorer,
+      score_cutoff=score_cutoff,
+      dtype=np.float64,
+      workers=self.workers,
+    )
+    return keys, matrix
+
+
+def fuzzy_scores(query: str, contents: list[str], workers: int = -1) -> np.ndarray:
+  """インデックスにない内容のリストに対するクエリのスコア（FuzzyChoicesの検索と同じ前処理とscorer）"""
+  if not contents:
+    return np.zeros(0, dtype=np.float64)
+  return process.cdist(
+    [utils.default_process(query)],
+    [utils.default_process(content) for content in contents],
+    scorer=fuzz.partial_ratio,
+    dtype=np.float64,
+    workers=workers,
+  )[0]
+
+
+def top_k(keys: list[str], scores: np.ndarray, limit: int, score_cutoff: float = 0) -> list[tuple[str, float]]:
+  """スコアの高い順に最大limit件の (キー, スコア) を返す（score_cutoff未満と0は除く）"""
+  n = len(scores)
+  if n == 0:
+    return []
+  k = min(limit, n)
+  top = np.argpartition(scores, n - k)[n - k :]
+  top = top[np.argsort(-scores[top], kind="stable")]
+  return [(keys[i], float(scores[i])) for i in top if scores[i] > 0 and scores[i] >= score_cutoff]
+
+
+def char_ngrams(text: str, sizes: tuple[int, ...] = (2, 3)) -> set[str]:
+  """前処理済みの文字列から文字n-gramの集合を作る（空白をまたぐn-gramは作らない）"""
+  grams: set[str] = set()
+  for word in text.split():
+    for n in sizes:
+      grams.update(word[i : i + n] for i in range(len(word) - n + 1))
+  return grams
+
+
+class NgramIndex:
+  """
+  文字バイグラム・トライグラム -> メモリ の転置インデックス
+
+  ファジー検索の前に、クエリとn-gramを多く共有するメモリだけに候補を絞り込む。
+  日本語のように単語の区切りがない文章でも部分一致の候補を拾える。
+
+  メモリには内部IDを振り、n-gramごとのIDの列をarrayで保持する（保存・読み込みがバイト列のコピーで済む）。
+  更新・削除されたメモリのIDは無効にするだけで列からは取り除かず、無効なIDが増えたら列を詰め直す。
+  """
+
+  FORMAT_VERSION = 2
+
+  def __init__(self):
+    self._postings: dict[str, array] = {}
+    # 内部ID -> キー（無効になったIDはNone）
+    self._keys: list[Optional[str]] = []
+    self._ids: dict[str, int] = {}
+    self._alive = bytearray()
+
+  def add(self, key: str, content: str) -> None:
+    self.remove(key)
+    doc_id = len(self._keys)
+    self._keys.append(key)
+    self._ids[key] = doc_id
+    self._alive.append(1)
+    for gram in char_ngrams(utils.default_process(content)):
+      postings = self._postings.get(gram)
+      if postings is None:
+        postings = self._postings[gram] = array("I")
+      postings.append(doc_id)
+
+  def remove(self, key: str) -> None:
+    doc_id = self._ids.pop(key, None)
+    if doc_id is None:
+      return
+    self._keys[doc_id] = None
+    self._alive[doc_id] = 0
+    if len(self._keys) > 1024 and len(self._ids) * 2 < len(self._keys):
+      self._compact()
+
+  def _compact(self) -> None:
+    """無効になったIDを取り除いて内部IDを振り直す"""
+    alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+    new_ids = np.cumsum(alive, dtype=np.int64) - 1
+    for gram in list(self._postings):
+      ids = np.frombuffer(self._postings[gram], dtype=np.uint32)
+      ids = new_ids[ids[alive[ids]]].astype(np.uint32)
+      if len(ids):
+        self._postings[gram] = array("I", ids.tobytes())
+      else:
+        del self._postings[gram]
+    self._keys = [key for key in self._keys if key is not None]
+    self._ids = {key: doc_id for doc_id, key in enumerate(self._keys)}
+    self._alive = bytearray(b"\x01" * len(self._keys))
+
+  def clear(self) -> None:
+    self._postings.clear()
+    self._keys.clear()
+    self._ids.clear()
+    self._alive.clear()
+
+  def shortlist(self, query: str, size: int, allowed: Optional[set[str]] = None) -> Optional[list[str]]:
+    """
+    クエリと共有するn-gramの数が多い順に最大size件のキーを返す
+
+    クエリが短すぎてn-gramを作れない場合は絞り込めないのでNoneを返す。
+    allowedを指定した場合はその中のキーだけを候補にする。
+    """
+    grams = char_ngrams(utils.default_process(query))
+    if not grams:
+      return None
+    postings = [self._postings[gram] for gram in grams if gram in self._postings]
+    if not postings:
+      return []
+
+    ids = np.concatenate([np.frombuffer(p, dtype=np.uint32) for p in postings])
+    ids, counts = np.unique(ids, return_counts=True)
+    keep = np.frombuffer(self._alive, dtype=np.uint8)[ids].astype(bool)
+    if allowed is not None:
+      allowed_ids = np.fromiter((self._ids[key] for key in allowed if key in self._ids), dtype=np.uint32)
+      keep &= np.isin(ids, allowed_ids)
+    ids, counts = ids[keep], counts[keep]
+
+    if len(ids) > size:
+      top = np.argpartition(-counts, size)[:size]
+      ids, counts = ids[top], counts[top]
+    order = np.argsort(-counts, kind="stable")
+    return [self._keys[doc_id] for doc_id in ids[order].tolist()]
+
+  def save(self, path: Path, fingerprint: int) -> None:
+    """インデックスをファイルに保存する（一時ファイルに書いてからリネームする）"""
+    if len(self._ids) < len(self._keys):
+      self._compact()
+    postings = {gram: ids.tobytes() for gram, ids in self._postings.items()}
+    # 同じメモリファイルを使う他のプロセスと一時ファイルが衝突しないようにファイル名にPIDを含める
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+      marshal.dump((self.FORMAT_VERSION, fingerprint, self._keys, postings), f)
+    os.replace(tmp_path, path)
+
+  def load(self, path: Path, fingerprint: int) -> bool:
+    """保存済みのインデックスを読み込む（メモリの内容と一致しない場合はFalseを返す）"""
+    try:
+      with open(path, "rb") as f:
+        version, saved_fingerprint, keys, postings = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+      return False
+    if version != self.FORMAT_VERSION or saved_fingerprint != fingerprint:
+      return False
+    self._keys = keys
+    self._ids = {key: doc_id for doc_id, key in enumerate(keys)}
+    self._alive = bytearray(b"\x01" * len(keys))
+    self._postings = {}
+    for gram, data in postings.items():
+      ids = array("I")
+      ids.frombytes(data)
+      self._postings[gram] = ids
+    return True
+
+
+def contents_fingerprint(items: Iterable[tuple[str, str]]) -> int:
+  """(キー, 内容) の集合から順序によらないフィンガープリントを計算する"""
+  total = 0
+  count = 0
+  for key, content in items:
+    total += zlib.crc32(f"{key}\0{content}".encode())
+    count += 1
+  return (count << 48) ^ (total & 0xFFFFFFFFFFFF)
@@ -0,0 +1,34 @@
+import datetime
+import secrets
+import threading
+from typing import Optional
+
+
+class MemoryKeyGenerator:
+  """
+  時系列順に並ぶ衝突しないメモリのキーを発行する
+
+  形式: memory_<YYYYMMDDHHMMSS><マイクロ秒6桁>_<プロセスごとの識別子（16進数4桁）>
+
+  - 先頭は従来のキー（memory_YYYYMMDDHHMMSS）と同じ形式なので、従来のキーと混ざっても文字列の順序が時系列順になる
+  - 同じプロセス内では単調に増加する（同じマイクロ秒に発行した場合や時計が戻った場合は直前のキーの1マイクロ秒後にする）
+  - 異なるプロセスが同じマイクロ秒に発行したキーは識別子で区別される
+  """
+
+  def __init__(self, prefix: str = "memory_", node: Optional[str] = None):
+    self.prefix = prefix
+    self.node = node or secrets.token_hex(2)
+    self._lock = threading.Lock()
+    # 最後に発行したキーの時刻（エポックからのマイクロ秒）
+    self._last = 0
+
+  def next(self, now: Optional[datetime.datetime] = None) -> str:
+    """新しいキーを発行する（nowを省略した場合は現在時刻）"""
+    now = now or datetime.datetime.now()
+    micros = int(now.replace(microsecond=0).timestamp()) * 1_000_000 + now.microsecond
+    with self._lock:
+      micros = max(micros, self._last + 1)
+      self._last = micros
+    seconds, microsecond = divmod(micros, 1_000_000)
+    issued_at = datetime.datetime.fromtimestamp(seconds).replace(microsecond=microsecond)
+    return f"{self.prefix}{issued_at.strftime('%Y%m%d%H%M%S%f')}_{self.node}"
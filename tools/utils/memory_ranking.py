@@ -0,0 +1,109 @@
+import datetime
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+# 検索結果に含めるのに必要な関連度（ファジー検索・ベクトル検索のスコア）の下限
+MIN_RELEVANCE = 20
+
+# 優先度ごとのスコア（未知の優先度は0）
+PRIORITY_SCORES = {"high": 100.0, "mid": 50.0, "low": 0.0}
+
+
+def timestamps_to_seconds(values: np.ndarray) -> np.ndarray:
+  """
+  YYYYMMDDHHMMSS形式の整数の列をエポックからの秒数（float）に変換する
+
+  日時として解釈できない値（負の値や月・日が範囲外のもの）はNaNにする。
+  """
+  values = np.asarray(values, dtype=np.int64)
+  year = values // 10**10
+  month = values // 10**8 % 100
+  day = values // 10**6 % 100
+  valid = (values > 0) & (year >= 1970) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+  months = np.where(valid, (year - 1970) * 12 + month - 1, 0).astype("datetime64[M]")
+  offset = (day - 1) * 86400 + values // 10**4 % 100 * 3600 + values // 100 % 100 * 60 + values % 100
+  seconds = months.astype("datetime64[s]").astype(np.int64) + offset
+  return np.where(valid, seconds, np.nan)
+
+
+def parse_timestamps(values: Iterable[str]) -> np.ndarray:
+  """YYYYMMDDHHMMSS形式の文字列の列をエポックからの秒数（int64）に変換する（空・不正な値は0）"""
+  numbers = np.array([int(value) if value.isdigit() and len(value) == 14 else 0 for value in values], dtype=np.int64)
+  return np.nan_to_num(timestamps_to_seconds(numbers), nan=0).astype(np.int64)
+
+
+def timestamp_to_seconds(value: str) -> int:
+  """YYYYMMDDHHMMSS形式の文字列をエポックからの秒数に変換する（空・不正な値は0）"""
+  return int(parse_timestamps([value])[0])
+
+
+def seconds_to_timestamp(seconds: int) -> str:
+  """エポックからの秒数をYYYYMMDDHHMMSS形式の文字列に戻す（0は空文字列）"""
+  if seconds <= 0:
+    return ""
+  return datetime.datetime.fromtimestamp(seconds, datetime.UTC).strftime("%Y%m%d%H%M%S")
+
+
+def current_seconds(now: Optional[datetime.datetime] = None) -> int:
+  """
+  現在時刻（nowを省略した場合）をtimestamps_to_secondsと同じ基準の秒数にする
+
+  日時の文字列はローカル時刻で保存しているので、ローカル時刻をそのままUTCとみなして変換する。
+  """
+  now = now or datetime.datetime.now()
+  return int(np.datetime64(now.replace(microsecond=0, tzinfo=None), "s").astype(np.int64))
+
+
+class MemoryRanker:
+  """
+  検索の関連度に優先度・新しさ・参照回数を加味したスコアを計算する
+
+  score = (1 - 各重みの和) * 関連度 + priority_weight * 優先度 + recency_weight * 新しさ + popularity_weight * 参照回数
+
+  各項は0-100に揃える。新しさは更新からの経過時間がrecency_half_life_daysごとに半分になり、
+  参照回数（時間とともに減衰させたもの）はpopularity_saturation回で50になるように飽和させる。
+  重みが全て0の場合は関連度だけで並ぶ。
+  """
+
+  def __init__(
+    self,
+    priority_weight: float = 0.1,
+    recency_weight: float = 0.1,
+    popularity_weight: float = 0.05,
+    recency_half_life_days: float = 30.0,
+    popularity_saturation: float = 10.0,
+  ):
+    weights = (priority_weight, recency_weight, popularity_weight)
+    if any(weight < 0 for weight in weights) or sum(weights) > 1:
+      raise ValueError(f"Ranking weights must be non-negative and sum to at most 1: {weights}")
+    self.priority_weight = priority_weight
+    self.recency_weight = recency_weight
+    self.popularity_weight = popularity_weight
+    self.relevance_weight = 1 - sum(weights)
+    self.recency_half_life = recency_half_life_days * 86400
+    self.popularity_saturation = popularity_saturation
+
+  def scores(
+    self,
+    relevance: np.ndarray,
+    priority_names: Sequence[str],
+    priority_codes: np.ndarray,
+    updated_at: np.ndarray,
+    reference_counts: np.ndarray,
+    now: Optional[datetime.datetime] = None,
+  ) -> np.ndarray:
+    """候補ごとのスコアを計算する（引数の列は全て候補の順に並べる。reference_countsは減衰させた参照回数）"""
+    scores = self.relevance_weight * np.asarray(relevance, dtype=np.float64)
+    if self.priority_weight:
+      table = np.array([PRIORITY_SCORES.get(name, 0.0) for name in priority_names])
+      scores += self.priority_weight * table[priority_codes]
+    if self.recency_weight:
+      age = np.maximum(current_seconds(now) - timestamps_to_seconds(updated_at), 0)
+      # 日時が不明なものは新しさを0とする
+      recency = np.nan_to_num(100 * np.exp2(-age / self.recency_half_life), nan=0.0)
+      scores += self.recency_weight * recency
+    if self.popularity_weight:
+      counts = np.asarray(reference_counts, dtype=np.float64)
+      scores += self.popularity_weight * 100 * counts / (counts + self.popularity_saturation)
+    return scores
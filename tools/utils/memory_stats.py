@@ -0,0 +1,160 @@
+import json
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from tools.utils.file_lock import StoreVersion
+from tools.utils.memory_storage import MemorySnapshot, create_memory_storage
+
+# 統計情報に含める使用回数の多いタグの数と最近追加したメモリの数
+TOP_TAGS = 5
+LATEST_CONTENTS = 10
+
+
+class MemoryStats:
+  """
+  メモリの統計情報（件数・タグごとの件数・優先度ごとの件数・作成日時の範囲）
+
+  メモリを追加・削除するたびにadd / removeで更新し、集計のために全メモリを走査しない。
+  作成日時の最小値・最大値は、その値のメモリを削除したときだけ次に参照されるまでに求め直す。
+  """
+
+  def __init__(self):
+    self.total = 0
+    self.tag_counts: Counter[str] = Counter()
+    self.priority_counts: Counter[str] = Counter()
+    # 作成日時 -> その日時に作成されたメモリの数
+    self._created_at: Counter[str] = Counter()
+    self._earliest: Optional[str] = None
+    self._latest: Optional[str] = None
+    self._range_stale = False
+
+  def add(self, tags: Iterable[str], priority: str, created_at: str) -> None:
+    self.total += 1
+    self.tag_counts.update(tags)
+    self.priority_counts[priority] += 1
+    self._created_at[created_at] += 1
+    if not self._range_stale:
+      if self._earliest is None or created_at < self._earliest:
+        self._earliest = created_at
+      if self._latest is None or created_at > self._latest:
+        self._latest = created_at
+
+  def add_counts(self, total: int, tag_counts: dict[str, int], priority_counts: dict[str, int], created_at: list[str]):
+    """集計済みの件数でまとめて追加する（読み込み時など、多数のメモリを一度に追加する場合用）"""
+    self.total += total
+    self.tag_counts.update(tag_counts)
+    self.priority_counts.update(priority_counts)
+    self._created_at.update(created_at)
+    if created_at and not self._range_stale:
+      earliest, latest = min(created_at), max(created_at)
+      if self._earliest is None or earliest < self._earliest:
+        self._earliest = earliest
+      if self._latest is None or latest > self._latest:
+        self._latest = latest
+
+  def remove(self, tags: Iterable[str], priority: str, created_at: str) -> None:
+    self.total -= 1
+    self.tag_counts.subtract(tags)
+    self.priority_counts[priority] -= 1
+    self._created_at[created_at] -= 1
+    if self._created_at[created_at] <= 0:
+      del self._created_at[created_at]
+      if created_at in (self._earliest, self._latest):
+        self._range_stale = True
+
+  def clear(self) -> None:
+    self.__init__()
+
+  def created_at_range(self) -> tuple[Optional[str], Optional[str]]:
+    """作成日時の最小値と最大値"""
+    if self._range_stale:
+      self._earliest = min(self._created_at, default=None)
+      self._latest = max(self._created_at, default=None)
+      self._range_stale = False
+    return self._earliest, self._latest
+
+  def summary(self, latest_contents: list[str]) -> dict[str, Any]:
+    """
+    統計情報を辞書形式で返す（MCPサーバーとAPIで共通の形式）
+
+    latest_contentsには最近追加したメモリの内容を古い順に渡す。
+    """
+    earliest, latest = self.created_at_range()
+    # 件数が同じタグはタグ名の順に並べる（どの順に集計しても同じ結果にする）
+    tag_counts = dict(sorted((item for item in self.tag_counts.items() if item[1] > 0), key=lambda x: (-x[1], x[0])))
+    return {
+      "total_memories": self.total,
+      "key_range": {"earliest": earliest, "latest": latest},
+      "tag_counts": tag_counts,
+      "priority_counts": {priority: count for priority, count in self.priority_counts.items() if count > 0},
+      # 保存したものを読み込んだときと同じ形になるよう、(タグ, 件数) はリストにする
+      "most_used_tags": [list(item) for item in list(tag_counts.items())[:TOP_TAGS]],
+      "latest_memory_contents": latest_contents,
+    }
+
+
+def snapshot_stats(snapshot: MemorySnapshot) -> dict[str, Any]:
+  """辞書形式の全メモリから統計情報を作る（保存された統計情報が使えない場合用）"""
+  stats = MemoryStats()
+  for item in snapshot.values():
+    stats.add(item.get("tags", []), item.get("priority", "mid"), item.get("created_at", ""))
+  contents = [item.get("content", "") for item in snapshot.values()]
+  return stats.summary(contents[-LATEST_CONTENTS:])
+
+
+def stats_file(memory_file: Path) -> Path:
+  """メモリファイルと一緒に保存する統計情報のファイルのパス"""
+  return memory_file.with_name(memory_file.name + ".stats")
+
+
+def save_stats(memory_file: Path, version: int, stats: dict[str, Any]) -> None:
+  """
+  ストアのバージョンと一緒に統計情報を保存する
+
+  統計情報はメモリから作り直せるため、一時ファイルへの書き込みとリネームだけを行いfsyncはしない。
+  """
+  path = stats_file(memory_file)
+  path.parent.mkdir(parents=True, exist_ok=True)
+  tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+  with open(tmp_path, "w", encoding="utf-8") as f:
+    json.dump({"version": version, "stats": stats}, f, ensure_ascii=False)
+  os.replace(tmp_path, path)
+
+
+def load_stats(memory_file: Path, version: int) -> Optional[dict[str, Any]]:
+  """保存されている統計情報を読み込む（存在しない・ストアのバージョンと一致しない場合はNone）"""
+  try:
+    with open(stats_file(memory_file), "r", encoding="utf-8") as f:
+      data = json.load(f)
+  except (OSError, json.JSONDecodeError):
+    return None
+  if not isinstance(data, dict) or data.get("version") != version:
+    return None
+  return data.get("stats")
+
+
+def read_memory_stats(memory_file: str | Path, storage_type: str = "json") -> Optional[dict[str, Any]]:
+  """
+  MCPサーバーを介さずにメモリファイルの統計情報を取得する（メモリが一度も保存されていない場合はNone）
+
+  MCPサーバーが書き込みのたびに保存している統計情報がストアの現在のバージョンのものであればそれを返す。
+  ない場合（古いバージョンのサーバーが書き込んだ場合など）は全メモリを読み込んで作り直し、保存しておく。
+  """
+  memory_file = Path(memory_file)
+  version_file = memory_file.with_name(memory_file.name + ".version")
+  if not memory_file.exists() and not version_file.exists():
+    return None
+  stats = load_stats(memory_file, StoreVersion(version_file).read())
+  if stats is not None:
+    return stats
+  storage = create_memory_storage(memory_file, storage_type)
+  try:
+    with storage.lock():
+      snapshot = storage.load()
+      stats = snapshot_stats(snapshot)
+      save_stats(memory_file, storage.version, stats)
+    return stats
+  finally:
+    storage.close()
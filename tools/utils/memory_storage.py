@@ -0,0 +1,557 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+from tools.utils.binary_snapshot import read_entries, write_entries
+from tools.utils.durability import Durability
+from tools.utils.file_lock import FileLock, StoreVersion
+
+# ストレージに渡す変更レコード
+#   {"op": "put", "key": "...", "entry": {...}}
+#   {"op": "delete", "key": "..."}
+MemoryRecord = dict[str, Any]
+MemorySnapshot = dict[str, dict[str, Any]]
+
+# バイナリスナップショットに保存するメモリの形式のバージョン
+# フィールドや値の制約を変えた場合は上げる（古いスナップショットは検証しながら読み込まれる）
+MEMORY_SCHEMA_VERSION = 2
+
+
+def apply_record(state: MemorySnapshot, record: MemoryRecord) -> None:
+  """変更レコードを辞書形式の状態に適用する"""
+  op = record.get("op")
+  key = record.get("key")
+  if op == "put":
+    state[key] = record["entry"]
+  elif op == "delete":
+    state.pop(key, None)
+
+
+def read_json_snapshot(path: Path) -> MemorySnapshot:
+  """JSONスナップショットを読み込む（存在しない・壊れている場合は空）"""
+  if not path.exists():
+    return {}
+  try:
+    with open(path, "r", encoding="utf-8") as f:
+      data = json.load(f)
+  except json.JSONDecodeError:
+    return {}
+  return data if isinstance(data, dict) else {}
+
+
+def write_json_snapshot(path: Path, state: MemorySnapshot, durability: Durability) -> None:
+  """一時ファイルに書き込んでからリネームし、途中でクラッシュしても元のファイルを壊さない"""
+  durability.replace(_write_json_tmp(path, state, durability), path)
+
+
+def _write_json_tmp(path: Path, state: MemorySnapshot, durability: Durability) -> Path:
+  """スナップショットを一時ファイルに書き込む（他のプロセスと衝突しないようにファイル名にPIDを含める）"""
+  path.parent.mkdir(parents=True, exist_ok=True)
+  tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+  with open(tmp_path, "w", encoding="utf-8") as f:
+    json.dump(state, f, ensure_ascii=False, indent=2)
+    durability.sync_before_replace(f)
+  return tmp_path
+
+
+class MemoryStorage(ABC):
+  """
+  MemoryManagerの永続化先のインターフェース
+
+  同じメモリファイルを複数のプロセス（エージェントのセッションごとに起動されるMCPサーバー）が共有するため、
+  書き込みは `<memory_file>.lock` によるプロセス間のロックを取って行い、書き込むたびに
+  `<memory_file>.version` のバージョン番号を進める。各プロセスは最後に同期したバージョンと比べて
+  他のプロセスの書き込みを検知し、変更を取り込んでから自分の変更を書き込む（楽観的な同期）。
+
+  書き込んだファイルをいつディスクに同期するかはdurability（fsyncの方針）に従う。
+  """
+
+  # 直前のload()の結果が検証済みのデータのみか（Trueの場合、MemoryManagerはエントリごとの検証を省略する）
+  validated = False
+  # 書き込みのたびに全メモリを書き直すか（Trueの場合、大量に取り込むときは書き込みを最後にまとめる）
+  rewrites_snapshot = False
+
+  def __init__(self, memory_file: Path, durability: Optional[Durability] = None):
+    self.memory_file = memory_file
+    self.durability = durability or Durability()
+    self.file_lock = FileLock(memory_file.with_name(memory_file.name + ".lock"))
+    self.store_version = StoreVersion(memory_file.with_name(memory_file.name + ".version"))
+    # 最後に同期（読み込み・書き込み）したときのバージョン
+    self.version = 0
+
+  def lock(self) -> FileLock:
+    """他のプロセスと排他するためのロック（同じプロセス内では再入可能）"""
+    return self.file_lock
+
+  def changed(self) -> bool:
+    """最後に同期してから他のプロセスが書き込んだかどうか"""
+    return self.store_version.read() != self.version
+
+  def load(self) -> MemorySnapshot:
+    """保存されている全てのメモリを読み込む"""
+    with self.file_lock:
+      self.version = self.store_version.read()
+      return self._load_state()
+
+  def read_changes(self) -> Optional[list[MemoryRecord]]:
+    """
+    最後に同期してから他のプロセスが書き込んだ変更レコードを読み込む
+
+    差分を読み込めない場合はNoneを返す（呼び出し側でload()し直して差分を求める）。
+    """
+    with self.file_lock:
+      version = self.store_version.read()
+      records = self._read_new_records()
+      if records is not None:
+        self.version = version
+      return records
+
+  def append(self, records: list[MemoryRecord], snapshot: Callable[[], MemorySnapshot]) -> None:
+    """
+    変更レコードを書き込む（他のプロセスの変更を取り込んでから呼ぶこと）
+
+    snapshotは現在の全メモリを返す関数で、差分を書き込めないストレージのみが使用する。
+    """
+    with self.file_lock:
+      self._append_records(records, snapshot)
+      self.version = self.store_version.bump()
+
+  @abstractmethod
+  def _load_state(self) -> MemorySnapshot:
+    """保存されている全てのメモリを読み込む（ロックを取った状態で呼ばれる）"""
+
+  @abstractmethod
+  def _append_records(self, records: list[MemoryRecord], snapshot: Callable[[], MemorySnapshot]) -> None:
+    """変更レコードを書き込む（ロックを取った状態で呼ばれる）"""
+
+  def _read_new_records(self) -> Optional[list[MemoryRecord]]:
+    """前回の同期以降に追記された変更レコード（差分を読めないストレージはNone）"""
+    return None
+
+  def close(self) -> None:
+    """ストレージを閉じる（グループコミットを待っている書き込みも同期する）"""
+    self.durability.close()
+
+
+class JsonMemoryStorage(MemoryStorage):
+  """変更のたびにJSONファイル全体を書き直す従来の保存方式"""
+
+  rewrites_snapshot = True
+
+  def _load_state(self) -> MemorySnapshot:
+    return read_json_snapshot(self.memory_file)
+
+  def _append_records(self, records: list[MemoryRecord], snapshot: Callable[[], MemorySnapshot]) -> None:
+    # 他のプロセスが書き込み途中のファイルを読まないよう、一時ファイルに書いてからリネームする
+    write_json_snapshot(self.memory_file, snapshot(), self.durability)
+
+
+class JournalMemoryStorage(MemoryStorage):
+  """
+  スナップショット + 追記ログ（write-ahead log）による保存方式
+
+  - 変更は1レコード1行のJSONとして `<memory_file>.wal` に追記する
+  - ログが一定件数を超えるとバックグラウンドでスナップショットに畳み込む
+  - 起動時はスナップショット、畳み込み中のログ、現在のログの順に再生する
+  - ログの先頭行にはファイルごとのIDを書き、他のプロセスがどのログのどこまで読んだかを判定できるようにする
+
+  スナップショットは従来の user_memory.json と同じ形式なので、既存のファイルはそのまま読み込める。
+  """
+
+  def __init__(self, memory_file: Path, durability: Optional[Durability] = None, compact_threshold: int = 1000):
+    super().__init__(memory_file, durability)
+    self.log_file = memory_file.with_name(memory_file.name + ".wal")
+    # 畳み込み中のログ（クラッシュ時は起動時に再生される）
+    self.compacting_log_file = memory_file.with_name(memory_file.name + ".wal.1")
+    self.compact_threshold = compact_threshold
+    # 畳み込みは1つのプロセスだけが行う
+    self.compact_file_lock = FileLock(memory_file.with_name(memory_file.name + ".compact.lock"))
+
+    self._compact_thread: Optional[threading.Thread] = None
+    self._log_records = 0
+    # 最後に同期したときのログの位置 (ログのID, バイト位置)（他のプロセスの追記を差分で読むために使う）
+    self._log_position: Optional[tuple[str, int]] = None
+
+  def _load_state(self) -> MemorySnapshot:
+    state = read_json_snapshot(self.memory_file)
+    for record in _read_log(self.compacting_log_file)[0]:
+      apply_record(state, record)
+    records, end = _read_log(self.log_file)
+    for record in records:
+      apply_record(state, record)
+    self._log_records = len(records)
+    self._log_position = _log_position(self.log_file, end)
+    return state
+
+  def _read_new_records(self) -> Optional[list[MemoryRecord]]:
+    if self._log_position is None:
+      return None
+    log_id, offset = self._log_position
+    if _log_id(self.log_file) == log_id:
+      records, end = _read_log(self.log_file, offset)
+      self._log_records += len(records)
+      self._log_position = (log_id, end)
+      return records
+
+    # 他のプロセスがログを畳み込み中のファイルに移した場合は、その残りと新しいログを読む
+    if _log_id(self.compacting_log_file) != log_id:
+      return None
+    records = _read_log(self.compacting_log_file, offset)[0]
+    new_records, end = _read_log(self.log_file)
+    self._log_records = len(new_records)
+    self._log_position = _log_position(self.log_file, end)
+    return records + new_records
+
+  def _append_records(self, records: list[MemoryRecord], snapshot: Callable[[], MemorySnapshot]) -> None:
+    # 他のプロセスがログを畳み込み中のファイルに移している場合があるので、書き込むたびに開き直す
+    self.log_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(self.log_file, "ab") as log:
+      if log.tell() == 0:
+        log_id = uuid.uuid4().hex
+        log.write(_dump_records([{"op": "log", "id": log_id}]).encode("utf-8"))
+      else:
+        log_id = _log_id(self.log_file)
+      log.write(_dump_records(records).encode("utf-8"))
+      self.durability.sync(log, self.log_file)
+      self._log_position = (log_id, log.tell()) if log_id is not None else None
+    self._log_records += len(records)
+
+  def append(self, records: list[MemoryRecord], snapshot: Callable[[], MemorySnapshot]) -> None:
+    super().append(records, snapshot)
+    if self._log_records >= self.compact_threshold:
+      self.compact_in_background()
+
+  def compact_in_background(self) -> None:
+    """ログの畳み込みをバックグラウンドスレッドで開始する"""
+    if self._compact_thread is not None and self._compact_thread.is_alive():
+      return
+    self._compact_thread = threading.Thread(target=self.compact, name="memory-journal-compaction", daemon=True)
+    self._compact_thread.start()
+
+  def compact(self) -> None:
+    """
+    現在のログをスナップショットに畳み込む
+
+    スナップショットの書き出しは他のプロセスの書き込みを止めずに行い、
+    書き出したファイルへの置き換えと畳み込んだログの削除だけをロックを取って行う。
+    畳み込み中のログを再生し直してもput/deleteの結果は変わらないため、途中で読み込まれても問題ない。
+    """
+    with self.compact_file_lock:
+      with self.file_lock:
+        # 前回の畳み込みが途中で終わっている場合はそのログを先に畳み込む
+        if not self.compacting_log_file.exists():
+          if self.log_file.exists():
+            os.replace(self.log_file, self.compacting_log_file)
+          self._log_records = 0
+
+      if not self.compacting_log_file.exists():
+        return
+      state = read_json_snapshot(self.memory_file)
+      for record in _read_log(self.compacting_log_file)[0]:
+        apply_record(state, record)
+      tmp_path = _write_json_tmp(self.memory_file, state, self.durability)
+      with self.file_lock:
+        self.durability.replace(tmp_path, self.memory_file)
+        self.compacting_log_file.unlink()
+
+  def close(self) -> None:
+    if self._compact_thread is not None:
+      self._compact_thread.join()
+    super().close()
+
+
+def _read_log(path: Path, offset: int = 0) -> tuple[list[MemoryRecord], int]:
+  """ログファイルのoffsetバイト目以降の変更レコードと、読み終えた位置を返す"""
+  records: list[MemoryRecord] = []
+  try:
+    with open(path, "rb") as f:
+      f.seek(offset)
+      for line in f:
+        try:
+          record = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+          # 書き込み途中でクラッシュした末尾の行は読み飛ばす
+          continue
+        if record.get("op") in ("put", "delete"):
+          records.append(record)
+      return records, f.tell()
+  except FileNotFoundError:
+    return records, 0
+
+
+def _log_id(path: Path) -> Optional[str]:
+  """ログファイルの先頭行に書かれたID（ファイルがない・IDがない古い形式の場合はNone）"""
+  try:
+    with open(path, "rb") as f:
+      header = json.loads(f.readline())
+  except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+    return None
+  return header.get("id") if isinstance(header, dict) and header.get("op") == "log" else None
+
+
+def _log_position(path: Path, offset: int) -> Optional[tuple[str, int]]:
+  log_id = _log_id(path)
+  return (log_id, offset) if log_id is not None else None
+
+
+class BinaryMemoryStorage(MemoryStorage):
+  """
+  バイナリ形式（marshal）のスナップショットによる保存方式
+
+  保存先は `<memory_file>.bin` で、変更のたびに全体を書き直す。
+  JSONより読み込みが速く、スキーマのバージョンが一致すれば保存時に検証済みのデータとして扱える。
+  初回起動時に同じ場所のuser_memory.jsonがあれば取り込む。
+  """
+
+  rewrites_snapshot = True
+
+  def __init__(self, memory_file: Path, durability: Optional[Durability] = None):
+    super().__init__(memory_file, durability)
+    self.snapshot_file = memory_file.with_suffix(".bin")
+
+  def _load_state(self) -> MemorySnapshot:
+    self.validated = False
+    if not self.snapshot_file.exists():
+      return read_json_snapshot(self.memory_file)
+    loaded = read_entries(self.snapshot_file)
+    if loaded is None:
+      return {}
+    schema_version, state = loaded
+    self.validated = schema_version == MEMORY_SCHEMA_VERSION
+    return state
+
+  def _append_records(self, records: list[MemoryRecord], snapshot: Callable[[], MemorySnapshot]) -> None:
+    write_entries(self.snapshot_file, MEMORY_SCHEMA_VERSION, snapshot(), self.durability)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+  key TEXT PRIMARY KEY,
+  content TEXT NOT NULL,
+  priority TEXT NOT NULL,
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL,
+  reference_count INTEGER NOT NULL DEFAULT 0,
+  decayed_reference_count REAL NOT NULL DEFAULT 0,
+  referenced_at TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS memory_tags (
+  tag TEXT NOT NULL,
+  key TEXT NOT NULL REFERENCES memories(key) ON DELETE CASCADE,
+  PRIMARY KEY (tag, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS memory_tags_key ON memory_tags(key);
+-- 検索・並べ替えはメモリ上の表で行うので使われなくなった索引（書き込みのたびに更新されるだけなので消す）
+DROP INDEX IF EXISTS memories_priority;
+DROP INDEX IF EXISTS memories_created_at;
+DROP INDEX IF EXISTS memories_updated_at;
+DROP INDEX IF EXISTS memories_reference_count;
+CREATE TABLE IF NOT EXISTS meta (
+  name TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+);
+"""
+
+
+# 後から追加した列（古いデータベースにはALTER TABLEで追加する）
+_SQLITE_ADDED_COLUMNS = {
+  "decayed_reference_count": "REAL NOT NULL DEFAULT 0",
+  "referenced_at": "TEXT NOT NULL DEFAULT ''",
+}
+
+_SQLITE_SYNCHRONOUS = {"always": "FULL", "group": "NORMAL", "none": "OFF"}
+
+
+class SqliteMemoryStorage(MemoryStorage):
+  """
+  SQLiteによる保存方式
+
+  変更は行単位で書き込むため、他のメモリの行には触れない。
+  タグは正規化したテーブルに保存する。
+  初回起動時に同じ場所のuser_memory.jsonがあれば一度だけ取り込む。
+
+  fsyncの方針はSQLiteのsynchronousに対応させる（groupはWALのチェックポイントでまとめて同期するNORMAL）。
+  """
+
+  def __init__(self, memory_file: Path, durability: Optional[Durability] = None):
+    super().__init__(memory_file, durability)
+    self.db_file = memory_file.with_suffix(".sqlite3")
+    self.db_file.parent.mkdir(parents=True, exist_ok=True)
+    # 参照回数の書き込みはタイマースレッドから行われることがある（排他はMemoryManager側で行う）
+    self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+    self._conn.execute("PRAGMA foreign_keys = ON")
+    self._conn.execute("PRAGMA journal_mode = WAL")
+    self._conn.execute(f"PRAGMA synchronous = {_SQLITE_SYNCHRONOUS[self.durability.policy]}")
+    with self.file_lock:
+      self._conn.executescript(_SQLITE_SCHEMA)
+      self._add_columns()
+      self._migrate_from_json()
+
+  def _add_columns(self) -> None:
+    """古いデータベースに後から追加した列を追加する"""
+    columns = {row[1] for row in self._conn.execute("PRAGMA table_info(memories)")}
+    for name, definition in _SQLITE_ADDED_COLUMNS.items():
+      if name not in columns:
+        self._conn.execute(f"ALTER TABLE memories ADD COLUMN {name} {definition}")
+
+  def _migrate_from_json(self) -> None:
+    """既存のJSONファイルを一度だけ取り込む"""
+    migrated = self._conn.execute("SELECT value FROM meta WHERE name = 'migrated_from'").fetchone()
+    if migrated is not None:
+      return
+    state = read_json_snapshot(self.memory_file)
+    with self._conn:
+      self._write(({"op": "put", "key": key, "entry": entry} for key, entry in state.items()))
+      self._conn.execute(
+        "INSERT INTO meta (name, value) VALUES ('migrated_from', ?)",
+        (str(self.memory_file) if state else "",),
+      )
+
+  def _load_state(self) -> MemorySnapshot:
+    state: MemorySnapshot = {}
+    for (
+      key,
+      content,
+      priority,
+      created_at,
+      updated_at,
+      reference_count,
+      decayed_reference_count,
+      referenced_at,
+    ) in self._conn.execute(
+      """
+      SELECT key, content, priority, created_at, updated_at, reference_count, decayed_reference_count, referenced_at
+      FROM memories
+      """
+    ):
+      state[key] = {
+        "tags": [],
+        "content": content,
+        "priority": priority,
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "reference_count": reference_count,
+        "decayed_reference_count": decayed_reference_count,
+        "referenced_at": referenced_at,
+      }
+    for tag, key in self._conn.execute("SELECT tag, key FROM memory_tags"):
+      state[key]["tags"].append(tag)
+    return state
+
+  def _append_records(self, records: list[MemoryRecord], snapshot: Callable[[], MemorySnapshot]) -> None:
+    with self._conn:
+      self._write(records)
+
+  def _write(self, records: Iterable[MemoryRecord]) -> None:
+    for record in records:
+      key = record["key"]
+      if record["op"] == "delete":
+        self._conn.execute("DELETE FROM memories WHERE key = ?", (key,))
+        continue
+      entry = record["entry"]
+      self._conn.execute(
+        """
+        INSERT INTO memories (
+          key, content, priority, created_at, updated_at, reference_count, decayed_reference_count, referenced_at
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET
+          content = excluded.content,
+          priority = excluded.priority,
+          created_at = excluded.created_at,
+          updated_at = excluded.updated_at,
+          reference_count = excluded.reference_count,
+          decayed_reference_count = excluded.decayed_reference_count,
+          referenced_at = excluded.referenced_at
+        """,
+        (
+          key,
+          entry["content"],
+          entry.get("priority", "mid"),
+          entry["created_at"],
+          entry["updated_at"],
+          entry.get("reference_count", 0),
+          entry.get("decayed_reference_count", 0.0),
+          entry.get("referenced_at", ""),
+        ),
+      )
+      self._conn.execute("DELETE FROM memory_tags WHERE key = ?", (key,))
+      self._conn.executemany(
+        "INSERT OR IGNORE INTO memory_tags (tag, key) VALUES (?, ?)", [(tag, key) for tag in entry.get("tags", [])]
+      )
+
+  def close(self) -> None:
+    self._conn.close()
+    super().close()
+
+
+def _dump_records(records: Iterable[MemoryRecord]) -> str:
+  return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+
+def create_memory_storage(
+  memory_file: Path, storage_type: str = "json", durability: Optional[Durability] = None
+) -> MemoryStorage:
+  """保存方式の名前からストレージを作成する"""
+  if storage_type == "json":
+    return JsonMemoryStorage(memory_file, durability)
+  if storage_type == "journal":
+    return JournalMemoryStorage(memory_file, durability)
+  if storage_type == "sqlite":
+    return SqliteMemoryStorage(memory_file, durability)
+  if storage_type == "binary":
+    return BinaryMemoryStorage(memory_file, durability)
+  raise ValueError(f"Unknown memory storage type: {storage_type}")
+
+
+# メモリファイルと一緒に移すファイルの名前の付け方（保存方式ごとのデータ、追い出したメモリ、バージョン・統計情報・インデックス）
+_STORE_FILE_SUFFIXES = (
+  "",
+  ".wal",
+  ".wal.1",
+  ".archive",
+  ".version",
+  ".stats",
+  ".changes",
+  ".ngram",
+  ".cold",
+  ".cold-wal",
+  ".cold-shm",
+)
+_STORE_FILE_EXTENSIONS = (".bin", ".sqlite3", ".sqlite3-wal", ".sqlite3-shm")
+
+
+def _store_files(memory_file: Path) -> list[Path]:
+  return [memory_file.with_name(memory_file.name + suffix) for suffix in _STORE_FILE_SUFFIXES] + [
+    memory_file.with_suffix(extension) for extension in _STORE_FILE_EXTENSIONS
+  ]
+
+
+def migrate_store(source: Path, destination: Path) -> bool:
+  """
+  sourceのメモリのファイルをdestinationに移す（移した場合はTrue）
+
+  destinationにまだメモリがなく、sourceにある場合だけ移す。sourceのロックを取って行うので、
+  複数のプロセスが同時に呼んでも移すのは1回だけになる。
+  """
+
+  def movable() -> bool:
+    return any(path.exists() for path in _store_files(source)) and not any(
+      path.exists() for path in _store_files(destination)
+    )
+
+  if not movable():
+    return False
+  with FileLock(source.with_name(source.name + ".lock")):
+    if not movable():
+      return False
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    for path, target in zip(_store_files(source), _store_files(destination)):
+      if path.exists():
+        os.replace(path, target)
+  return True
@@ -0,0 +1,515 @@
+import heapq
+import sys
+from itertools import islice
+from typing import Any, Callable, Iterable, Optional
+
+import numpy as np
+
+from tools.utils.memory_eviction import EVICTION_POLICIES, EvictionQueue
+from tools.utils.memory_ranking import (
+  current_seconds,
+  parse_timestamps,
+  seconds_to_timestamp,
+  timestamp_to_seconds,
+  timestamps_to_seconds,
+)
+from tools.utils.memory_stats import MemoryStats
+
+
+class MemoryTable:
+  """
+  メモリを列ごとの配列で保持する表
+
+  エントリごとにオブジェクトを作らず、内容とキーはリスト、作成・更新日時と参照回数はint64、
+  優先度はコード（int8）、タグは固定のタグ集合に対するビットマスク（uint32）の列で保持する。
+  キー・タグ・優先度の文字列はインターンして、インデックスなどとの間で同じオブジェクトを共有する。
+
+  行はキーを追加した順に並ぶとは限らない（削除は末尾の行と入れ替えて行う）が、
+  キーの一覧（_rows）は追加した順を保つ。
+  統計情報（stats）は行を追加・上書き・削除するたびに更新する。
+  versionは内容を変更するたびに増える（参照回数の増加では変わらない）ので、検索結果のキャッシュのキーに使える。
+
+  参照回数は累計（reference_count）とは別に、reference_half_life_daysごとに半分になる減衰した値を持つ。
+  減衰した値は最後に参照した時点の値と時刻だけを保持し、読み出すときに経過時間から計算する
+  （時間が経つたびに全メモリを書き直さない）。
+
+  eviction_policyを指定した場合は、件数の上限を超えたときに追い出す順に並べたヒープ（eviction）を
+  行を変更するたびに更新する。
+
+  offload()した行は内容を手放し（contentsはNone）、読み出すときにload_contentで取得する。
+  """
+
+  # 日時の列で、数字だけの文字列として表せない値の印（元の文字列は別に保持する）
+  _RAW_TIME = -1
+
+  # ordered_keysで指定できる並び順
+  ORDERS = ("recency", "priority", "reference_count", "least_useful")
+
+  _COLUMNS = (
+    "_tags",
+    "_priority",
+    "_created_at",
+    "_updated_at",
+    "_reference_count",
+    "_decayed_references",
+    "_referenced_at",
+    "_usefulness",
+  )
+
+  # 有用度（_usefulness）の固定小数点の倍率と、一度も参照されていないメモリの有用度
+  _USEFULNESS_SCALE = 1_000_000
+  _NEVER_REFERENCED = np.iinfo(np.int64).min // 2
+
+  def __init__(
+    self,
+    tag_names: Iterable[str],
+    priority_names: Iterable[str],
+    initial_capacity: int = 1024,
+    reference_half_life_days: float = 30.0,
+    eviction_policy: Optional[str] = None,
+  ):
+    self.tag_names = [sys.intern(tag) for tag in tag_names]
+    if len(self.tag_names) > 32:
+      raise ValueError("MemoryTable supports up to 32 tags")
+    self._tag_bits = {tag: 1 << i for i, tag in enumerate(self.tag_names)}
+    # 未知の優先度は読み込み時に末尾に追加する
+    self.priority_names = [sys.intern(priority) for priority in priority_names]
+    self._priority_codes = {priority: code for code, priority in enumerate(self.priority_names)}
+
+    self.keys: list[str] = []
+    self.contents: list[Optional[str]] = []
+    # offload()した行の内容をキーから読み出す関数
+    self.load_content: Optional[Callable[[str], str]] = None
+    self._rows: dict[str, int] = {}
+    self._tags = np.zeros(initial_capacity, dtype=np.uint32)
+    self._priority = np.zeros(initial_capacity, dtype=np.int8)
+    self._created_at = np.zeros(initial_capacity, dtype=np.int64)
+    self._updated_at = np.zeros(initial_capacity, dtype=np.int64)
+    self._reference_count = np.zeros(initial_capacity, dtype=np.int64)
+    # 最後に参照した時点の減衰した参照回数と、その時刻（エポックからの秒数。0は参照されていない）
+    self._decayed_references = np.zeros(initial_capacity, dtype=np.float64)
+    self._referenced_at = np.zeros(initial_capacity, dtype=np.int64)
+    # 有用度のインデックス: log2(減衰した参照回数) + 参照した時刻 / 半減期 の固定小数点
+    # （減衰した参照回数の大小は時刻によらずこの値の大小と一致するので、参照されたときだけ更新すればよい）
+    self._usefulness = np.full(initial_capacity, self._NEVER_REFERENCED, dtype=np.int64)
+    self._reference_half_life = reference_half_life_days * 86400
+    # (列名, キー) -> 日時の元の文字列（数字だけの文字列として表せないもの）
+    self._raw_times: dict[tuple[str, str], str] = {}
+    self.stats = MemoryStats()
+    self.version = 0
+    if eviction_policy is not None and eviction_policy not in EVICTION_POLICIES:
+      raise ValueError(f"Unknown eviction policy: {eviction_policy}")
+    self.eviction_policy = eviction_policy
+    self.eviction: Optional[EvictionQueue] = EvictionQueue() if eviction_policy is not None else None
+
+  def __len__(self) -> int:
+    return len(self.keys)
+
+  def __contains__(self, key: object) -> bool:
+    return key in self._rows
+
+  def __iter__(self):
+    return iter(self._rows)
+
+  def _grow(self) -> None:
+    capacity = len(self._tags) * 2
+    for name in self._COLUMNS:
+      column = getattr(self, name)
+      grown = np.full(capacity, self._NEVER_REFERENCED if name == "_usefulness" else 0, dtype=column.dtype)
+      grown[: len(column)] = column
+      setattr(self, name, grown)
+
+  def _encode_tags(self, tags: Iterable[str]) -> int:
+    mask = 0
+    for tag in tags:
+      bit = self._tag_bits.get(tag)
+      if bit is None:
+        raise ValueError(f"Unknown memory tag: {tag}")
+      mask |= bit
+    return mask
+
+  def _decode_tags(self, mask: int) -> list[str]:
+    return [tag for i, tag in enumerate(self.tag_names) if mask >> i & 1]
+
+  def _encode_priority(self, priority: str) -> int:
+    code = self._priority_codes.get(priority)
+    if code is None:
+      code = len(self.priority_names)
+      self.priority_names.append(sys.intern(priority))
+      self._priority_codes[priority] = code
+    return code
+
+  def _encode_time(self, name: str, key: str, value: str) -> int:
+    # YYYYMMDDHHMMSS形式の日時は整数で保持し、それ以外の形式は元の文字列を別に保持する
+    if value.isdigit() and (value == "0" or value[0] != "0") and len(value) < 19:
+      self._raw_times.pop((name, key), None)
+      return int(value)
+    self._raw_times[(name, key)] = value
+    return self._RAW_TIME
+
+  def _get_time(self, column: np.ndarray, name: str, key: str, row: int) -> str:
+    value = int(column[row])
+    return self._raw_times[(name, key)] if value == self._RAW_TIME else str(value)
+
+  def put(
+    self,
+    key: str,
+    tags: Iterable[str],
+    content: str,
+    priority: str,
+    created_at: str,
+    updated_at: str,
+    reference_count: int = 0,
+    decayed_reference_count: float = 0.0,
+    referenced_at: str = "",
+  ) -> None:
+    """メモリを追加・上書きする（未知のタグの場合はValueError）"""
+    tags = list(tags)
+    mask = self._encode_tags(tags)
+    self.version += 1
+    row = self._rows.get(key)
+    if row is not None:
+      self._stats_remove(key, row)
+    if row is None:
+      key = sys.intern(key)
+      row = len(self.keys)
+      if row == len(self._tags):
+        self._grow()
+      self._rows[key] = row
+      self.keys.append(key)
+      self.contents.append(content)
+    else:
+      self.contents[row] = content
+    self._tags[row] = mask
+    self._priority[row] = self._encode_priority(priority)
+    self._created_at[row] = self._encode_time("created_at", key, created_at)
+    self._updated_at[row] = self._encode_time("updated_at", key, updated_at)
+    self._reference_count[row] = reference_count
+    self._set_decayed_references(row, decayed_reference_count, timestamp_to_seconds(referenced_at))
+    self.stats.add(tags, priority, created_at)
+    self._update_eviction(key, row)
+
+  def _set_decayed_references(self, row: Any, value: Any, referenced_at: Any) -> None:
+    value = np.asarray(value, dtype=np.float64)
+    referenced_at = np.asarray(referenced_at, dtype=np.int64)
+    self._decayed_references[row] = value
+    self._referenced_at[row] = referenced_at
+    with np.errstate(divide="ignore"):
+      usefulness = (np.log2(value) + referenced_at / self._reference_half_life) * self._USEFULNESS_SCALE
+    self._usefulness[row] = np.where(value > 0, np.nan_to_num(usefulness), self._NEVER_REFERENCED)
+
+  def _stats_remove(self, key: str, row: int) -> None:
+    self.stats.remove(
+      self._decode_tags(int(self._tags[row])),
+      self.priority_names[self._priority[row]],
+      self._get_time(self._created_at, "created_at", key, row),
+    )
+
+  def extend(self, entries: Iterable[tuple[str, dict[str, Any]]]) -> None:
+    """
+    辞書形式のメモリをまとめて追加する（読み込み用）
+
+    列への書き込みを最後に1回のスライス代入で行うため、putを繰り返すよりも速い。
+    """
+    existing: list[tuple[str, dict[str, Any]]] = []
+    new_keys: list[str] = []
+    contents: list[str] = []
+    tags: list[int] = []
+    priorities: list[int] = []
+    created_at: list[str] = []
+    updated_at: list[str] = []
+    reference_counts: list[int] = []
+    decayed_references: list[float] = []
+    referenced_at: list[str] = []
+    # 未知のタグがあった場合に表を変更しないよう、先に全てを変換する
+    for key, entry in entries:
+      if key in self._rows:
+        self._encode_tags(entry["tags"])
+        existing.append((key, entry))
+        continue
+      tags.append(self._encode_tags(entry["tags"]))
+      new_keys.append(sys.intern(key))
+      contents.append(entry["content"])
+      priorities.append(self._encode_priority(entry["priority"]))
+      created_at.append(entry["created_at"])
+      updated_at.append(entry["updated_at"])
+      reference_counts.append(entry.get("reference_count", 0))
+      decayed_references.append(entry.get("decayed_reference_count", 0.0))
+      referenced_at.append(entry.get("referenced_at", ""))
+
+    self.version += 1
+    for key, entry in existing:
+      self.put(key, **entry)
+    start = len(self.keys)
+    end = start + len(new_keys)
+    while end > len(self._tags):
+      self._grow()
+    self._rows.update(zip(new_keys, range(start, end)))
+    self.keys.extend(new_keys)
+    self.contents.extend(contents)
+    self._tags[start:end] = tags
+    self._priority[start:end] = priorities
+    self._reference_count[start:end] = reference_counts
+    self._set_decayed_references(slice(start, end), decayed_references, parse_timestamps(referenced_at))
+    self._created_at[start:end] = [self._encode_time("created_at", k, v) for k, v in zip(new_keys, created_at)]
+    self._updated_at[start:end] = [self._encode_time("updated_at", k, v) for k, v in zip(new_keys, updated_at)]
+    # 統計情報も追加した行の列からまとめて集計する
+    masks = self._tags[start:end]
+    self.stats.add_counts(
+      len(new_keys),
+      {tag: int(np.count_nonzero(masks & bit)) for tag, bit in self._tag_bits.items()},
+      {self.priority_names[code]: int(count) for code, count in enumerate(np.bincount(self._priority[start:end]))},
+      created_at,
+    )
+    if self.eviction is not None:
+      if len(new_keys) > len(self.eviction):
+        rows = slice(0, end)
+        scores = zip(*(column.tolist() for column in self._eviction_columns(rows)))
+        self.eviction.rebuild(dict(zip(self.keys, scores)))
+      else:
+        for key, row in zip(new_keys, range(start, end)):
+          self._update_eviction(key, row)
+
+  def remove(self, key: str) -> bool:
+    row = self._rows.get(key)
+    if row is None:
+      return False
+    self.version += 1
+    self._stats_remove(key, row)
+    if self.eviction is not None:
+      self.eviction.remove(key)
+    del self._rows[key]
+    self._raw_times.pop(("created_at", key), None)
+    self._raw_times.pop(("updated_at", key), None)
+    last = len(self.keys) - 1
+    last_key = self.keys.pop()
+    last_content = self.contents.pop()
+    if row < last:
+      self.keys[row] = last_key
+      self.contents[row] = last_content
+      self._rows[last_key] = row
+      for name in self._COLUMNS:
+        column = getattr(self, name)
+        column[row] = column[last]
+    return True
+
+  def clear(self) -> None:
+    self.keys.clear()
+    self.contents.clear()
+    self._rows.clear()
+    self._raw_times.clear()
+    self.stats.clear()
+    if self.eviction is not None:
+      self.eviction.clear()
+    self.version += 1
+
+  def content(self, key: str) -> str:
+    return self._content(key, self._rows[key])
+
+  def _content(self, key: str, row: int) -> str:
+    content = self.contents[row]
+    if content is None:
+      content = self.load_content(key)
+    return content
+
+  def offload(self, key: str) -> None:
+    """行の内容を手放す（以後はload_contentで読み出す）"""
+    self.contents[self._rows[key]] = None
+
+  def restore(self, key: str) -> None:
+    """offload()した行の内容を読み出して表に戻す"""
+    row = self._rows[key]
+    if self.contents[row] is None:
+      self.contents[row] = self.load_content(key)
+
+  def offloaded(self) -> int:
+    """内容を手放している行の数"""
+    return self.contents.count(None)
+
+  def tags(self, key: str) -> list[str]:
+    return self._decode_tags(int(self._tags[self._rows[key]]))
+
+  def reference_count(self, key: str) -> int:
+    return int(self._reference_count[self._rows[key]])
+
+  def set_content(self, key: str, content: str, updated_at: str) -> None:
+    row = self._rows[key]
+    self.version += 1
+    self.contents[row] = content
+    self._updated_at[row] = self._encode_time("updated_at", key, updated_at)
+    self._update_eviction(key, row)
+
+  def add_reference(self, key: str, count: int = 1, now: Optional[int] = None) -> None:
+    """参照回数を増やす（nowはcurrent_secondsの秒数。省略した場合は現在時刻）"""
+    row = self._rows[key]
+    now = current_seconds() if now is None else now
+    self._reference_count[row] += count
+    self._set_decayed_references(row, self._decay(row, now) + count, now)
+    self._update_eviction(key, row)
+
+  def _decay(self, rows: Any, now: int) -> Any:
+    elapsed = np.maximum(now - self._referenced_at[rows], 0)
+    return self._decayed_references[rows] * np.exp2(-elapsed / self._reference_half_life)
+
+  def decayed_references(self, keys: list[str], now: Optional[int] = None) -> np.ndarray:
+    """キーの順に並べた、現在時刻まで減衰させた参照回数"""
+    rows = np.fromiter((self._rows[key] for key in keys), dtype=np.int64, count=len(keys))
+    return self._decay(rows, current_seconds() if now is None else now)
+
+  def signals(self, keys: list[str], now: Optional[int] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """キーの順に並べた優先度のコード・更新日時・減衰させた参照回数の列（検索結果の順位付け用）"""
+    rows = np.fromiter((self._rows[key] for key in keys), dtype=np.int64, count=len(keys))
+    return self._priority[rows], self._updated_at[rows], self._decay(rows, current_seconds() if now is None else now)
+
+  def entry(self, key: str) -> dict[str, Any]:
+    """保存用の辞書形式（MemoryEntryと同じフィールド）でメモリを返す"""
+    row = self._rows[key]
+    return {
+      "tags": self._decode_tags(int(self._tags[row])),
+      "content": self._content(key, row),
+      "priority": self.priority_names[self._priority[row]],
+      "created_at": self._get_time(self._created_at, "created_at", key, row),
+      "updated_at": self._get_time(self._updated_at, "updated_at", key, row),
+      "reference_count": int(self._reference_count[row]),
+      "decayed_reference_count": float(self._decayed_references[row]),
+      "referenced_at": seconds_to_timestamp(int(self._referenced_at[row])),
+    }
+
+  def entries(self) -> dict[str, dict[str, Any]]:
+    """全メモリを追加した順に辞書形式で返す"""
+    return {key: self.entry(key) for key in self._rows}
+
+  def sort_values(self, order_by: str, key: str) -> tuple[int, ...]:
+    """並び順（ORDERS）でのメモリの値（小さいほど前に並ぶ。ordered_keysのafterに渡す）"""
+    row = self._rows[key]
+    return tuple(int(column[0]) for column in self._sort_columns(order_by, slice(row, row + 1)))
+
+  def _sort_columns(self, order_by: str, rows: Any) -> list[np.ndarray]:
+    # 新しいもの・優先度が高いもの・参照回数が多いものが前に並ぶよう、大きい方を前にする値は符号を反転する
+    updated_at = -self._updated_at[rows]
+    if order_by == "recency":
+      return [updated_at]
+    if order_by == "priority":
+      return [self._priority[rows].astype(np.int64), updated_at]
+    if order_by == "reference_count":
+      return [-self._reference_count[rows], updated_at]
+    if order_by == "least_useful":
+      # 減衰した参照回数が少ないもの（一度も参照されていないものを含む）が前、同じものは更新が古い順
+      return [self._usefulness[rows], self._updated_at[rows]]
+    raise ValueError(f"Unknown order: {order_by}")
+
+  def ordered_keys(self, order_by: str, limit: int, after: Optional[tuple[tuple[int, ...], str]] = None) -> list[str]:
+    """
+    並び順（recency: 更新が新しい順 / priority: 優先度の高い順 / reference_count: 参照回数の多い順 /
+    least_useful: 減衰させた参照回数の少ない順）で
+    after（前のページの最後の (値, キー)）より後ろの先頭limit件のキーを返す
+
+    値が同じものはキーの大きい順に並べる。全体をnumpyで並べた後、ページに入る項目の同じ値の中でだけキーで並べ直す。
+    """
+    n = len(self.keys)
+    columns = self._sort_columns(order_by, slice(0, n))
+    if limit <= 0:
+      return []
+    rows = np.arange(n)
+    if after is not None:
+      # カーソルより後ろ: 値が辞書順で大きい、または値が同じでキーが小さい
+      cursor_values, cursor_key = after
+      greater = np.zeros(n, dtype=bool)
+      equal = np.ones(n, dtype=bool)
+      for column, value in zip(columns, cursor_values):
+        greater |= equal & (column > value)
+        equal &= column == value
+      ties = [row for row in np.flatnonzero(equal).tolist() if self.keys[row] < cursor_key]
+      rows = np.concatenate([np.flatnonzero(greater), np.array(ties, dtype=np.int64)])
+      columns = [column[rows] for column in columns]
+
+    # np.lexsortは最後の列を第1キーにする
+    order = np.lexsort(columns[::-1])
+    head, boundary = order[:limit], order[:0]
+    if len(order) > limit:
+      # ページの最後の項目と値が同じ項目（連続して並ぶ）は、キーの大きい順に並べたときにページに入るものだけを選ぶ
+      last = order[limit - 1]
+      same = np.ones(len(order), dtype=bool)
+      for column in columns:
+        same &= column[order] == column[last]
+      start = int(np.argmax(same))
+      end = len(order) - int(np.argmax(same[::-1]))
+      head, boundary = order[:start], order[start:end]
+
+    selected = rows[head].tolist()
+    values = {row: tuple(int(column[i]) for column in columns) for row, i in zip(selected, head.tolist())}
+    selected.sort(key=lambda row: self.keys[row], reverse=True)
+    selected.sort(key=values.__getitem__)
+    if len(boundary):
+      selected += heapq.nlargest(limit - len(selected), rows[boundary].tolist(), key=self.keys.__getitem__)
+    return [self.keys[row] for row in selected]
+
+  def select_tags(self, tags: Iterable[str], match_all: bool = False) -> set[str]:
+    """
+    タグでメモリのキーを絞り込む（ビットマスクの列に対する1回の比較で行う）
+
+    match_all=Trueの場合は全てのタグを持つもの（AND）、Falseの場合はいずれかのタグを持つもの（OR）を返す。
+    """
+    tags = list(tags)
+    if not tags or (match_all and any(tag not in self._tag_bits for tag in tags)):
+      return set()
+    mask = 0
+    for tag in tags:
+      mask |= self._tag_bits.get(tag, 0)
+    column = self._tags[: len(self.keys)]
+    selected = (column & mask) == mask if match_all else (column & mask) != 0
+    return {self.keys[row] for row in np.flatnonzero(selected).tolist()}
+
+  def _eviction_columns(self, rows: Any) -> tuple[np.ndarray, np.ndarray]:
+    # 値の小さいものから追い出す。同じ値のものは更新が古いものから
+    updated_at = self._updated_at[rows]
+    if self.eviction_policy == "low_priority":
+      return -self._priority[rows].astype(np.int64), updated_at
+    if self.eviction_policy == "least_recently_referenced":
+      return self._referenced_at[rows], updated_at
+    return self._usefulness[rows], updated_at
+
+  def _update_eviction(self, key: str, row: int) -> None:
+    if self.eviction is not None:
+      self.eviction.update(key, tuple(int(column[0]) for column in self._eviction_columns(slice(row, row + 1))))
+
+  def eviction_candidates(self, count: int, protected: frozenset[str] = frozenset()) -> list[str]:
+    """次に追い出すメモリのキーを追い出す順に最大count件返す（protectedのキーは除く。表からは取り除かない）"""
+    if self.eviction is None:
+      return []
+    keys: list[str] = []
+    while len(keys) < count:
+      key = self.eviction.pop(protected)
+      if key is None:
+        break
+      keys.append(key)
+    for key in keys:
+      self._update_eviction(key, self._rows[key])
+    return keys
+
+  def _hot(self, rows: Any, priorities: Iterable[str], tags: Iterable[str], since: int) -> np.ndarray:
+    codes = [self._priority_codes[priority] for priority in priorities if priority in self._priority_codes]
+    bits = 0
+    for tag in tags:
+      bits |= self._tag_bits.get(tag, 0)
+    hot = np.isin(self._priority[rows], codes) | ((self._tags[rows] & bits) != 0)
+    hot |= self._referenced_at[rows] >= since
+    return hot | (np.nan_to_num(timestamps_to_seconds(self._updated_at[rows]), nan=0) >= since)
+
+  def hot_rows(self, priorities: Iterable[str], tags: Iterable[str], since: int) -> np.ndarray:
+    """
+    hotの層に置く行のマスク（行の順）
+
+    優先度がprioritiesのいずれか、タグがtagsのいずれかを含む、またはsince（current_secondsの秒数）以降に
+    参照・更新されたものがhotになる。
+    """
+    return self._hot(slice(0, len(self.keys)), list(priorities), list(tags), since)
+
+  def is_hot(self, key: str, priorities: Iterable[str], tags: Iterable[str], since: int) -> bool:
+    row = self._rows[key]
+    return bool(self._hot(slice(row, row + 1), list(priorities), list(tags), since)[0])
+
+  def latest_contents(self, n: int) -> list[str]:
+    """最近追加したn件のメモリの内容（古い順）"""
+    keys = list(islice(reversed(self._rows), n))
+    return [self.content(key) for key in reversed(keys)]
@@ -0,0 +1,164 @@
+import sqlite3
+import zlib
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from rapidfuzz import utils
+
+from tools.utils.memory_index import char_ngrams
+
+# 参照・更新されていなくても常にhotの層に置く優先度とタグ
+HOT_PRIORITIES = ("high",)
+HOT_TAGS = ("personal_information", "instruction_for_ai")
+
+# 1回の全文検索に使うトライグラムの最大数
+_MAX_QUERY_TERMS = 64
+# インデックスの形式（変わったら作り直す）
+_SCHEMA_VERSION = 2
+
+
+class ColdIndex:
+  """
+  coldの層のメモリの全文検索インデックス（`<memory_file>.cold`、SQLiteのFTS5のtrigramトークナイザ）
+
+  メモリ上のn-gramインデックスの代わりに、hotの層の検索結果が足りない場合だけ候補の絞り込みに使う。
+  coldのメモリの内容はここに置き、メモリの表には残さない（content()で読み出す）。
+  全文検索は前処理した内容（text）に対して行い、3文字未満の語は全文検索では探せないのでtextを走査する。
+
+  hotに昇格したメモリは消さずに残しておく（降格し直すときに書き直さずに済む）。呼び出し側は
+  coldのメモリだけを結果に使う。内容が変わったメモリと削除されたメモリは必ず取り除く（remove）。
+  変更はメモリ上に溜めてflush()でまとめて書き込み、検索では書き込まずにメモリ上の変更と突き合わせる。
+  インデックスはメモリから作り直せるので、読み込み時にreconcile()で表と突き合わせる。
+  """
+
+  def __init__(self, path: Path):
+    self.path = path
+    self._conn: Optional[sqlite3.Connection] = None
+    # キー -> 書き込む内容（Noneは削除）
+    self._pending: dict[str, Optional[str]] = {}
+
+  def _connection(self) -> sqlite3.Connection:
+    if self._conn is None:
+      self.path.parent.mkdir(parents=True, exist_ok=True)
+      # 呼び出し側のロックで排他するので、ツールのスレッドとタイマースレッドのどちらからでも使えるようにする
+      conn = sqlite3.connect(self.path, check_same_thread=False)
+      conn.execute("PRAGMA journal_mode=WAL")
+      conn.execute("PRAGMA synchronous=NORMAL")
+      # インデックスはメモリから作り直せるので、古い形式のものは捨てる（reconcile()で作り直す）
+      if conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+        with conn:
+          conn.execute("DROP TABLE IF EXISTS docs_fts")
+          conn.execute("DROP TABLE IF EXISTS docs")
+          conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+      conn.execute(
+        "CREATE TABLE IF NOT EXISTS docs"
+        " (id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, crc INTEGER, content TEXT NOT NULL, text TEXT NOT NULL)"
+      )
+      # 全文検索の索引だけを持ち、textはdocsから読む（外部コンテンツテーブル）
+      conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(text, content='docs', content_rowid='id', tokenize='trigram')"
+      )
+      self._conn = conn
+    return self._conn
+
+  def put(self, key: str, content: str) -> None:
+    self._pending[key] = content
+
+  def remove(self, key: str) -> None:
+    self._pending[key] = None
+
+  def flush(self) -> None:
+    """溜まっている変更を1つのトランザクションで書き込む（同じ内容が既にあるものは書き直さない）"""
+    if not self._pending:
+      return
+    conn = self._connection()
+    with conn:
+      for key, content in self._pending.items():
+        row = conn.execute("SELECT id, crc, text FROM docs WHERE key = ?", (key,)).fetchone()
+        crc = _crc(content) if content is not None else None
+        if row is not None:
+          if row[1] == crc:
+            continue
+          conn.execute("INSERT INTO docs_fts (docs_fts, rowid, text) VALUES ('delete', ?, ?)", (row[0], row[2]))
+          conn.execute("DELETE FROM docs WHERE id = ?", (row[0],))
+        if content is not None:
+          text = utils.default_process(content)
+          doc_id = conn.execute(
+            "INSERT INTO docs (key, crc, content, text) VALUES (?, ?, ?, ?)", (key, crc, content, text)
+          ).lastrowid
+          conn.execute("INSERT INTO docs_fts (rowid, text) VALUES (?, ?)", (doc_id, text))
+    self._pending.clear()
+
+  def content(self, key: str) -> Optional[str]:
+    """coldのメモリの内容（ないキーはNone）"""
+    if key in self._pending:
+      return self._pending[key]
+    row = self._connection().execute("SELECT content FROM docs WHERE key = ?", (key,)).fetchone()
+    return row[0] if row is not None else None
+
+  def reconcile(self, cold_items: Iterable[tuple[str, str]], content_of: Callable[[str], Optional[str]]) -> None:
+    """
+    インデックスを現在のメモリに合わせる（読み込み時用）
+
+    cold_itemsはcoldの層のメモリの (キー, 内容)、content_ofはキーから現在の内容を返す関数（ないキーはNone）。
+    """
+    existing = dict(self._connection().execute("SELECT key, crc FROM docs"))
+    for key, crc in existing.items():
+      content = content_of(key)
+      if content is None or _crc(content) != crc:
+        self._pending[key] = None
+    for key, content in cold_items:
+      if existing.get(key) != _crc(content):
+        self._pending[key] = content
+    self.flush()
+
+  def search(self, query: str, size: int) -> list[str]:
+    """
+    クエリのトライグラムを多く含む順に最大size件のキーを返す
+
+    3文字未満の語（トライグラムがない）は、前処理した内容に部分文字列として含むものを後に続ける。
+    まだ書き込んでいない変更はインデックスに書き込まず、メモリ上の内容で突き合わせて先に並べる
+    （インデックスにある古い内容は結果から除く）。
+    """
+    processed = utils.default_process(query)
+    grams = sorted(char_ngrams(processed, sizes=(3,)))[:_MAX_QUERY_TERMS]
+    short_words = [word for word in processed.split() if len(word) < 3]
+    terms = grams + short_words
+    keys: dict[str, None] = {}
+    for key, content in self._pending.items():
+      if content is not None and any(term in utils.default_process(content) for term in terms):
+        keys[key] = None
+        if len(keys) >= size:
+          return list(keys)
+
+    # 書き込み待ちのキーはインデックスの結果から除くので、その分だけ多めに取得する
+    limit = size + len(self._pending)
+    conn = self._connection()
+    if grams:
+      expression = " OR ".join('"' + gram.replace('"', '""') + '"' for gram in grams)
+      rows = conn.execute(
+        "SELECT docs.key FROM docs_fts JOIN docs ON docs.id = docs_fts.rowid"
+        " WHERE docs_fts MATCH ? ORDER BY docs_fts.rank LIMIT ?",
+        (expression, limit),
+      )
+      keys.update((key, None) for (key,) in rows if key not in self._pending)
+    if short_words and len(keys) < size:
+      # trigramトークナイザの表に対するLIKEは3文字未満の非ASCIIの語を探せないので、docsのtextを走査する
+      condition = " OR ".join("instr(text, ?) > 0" for _ in short_words)
+      rows = conn.execute(f"SELECT key FROM docs WHERE {condition} LIMIT ?", (*short_words, limit))
+      for (key,) in rows:
+        if key not in self._pending:
+          keys.setdefault(key, None)
+        if len(keys) >= size:
+          break
+    return list(keys)[:size]
+
+  def close(self) -> None:
+    if self._conn is not None:
+      self.flush()
+      self._conn.close()
+      self._conn = None
+
+
+def _crc(content: str) -> int:
+  return zlib.crc32(content.encode("utf-8"))
@@ -0,0 +1,131 @@
+import math
+from array import array
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+from rapidfuzz import utils
+
+# ベクトル検索の結果に使うコサイン類似度の下限（これ未満は、ありふれた1文字を共有するだけの偶然の一致とみなす）
+MIN_SIMILARITY = 0.15
+
+
+def ngram_weights(text: str, sizes: tuple[int, ...] = (1, 2)) -> dict[str, float]:
+  """文字n-gram -> 重み のスパースなベクトル（出現回数をlogで抑えたTFを長さ1に正規化したもの）"""
+  counts: Counter[str] = Counter()
+  for word in utils.default_process(text).split():
+    for n in sizes:
+      counts.update(word[i : i + n] for i in range(len(word) - n + 1))
+  # 出現回数はlogで抑える（sublinear tf）
+  weights = {gram: 1.0 + math.log(count) for gram, count in counts.items()}
+  norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+  return {gram: weight / norm for gram, weight in weights.items()} if norm > 0 else {}
+
+
+class VectorIndex:
+  """
+  ネットワークを使わない決定的な埋め込みによるベクトル検索
+
+  メモリの内容を文字n-gramをそのまま次元とするスパースなベクトル（TF）にして、n-gram -> (内部ID, 重み) の
+  転置インデックスで保持する（ハッシュで次元をまとめないので、共有しないn-gramが衝突して類似度を持つことはない）。
+  クエリ側にIDFの重みをかけ、クエリのn-gramの列だけを合算して全メモリとのコサイン類似度を計算する。
+
+  NgramIndexと同じく、更新・削除されたメモリの内部IDは無効にするだけで列からは取り除かず、
+  無効なIDが増えたら列を詰め直す。類似度の配列の添字は内部ID（rows_ofで変換する）で、無効なIDの類似度は0になる。
+  """
+
+  def __init__(self):
+    # n-gram -> 内部IDの列と重みの列
+    self._ids: dict[str, array] = {}
+    self._weights: dict[str, array] = {}
+    # 内部ID -> キー（無効になったIDはNone）
+    self._keys: list[Optional[str]] = []
+    self._rows: dict[str, int] = {}
+    self._alive = bytearray()
+
+  def __len__(self) -> int:
+    return len(self._rows)
+
+  def __contains__(self, key: object) -> bool:
+    return key in self._rows
+
+  def set(self, key: str, content: str) -> None:
+    self.remove(key)
+    row = len(self._keys)
+    self._keys.append(key)
+    self._rows[key] = row
+    self._alive.append(1)
+    for gram, weight in ngram_weights(content).items():
+      ids = self._ids.get(gram)
+      if ids is None:
+        ids = self._ids[gram] = array("I")
+        self._weights[gram] = array("f")
+      ids.append(row)
+      self._weights[gram].append(weight)
+
+  def remove(self, key: str) -> None:
+    row = self._rows.pop(key, None)
+    if row is None:
+      return
+    self._keys[row] = None
+    self._alive[row] = 0
+    if len(self._keys) > 1024 and len(self._rows) * 2 < len(self._keys):
+      self._compact()
+
+  def _compact(self) -> None:
+    """無効になったIDを取り除いて内部IDを振り直す"""
+    alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+    new_ids = np.cumsum(alive, dtype=np.int64) - 1
+    for gram in list(self._ids):
+      ids = np.frombuffer(self._ids[gram], dtype=np.uint32)
+      keep = alive[ids]
+      if not keep.any():
+        del self._ids[gram], self._weights[gram]
+        continue
+      self._ids[gram] = array("I", new_ids[ids[keep]].astype(np.uint32).tobytes())
+      self._weights[gram] = array("f", np.frombuffer(self._weights[gram], dtype=np.float32)[keep].tobytes())
+    self._keys = [key for key in self._keys if key is not None]
+    self._rows = {key: row for row, key in enumerate(self._keys)}
+    self._alive = bytearray(b"\x01" * len(self._keys))
+
+  def clear(self) -> None:
+    self._ids.clear()
+    self._weights.clear()
+    self._keys.clear()
+    self._rows.clear()
+    self._alive.clear()
+
+  def query_vector(self, query: str) -> dict[str, float]:
+    """
+    クエリのTFベクトルにIDFの重みをかけて正規化する（インデックスにないn-gramは類似度に寄与しないので除く）
+
+    文書頻度には列の長さを使う（無効になったIDも詰め直すまでは数える）。
+    """
+    n = len(self._rows)
+    vector = {
+      gram: weight * (math.log((1 + n) / (1 + len(self._ids[gram]))) + 1.0)
+      for gram, weight in ngram_weights(query).items()
+      if gram in self._ids
+    }
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {gram: weight / norm for gram, weight in vector.items()} if norm > 0 else {}
+
+  def similarities(self, query: str) -> np.ndarray:
+    """全メモリとのコサイン類似度（添字は内部ID。クエリのn-gramの列だけを1回のbincountで合算する）"""
+    vector = self.query_vector(query)
+    if not vector:
+      return np.zeros(len(self._keys), dtype=np.float32)
+    ids = np.concatenate([np.frombuffer(self._ids[gram], dtype=np.uint32) for gram in vector])
+    weights = np.concatenate([np.frombuffer(self._weights[gram], dtype=np.float32) * w for gram, w in vector.items()])
+    scores = np.bincount(ids, weights=weights, minlength=len(self._keys)).astype(np.float32)
+    scores *= np.frombuffer(self._alive, dtype=np.uint8)
+    return scores
+
+  @property
+  def keys(self) -> list[Optional[str]]:
+    """内部ID -> キー（similaritiesの添字に対応する。無効になったIDはNone）"""
+    return self._keys
+
+  def rows_of(self, keys: list[str]) -> np.ndarray:
+    """キーに対応する内部ID（similaritiesの添字）"""
+    return np.fromiter((self._rows[key] for key in keys), dtype=np.int64, count=len(keys))
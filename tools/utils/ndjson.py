@@ -0,0 +1,41 @@
+import json
+from typing import IO, Callable, Iterable, Iterator, Optional
+
+# エクスポート・インポートの進捗を報告する間隔（件数）とまとめて書き込む件数の既定値
+TRANSFER_BATCH_SIZE = 1000
+
+# 進捗の報告先（それまでに処理した件数を受け取る）
+Progress = Callable[[int], None]
+
+
+def write_records(
+  f: IO[str], records: Iterable[dict], progress: Optional[Progress] = None, every: int = TRANSFER_BATCH_SIZE
+) -> int:
+  """レコードを1行1件のJSON（NDJSON）で書き出し、書き出した件数を返す（every件ごとと最後に進捗を報告する）"""
+  count = 0
+  for record in records:
+    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    count += 1
+    if progress is not None and count % every == 0:
+      progress(count)
+  if progress is not None and count % every != 0:
+    progress(count)
+  return count
+
+
+def read_records(f: IO[str]) -> Iterator[tuple[int, Optional[dict]]]:
+  """
+  NDJSONを1行ずつ読み、(行番号, レコード) を返す
+
+  全体を読み込まないので、ファイルの大きさによらず使うメモリは1行分で済む。
+  空行は飛ばし、JSONとして読めない行やオブジェクトでない行はレコードをNoneにする。
+  """
+  for number, line in enumerate(f, start=1):
+    if not line.strip():
+      continue
+    try:
+      record = json.loads(line)
+    except json.JSONDecodeError:
+      yield number, None
+      continue
+    yield number, record if isinstance(record, dict) else None
@@ -0,0 +1,60 @@
+import base64
+import binascii
+import json
+from typing import Any, Iterable, Optional, Sequence
+
+# 一覧のページング
+#   一覧は (並び順の値のタプル, キー) の順に並べる。値は小さい順、値が同じものはキーの大きい順（新しい順）にする。
+#   カーソルは前のページの最後の項目の (並び順の名前, 値, キー) をエンコードしたもので、
+#   次のページはその項目より後ろの項目から始まる（ページの間に追加・削除があっても重複や抜けが起きない）。
+
+SortValues = tuple[int, ...]
+
+
+def encode_cursor(order_by: str, values: Sequence[int], key: str) -> str:
+  """ページの最後の項目から次のページのカーソルを作る"""
+  payload = json.dumps({"o": order_by, "v": [int(value) for value in values], "k": key}, separators=(",", ":"))
+  return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, order_by: str) -> tuple[SortValues, str]:
+  """カーソルを (並び順の値, キー) に戻す（不正なカーソルや並び順が異なるカーソルの場合はValueError）"""
+  try:
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    cursor_order_by, values, key = payload["o"], payload["v"], payload["k"]
+  except (binascii.Error, UnicodeError, json.JSONDecodeError, KeyError, TypeError) as e:
+    raise ValueError(f"Invalid cursor: {cursor}") from e
+  if cursor_order_by != order_by:
+    raise ValueError(f"Cursor was issued for order_by={cursor_order_by}, not {order_by}")
+  return tuple(int(value) for value in values), str(key)
+
+
+def is_after(values: SortValues, key: str, cursor_values: SortValues, cursor_key: str) -> bool:
+  """(values, key) の項目がカーソルの項目より後ろに並ぶかどうか"""
+  return values > cursor_values or (values == cursor_values and key < cursor_key)
+
+
+def sort_page(
+  items: Iterable[tuple[SortValues, str]], limit: int, after: Optional[tuple[SortValues, str]] = None
+) -> list[tuple[SortValues, str]]:
+  """(並び順の値, キー) の列を並べ、カーソルより後ろの先頭limit件を返す"""
+  if after is not None:
+    items = [item for item in items if is_after(item[0], item[1], *after)]
+  # 値は小さい順、値が同じものはキーの大きい順（安定ソートを2回行う）
+  ordered = sorted(items, key=lambda item: item[1], reverse=True)
+  ordered.sort(key=lambda item: item[0])
+  return ordered[:limit]
+
+
+def project(
+  entry: dict[str, Any], fields: Optional[Iterable[str]] = None, preview_chars: Optional[int] = None
+) -> dict[str, Any]:
+  """
+  一覧の項目を必要なフィールドだけに絞る
+
+  fieldsを省略した場合は全てのフィールドを返す。preview_charsを指定した場合、contentをその文字数までに切り詰める。
+  """
+  entry = {name: entry[name] for name in fields if name in entry} if fields is not None else dict(entry)
+  if preview_chars is not None and "content" in entry and len(entry["content"]) > preview_chars:
+    entry["content"] = entry["content"][:preview_chars] + "…"
+  return entry
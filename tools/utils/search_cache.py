@@ -0,0 +1,56 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from rapidfuzz import utils
+
+
+def normalize_query(query: str) -> str:
+  """
+  キャッシュのキーにするクエリの正規化
+
+  検索の各段階（n-gram・ファジー検索・ベクトル）と同じ前処理なので、正規化後が同じクエリは検索結果も同じになる。
+  """
+  return utils.default_process(query)
+
+
+class SearchCache:
+  """
+  検索結果のLRUキャッシュ
+
+  キーには表のバージョンを含めて使う（メモリが変更されると古いバージョンのキーには二度と当たらず、
+  使われないまま古い順に追い出される）。capacityが0の場合はキャッシュしない。
+  ヒット・ミスの回数を数え、info()で容量の調整に使えるようにする。
+  """
+
+  def __init__(self, capacity: int = 256):
+    self.capacity = capacity
+    self.hits = 0
+    self.misses = 0
+    self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def get(self, key: Hashable) -> Optional[Any]:
+    value = self._entries.get(key)
+    if value is None:
+      self.misses += 1
+      return None
+    self._entries.move_to_end(key)
+    self.hits += 1
+    return value
+
+  def put(self, key: Hashable, value: Any) -> None:
+    if self.capacity <= 0:
+      return
+    self._entries[key] = value
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.capacity:
+      self._entries.popitem(last=False)
+
+  def clear(self) -> None:
+    self._entries.clear()
+
+  def info(self) -> dict[str, int]:
+    """ヒット・ミスの回数と現在の件数・容量"""
+    return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "capacity": self.capacity}
@@ -0,0 +1,34 @@
+import asyncio
+import sys
+from typing import Callable, Optional
+
+
+class DebouncedFlusher:
+  """
+  MCPツールのハンドラから変更の印を受け取り、delay秒ごとにまとめて書き込むasyncioのタスク
+
+  最初の変更からdelay秒後にflushを1回だけ呼ぶ（その間の変更は同じ書き込みにまとめられる）。
+  flushはファイルへの書き込みを行うため、イベントループを止めないようにスレッドで実行する。
+  終了時に書き込まれていない変更は、flushを呼ぶ側（atexitで呼ばれるclose）が書き込む。
+  """
+
+  def __init__(self, flush: Callable[[], None], delay: float = 0.2):
+    self.flush = flush
+    self.delay = delay
+    self._task: Optional[asyncio.Task] = None
+
+  def mark_dirty(self) -> None:
+    """変更があったことを知らせる（イベントループの中から呼ぶ）"""
+    if self._task is None:
+      self._task = asyncio.get_running_loop().create_task(self._flush_later())
+
+  async def _flush_later(self) -> None:
+    await asyncio.sleep(self.delay)
+    # 書き込み中の変更は次の書き込みにまとめられるよう、書き込みの前にタスクを外す
+    self._task = None
+    try:
+      await asyncio.to_thread(self.flush)
+    except Exception as e:
+      # 書き込めなかった変更は書き込み待ちのまま残り、次の書き込みか終了時に書き込まれる
+      # （標準出力はMCPのstdio通信に使われているため標準エラー出力に出す）
+      print(f"Warning: Failed to flush pending writes: {e}", file=sys.stderr)